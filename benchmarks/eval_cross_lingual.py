@@ -0,0 +1,193 @@
+"""
+So sánh chế độ cross-lingual (truy xuất bằng câu hỏi gốc, trả lời bằng ngôn ngữ của người dùng
+trong cùng lời gọi RAG) với luồng dịch hai đầu hiện tại của iSTQB_ChatBot.py (dịch câu hỏi sang
+tiếng Anh, trả lời, dịch ngược): cùng bộ câu hỏi tiếng Việt, mỗi chế độ một Chatbot với cache lạnh.
+
+    python benchmarks/eval_cross_lingual.py                    # OpenAI/Supabase thật (.env)
+    python benchmarks/eval_cross_lingual.py --fake             # dịch vụ giả lập, không cần mạng
+    python benchmarks/eval_cross_lingual.py --questions questions.txt --output .cache/benchmarks/cross_lingual.json
+
+Chỉ số: tỉ lệ hai chế độ đi cùng nhánh (giáo trình/dự phòng), độ trùng trang nguồn, độ tương đồng
+embedding giữa hai câu trả lời (text-embedding-3-small đa ngôn ngữ), tỉ lệ đồng thuận, thời gian
+p50/p95 và số lời gọi LLM/token mỗi lượt. Không ghi tri thức mới (Chatbot(learn=False)).
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from contextlib import ExitStack
+from datetime import datetime, timezone
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+from benchmarks.fake_services import FakeOpenAI, FakeSupabase, ServiceThread
+from benchmarks.run_benchmarks import SCENARIOS, TRANSLATIONS, configure_environment, git_revision, summarize
+
+# Câu hỏi mặc định: các kịch bản tiếng Việt của benchmark và một số câu thường gặp về giáo trình
+EVAL_QUESTIONS = SCENARIOS["vi_syllabus"] + SCENARIOS["vi_fallback"] + [
+    "Kiểm thử hộp trắng khác kiểm thử hộp đen như thế nào?",
+    "Bảy nguyên tắc kiểm thử là gì?",
+    "Kiểm thử hồi quy là gì và khi nào cần thực hiện?",
+    "Mục tiêu của kiểm thử chấp nhận là gì?",
+    "Sự khác nhau giữa lỗi, khiếm khuyết và thất bại là gì?",
+]
+MODES = ("translate", "cross_lingual")
+# Các bước có gọi LLM chat (theo telemetry của lượt hỏi)
+LLM_STAGES = ("translate", "rag_llm", "fallback_llm")
+
+
+def load_questions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def run_question(bots, runtime, question, order):
+    """Hỏi cùng một câu ở từng chế độ; trả về {chế độ: kết quả lượt hỏi kèm thời gian, nhánh, số lời gọi LLM}."""
+    from src.pipeline import aanswer_turn
+    from src.telemetry import telemetry
+
+    rows = {}
+    for mode in order:
+        result = runtime.run(aanswer_turn(bots[mode], question))
+        turn = next(turn for turn in telemetry.recent_turns() if turn["trace_id"] == result["trace_id"])
+        rows[mode] = {
+            "answer": result["answer"],
+            "sources": sorted({f"{source.get('source')}#{source.get('page')}" for source in result["sources"]}),
+            "path": turn.get("path"),
+            "seconds": turn["duration"],
+            "llm_calls": sum(1 for stage in turn["stages"] if stage["stage"] in LLM_STAGES),
+            "tokens": turn["tokens"].get("prompt", 0) + turn["tokens"].get("completion", 0),
+        }
+    return rows
+
+
+def jaccard(a, b):
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def answer_similarity(rows):
+    """Cosine giữa embedding của hai câu trả lời cho từng câu hỏi (một lời gọi embedding cho cả bộ)."""
+    from src.clients import create_embeddings
+
+    texts = [row[mode]["answer"] for row in rows for mode in MODES]
+    vectors = np.asarray(create_embeddings(model="text-embedding-3-small").embed_documents(texts), dtype=float)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return [float(vectors[2 * i] @ vectors[2 * i + 1]) for i in range(len(rows))]
+
+
+def evaluate(questions, threshold):
+    from src import language_utils
+    from src.chatbot import Chatbot
+    from src.pipeline import EventLoopThread
+    from src.translation_memory import TranslationMemory
+
+    # Bộ nhớ dịch trống để luồng dịch hai đầu được đo đúng như lần hỏi đầu tiên
+    language_utils._translation_memory = TranslationMemory(":memory:")
+    bots = {mode: Chatbot(cross_lingual=mode == "cross_lingual", learn=False) for mode in MODES}
+    runtime = EventLoopThread()
+
+    rows = []
+    for i, question in enumerate(questions):
+        # Đổi thứ tự chạy giữa các câu để connection/cache dùng chung không thiên vị chế độ nào
+        order = MODES if i % 2 == 0 else MODES[::-1]
+        rows.append(run_question(bots, runtime, question, order))
+
+    details = []
+    for question, row, similarity in zip(questions, rows, answer_similarity(rows)):
+        same_path = row["translate"]["path"] == row["cross_lingual"]["path"]
+        details.append({
+            "question": question,
+            **row,
+            "same_path": same_path,
+            "source_overlap": round(jaccard(row["translate"]["sources"], row["cross_lingual"]["sources"]), 3),
+            "answer_similarity": round(similarity, 4),
+            "agree": same_path and similarity >= threshold,
+        })
+        print(f"  {'✓' if details[-1]['agree'] else '✗'} {question[:50]:<50} "
+              f"{row['translate']['path']}/{row['cross_lingual']['path']} sim={similarity:.3f} "
+              f"{row['translate']['seconds']:.2f}s -> {row['cross_lingual']['seconds']:.2f}s")
+
+    for bot in bots.values():
+        bot.learning_queue.close()
+
+    count = len(details)
+    summary = {
+        "questions": count,
+        "agreement_rate": round(sum(d["agree"] for d in details) / count, 3),
+        "path_agreement": round(sum(d["same_path"] for d in details) / count, 3),
+        "mean_source_overlap": round(sum(d["source_overlap"] for d in details) / count, 3),
+        "mean_answer_similarity": round(sum(d["answer_similarity"] for d in details) / count, 4),
+    }
+    for mode in MODES:
+        summary[mode] = {
+            "seconds": summarize([d[mode]["seconds"] for d in details]),
+            "llm_calls_per_turn": round(sum(d[mode]["llm_calls"] for d in details) / count, 3),
+            "tokens_per_turn": round(sum(d[mode]["tokens"] for d in details) / count, 1),
+        }
+    summary["speedup_p50"] = round(summary["translate"]["seconds"]["p50"]
+                                   / max(summary["cross_lingual"]["seconds"]["p50"], 1e-9), 3)
+    return summary, details
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="So sánh chế độ cross-lingual với luồng dịch hai đầu.")
+    parser.add_argument("--questions", default=None, help="File câu hỏi (mỗi dòng một câu, # là chú thích)")
+    parser.add_argument("--threshold", type=float, default=0.85,
+                        help="Độ tương đồng tối thiểu để coi hai câu trả lời là đồng thuận")
+    parser.add_argument("--fake", action="store_true", help="Chạy trên OpenAI/Supabase giả lập (benchmarks/fake_services.py)")
+    parser.add_argument("--data-path", default=os.path.join(ROOT, "data"), help="Tài liệu ingest khi dùng --fake")
+    parser.add_argument("--chat-latency", type=float, default=0.2, help="Độ trễ mỗi lần gọi chat khi dùng --fake")
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--output", default=None, help="File JSON kết quả")
+    args = parser.parse_args(argv)
+
+    if args.questions:
+        questions = load_questions(args.questions)
+    else:
+        # Dịch vụ giả chỉ "hiểu" các câu có trong bảng dịch của benchmark
+        questions = [q for q in EVAL_QUESTIONS if q in TRANSLATIONS] if args.fake else EVAL_QUESTIONS
+
+    with ExitStack() as stack:
+        if args.fake:
+            fake_openai = FakeOpenAI(latency=args.chat_latency, token_latency=args.token_latency,
+                                     translations=TRANSLATIONS)
+            fake_supabase = FakeSupabase()
+            stack.enter_context(ServiceThread(fake_openai, fake_supabase))
+            configure_environment(fake_openai.url, fake_supabase.url,
+                                  stack.enter_context(tempfile.TemporaryDirectory()))
+            import ingest_data  # đọc biến môi trường lúc import: sau configure_environment
+            ingest_data.create_vector_db(backend="supabase", data_path=args.data_path)
+
+        print(f"So sánh {len(questions)} câu hỏi (dịch hai đầu -> cross-lingual)...")
+        summary, details = evaluate(questions, args.threshold)
+
+    for mode in MODES:
+        stats = summary[mode]
+        print(f"  {mode:<13} p50={stats['seconds']['p50']:.3f}s p95={stats['seconds']['p95']:.3f}s "
+              f"LLM={stats['llm_calls_per_turn']}/lượt token={stats['tokens_per_turn']}/lượt")
+    print(f"  Đồng thuận {summary['agreement_rate']:.0%} (cùng nhánh {summary['path_agreement']:.0%}, "
+          f"tương đồng TB {summary['mean_answer_similarity']:.3f}), nhanh hơn x{summary['speedup_p50']}")
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "summary": summary,
+        "details": details,
+    }
+    output = args.output or os.path.join(
+        ROOT, ".cache", "benchmarks", f"cross_lingual-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Đã ghi kết quả vào {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,672 @@
+"""
+Các dịch vụ giả lập chạy cục bộ cho bộ benchmark: OpenAI (chat, stream SSE, embeddings)
+và Supabase (PostgREST: bảng + RPC match_documents).
+Phản hồi hoàn toàn xác định; độ trễ, độ dao động và giới hạn tốc độ (429) có thể cấu hình.
+"""
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+import numpy as np
+from aiohttp import web
+
+EMBEDDING_DIM = 1536
+
+_WORD = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how in is it its of on or that the this to "
+    "was what when where which who why with explain define describe".split()
+)
+_TRANSLATE_PROMPT = re.compile(r"^Translate the following text to (.+?): '(.*)'$", re.S)
+_GENERAL_PROMPT = re.compile(r"^Answer the following question concisely[^:]*: (.*)$", re.S)
+_NOT_FOUND_PHRASE = re.compile(r"reply with exactly th(?:is|e) (?:phrase|token):? '([^']+)'")
+_ARROW = re.compile(r"(->>|->)")
+
+
+def _terms(text):
+    return [t for t in _WORD.findall((text or "").lower()) if len(t) > 1 and t not in _STOPWORDS]
+
+
+def fake_embedding(text, dim=EMBEDDING_DIM):
+    """Embedding xác định kiểu bag-of-words băm: văn bản chung nhiều thuật ngữ thì cosine cao."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for term, tf in Counter(_terms(text)).items():
+        value = int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+        vector[value % dim] += (1.0 if value >> 63 else -1.0) * (1.0 + math.log(tf))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class _RateLimit:
+    """Cửa sổ trượt 60 giây: vượt quá requests_per_minute thì trả về số giây cần chờ."""
+
+    def __init__(self, requests_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self._window = deque()
+
+    def retry_after(self):
+        if not self.requests_per_minute:
+            return 0.0
+        now = time.monotonic()
+        while self._window and now - self._window[0] >= 60:
+            self._window.popleft()
+        if len(self._window) >= self.requests_per_minute:
+            return max(60 - (now - self._window[0]), 0.001)
+        self._window.append(now)
+        return 0.0
+
+
+class _FakeService:
+    """Phần chung: thống kê theo route, giới hạn tốc độ và độ trễ có dao động (seed cố định)."""
+
+    def __init__(self, requests_per_minute=None, jitter=0.0, seed=0):
+        self.jitter = jitter
+        self.url = None
+        self._random = random.Random(seed)
+        self._limiter = _RateLimit(requests_per_minute)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._stats = {"requests": Counter(), "rate_limited": 0, "response_bytes": 0, "tokens": Counter()}
+
+    def stats(self):
+        return {
+            "requests": dict(self._stats["requests"]),
+            "total_requests": sum(self._stats["requests"].values()),
+            "rate_limited": self._stats["rate_limited"],
+            "response_bytes": self._stats["response_bytes"],
+            "tokens": dict(self._stats["tokens"]),
+        }
+
+    async def _delay(self, seconds):
+        if seconds > 0:
+            await asyncio.sleep(seconds * (1 + self.jitter * self._random.uniform(-1, 1)))
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        self._stats["requests"][f"{request.method} {request.path}"] += 1
+        retry_after = self._limiter.retry_after()
+        if retry_after:
+            self._stats["rate_limited"] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+                status=429, headers={"Retry-After": f"{retry_after:.3f}"},
+            )
+        response = await handler(request)
+        if isinstance(response, web.Response) and response.body is not None:
+            self._stats["response_bytes"] += len(response.body)
+        return response
+
+    def app(self):
+        app = web.Application(middlewares=[self._middleware], client_max_size=64 * 1024 * 1024)
+        self._add_routes(app)
+        return app
+
+    def _add_routes(self, app):
+        raise NotImplementedError
+
+
+class FakeOpenAI(_FakeService):
+    """
+    Giả lập /v1/chat/completions (thường và stream SSE) và /v1/embeddings.
+    - Prompt dịch: tra bảng `translations`, không có thì trả về "[ngôn ngữ] văn bản".
+    - Prompt RAG: trả lời bằng các câu trong context chứa thuật ngữ của câu hỏi,
+      không có thì trả về đúng cụm "không tìm thấy" mà prompt yêu cầu (đứng sau câu dẫn
+      `not_found_lead_ins[câu hỏi]` nếu có, giống LLM không làm đúng hoàn toàn yêu cầu).
+    - Prompt chung: một câu trả lời cố định dựa trên câu hỏi.
+    - Giả lập mô hình đa ngôn ngữ: văn bản có trong `translations` được embed và hiểu như bản tiếng Anh,
+      câu trả lời cho câu hỏi gốc đó có dạng "[answer_language] câu trả lời tiếng Anh" (giống kết quả dịch).
+    """
+
+    def __init__(self, latency=0.2, token_latency=0.005, embedding_latency=0.05, requests_per_minute=None,
+                 jitter=0.0, seed=0, translations=None, dim=EMBEDDING_DIM, answer_language="Vietnamese",
+                 not_found_lead_ins=None):
+        super().__init__(requests_per_minute, jitter, seed)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.embedding_latency = embedding_latency
+        self.translations = dict(translations or {})
+        self.answer_language = answer_language
+        self.not_found_lead_ins = dict(not_found_lead_ins or {})
+        self.dim = dim
+        self._encoding = None
+
+    def _add_routes(self, app):
+        app.router.add_post("/v1/chat/completions", self._chat_completions)
+        app.router.add_post("/v1/embeddings", self._embeddings)
+
+    # --- Nội dung trả lời ---
+    def complete(self, prompt):
+        match = _TRANSLATE_PROMPT.match(prompt)
+        if match:
+            language, text = match.groups()
+            return self.translations.get(text, f"[{language}] {text}")
+        if "Context:" in prompt and "Question:" in prompt:
+            question = prompt.split("Question:", 1)[1].split("Helpful Answer:", 1)[0].strip()
+            answer = self._answer_from_context(prompt, self.translations.get(question, question))
+            match = _NOT_FOUND_PHRASE.search(prompt)
+            if match and answer == match.group(1):
+                return self.not_found_lead_ins.get(question, "") + answer
+            return self._in_question_language(question, answer)
+        match = _GENERAL_PROMPT.match(prompt)
+        question = match.group(1).strip() if match else prompt.strip()
+        english = self.translations.get(question, question)
+        return self._in_question_language(question, (
+            f"In short, regarding \"{english}\": this is a general-knowledge answer generated "
+            f"without the syllabus, kept concise and factual for the user."))
+
+    def _in_question_language(self, question, answer):
+        """Câu hỏi gốc (không phải tiếng Anh) được trả lời bằng ngôn ngữ của nó, như bản dịch giả lập."""
+        if question not in self.translations:
+            return answer
+        return self.translations.get(answer, f"[{self.answer_language}] {answer}")
+
+    @staticmethod
+    def _answer_from_context(prompt, question):
+        context = prompt.split("Context:", 1)[1].split("Question:", 1)[0]
+        match = _NOT_FOUND_PHRASE.search(prompt)
+        not_found = match.group(1) if match else "I don't know."
+
+        terms = set(_terms(question))
+        sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+|\n+", context) if s.strip()]
+        scored = [(len(terms & set(_terms(s))), i, s) for i, s in enumerate(sentences)]
+        best = sorted((item for item in scored if item[0]), key=lambda item: (-item[0], item[1]))[:3]
+        if not terms or not best or best[0][0] < (len(terms) + 1) // 2:
+            return not_found
+        return " ".join(s for _, _, s in sorted(best, key=lambda item: item[1]))
+
+    # --- Handlers ---
+    async def _chat_completions(self, request):
+        body = await request.json()
+        content = body["messages"][-1]["content"]
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content)
+        answer = self.complete(content)
+        usage = {"prompt_tokens": _count_tokens(content), "completion_tokens": _count_tokens(answer)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        self._stats["tokens"]["prompt"] += usage["prompt_tokens"]
+        self._stats["tokens"]["completion"] += usage["completion_tokens"]
+
+        completion_id = "chatcmpl-" + hashlib.sha1(content.encode("utf-8")).hexdigest()[:24]
+        model = body.get("model", "gpt-3.5-turbo")
+        await self._delay(self.latency)
+
+        if not body.get("stream"):
+            await self._delay(self.token_latency * usage["completion_tokens"])
+            return web.json_response({
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer},
+                             "finish_reason": "stop", "logprobs": None}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        def event(delta, finish_reason=None, **extra):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason,
+                                                  "logprobs": None}], **extra}
+            return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+        await response.write(event({"role": "assistant", "content": ""}))
+        for piece in re.findall(r"\S+\s*|\s+", answer):
+            await self._delay(self.token_latency)
+            await response.write(event({"content": piece}))
+        await response.write(event({}, "stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage_chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                           "model": model, "choices": [], "usage": usage}
+            await response.write(f"data: {json.dumps(usage_chunk)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def _decode(self, item):
+        """
+        Input là chuỗi (EMBEDDING_CHECK_CTX_LENGTH=false, như configure_environment đặt) hoặc
+        danh sách token id tiktoken cl100k_base (mặc định của langchain).
+        """
+        if isinstance(item, str):
+            return item
+        if self._encoding is None:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding("cl100k_base")
+        return self._encoding.decode(item)
+
+    async def _embeddings(self, request):
+        body = await request.json()
+        inputs = body["input"]
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        texts = [self._decode(item) for item in inputs]
+        tokens = sum(_count_tokens(text) for text in texts)
+        self._stats["tokens"]["embedding"] += tokens
+        await self._delay(self.embedding_latency)
+
+        dim = body.get("dimensions") or self.dim
+        data = []
+        for index, text in enumerate(texts):
+            vector = fake_embedding(self.translations.get(text, text), dim)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        return web.json_response({
+            "object": "list", "data": data, "model": body.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+
+# --- PostgREST ---
+_RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+_OBJECT_MEDIA_TYPE = "application/vnd.pgrst.object+json"
+
+
+def _split_top_level(text):
+    """Tách theo dấu phẩy nằm ngoài ngoặc và ngoặc kép."""
+    parts, depth, quoted, current = [], 0, False, []
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            parts.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    if current:
+        parts.append("".join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _parse_logic(operator, text):
+    """Phân tích biểu thức and=(...)/or=(...) của PostgREST thành cây điều kiện."""
+    return (operator, [_parse_condition(part) for part in _split_top_level(text.strip()[1:-1])])
+
+
+def _parse_condition(part):
+    match = re.match(r"^(not\.)?(and|or)(\(.*\))$", part, re.S)
+    if match:
+        node = _parse_logic(match.group(2), match.group(3))
+        return ("not", node) if match.group(1) else node
+    column, _, expression = part.partition(".")
+    return ("filter", column, expression)
+
+
+def _column_value(row, column):
+    """Đọc giá trị cột, hỗ trợ đường dẫn JSON kiểu metadata->>status, metadata->'a'->>'b'."""
+    parts = _ARROW.split(re.sub(r"::\w+$", "", column))
+    value = row.get(parts[0].strip())
+    arrow = None
+    for arrow, key in zip(parts[1::2], parts[2::2]):
+        key = key.strip().strip("'\"")
+        if isinstance(value, dict):
+            value = value.get(key)
+        elif isinstance(value, list) and key.lstrip("-").isdigit() and -len(value) <= int(key) < len(value):
+            value = value[int(key)]
+        else:
+            value = None
+    if arrow == "->>" and value is not None and not isinstance(value, str):
+        value = json.dumps(value) if isinstance(value, (dict, list, bool)) else str(value)
+    return value
+
+
+def _output_name(column):
+    parts = _ARROW.split(re.sub(r"::\w+$", "", column))
+    return parts[-1].strip().strip("'\"")
+
+
+def _contains(value, expected):
+    """Ngữ nghĩa jsonb @>."""
+    if isinstance(expected, dict):
+        return isinstance(value, dict) and all(k in value and _contains(value[k], v) for k, v in expected.items())
+    if isinstance(expected, list):
+        return isinstance(value, list) and all(any(_contains(item, e) for item in value) for e in expected)
+    return value == expected
+
+
+def _compare(value, operator, raw):
+    if operator == "is":
+        if raw == "null":
+            return value is None
+        return value in ({True, "true"} if raw == "true" else {False, "false"})
+    if value is None:
+        return False
+    if operator == "in":
+        items = [item.strip('"') for item in _split_top_level(raw.strip()[1:-1])]
+        return _compare_scalar(value, items)
+    if operator in ("like", "ilike"):
+        pattern = "".join(".*" if c in "%*" else "." if c == "_" else re.escape(c) for c in raw)
+        return re.fullmatch(pattern, str(value), re.S | (re.I if operator == "ilike" else 0)) is not None
+    if operator == "cs":
+        return _contains(value, json.loads(raw))
+    comparisons = {
+        "eq": lambda a, b: a == b, "neq": lambda a, b: a != b,
+        "gt": lambda a, b: a > b, "gte": lambda a, b: a >= b,
+        "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b,
+    }
+    if operator not in comparisons:
+        raise web.HTTPBadRequest(text=json.dumps({"code": "PGRST100", "details": None, "hint": None,
+                                                  "message": f"unknown operator {operator}"}),
+                                 content_type="application/json")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return comparisons[operator](value, float(raw))
+        except ValueError:
+            pass
+    if isinstance(value, bool):
+        value = "true" if value else "false"
+    return comparisons[operator](str(value), raw)
+
+
+def _compare_scalar(value, items):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return any(item.lstrip("-").replace(".", "", 1).isdigit() and float(item) == value for item in items)
+    return str(value) in items
+
+
+def _evaluate(row, node):
+    kind = node[0]
+    if kind == "and":
+        return all(_evaluate(row, child) for child in node[1])
+    if kind == "or":
+        return any(_evaluate(row, child) for child in node[1])
+    if kind == "not":
+        return not _evaluate(row, node[1])
+    _, column, expression = node
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[4:]
+    operator, _, raw = expression.partition(".")
+    result = _compare(_column_value(row, column), operator, raw)
+    return not result if negate else result
+
+
+def _sort_key(value):
+    if value is None:
+        return (1, 0, "")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (0, 0, value)
+    return (0, 1, str(value))
+
+
+def _serialize(value):
+    if isinstance(value, np.ndarray):
+        # PostgREST trả cột vector dưới dạng chuỗi "[...]"
+        return "[" + ",".join(f"{x:.8g}" for x in value.tolist()) + "]"
+    return value
+
+
+class FakeSupabase(_FakeService):
+    """
+    Giả lập PostgREST của Supabase tại /rest/v1: đọc (lọc, order, limit/offset, count,
+    single), insert/upsert, update, delete trên các bảng trong bộ nhớ và gọi RPC.
+    RPC được đăng ký qua register_function; có sẵn match_documents, match_qa_pairs (cosine, lọc jsonb @>)
+    và set_qa_pairs_status.
+    """
+
+    def __init__(self, latency=0.02, requests_per_minute=None, jitter=0.0, seed=0):
+        super().__init__(requests_per_minute, jitter, seed)
+        self.latency = latency
+        self.tables = defaultdict(list)
+        self.functions = {
+            "match_documents": self.match_documents,
+            "match_qa_pairs": lambda params: self.match_documents(params, table="qa_pairs"),
+            "set_qa_pairs_status": self.set_qa_pairs_status,
+        }
+        self._lock = threading.Lock()
+        self._next_id = itertools.count(1)
+
+    def _add_routes(self, app):
+        app.router.add_route("POST", "/rest/v1/rpc/{function}", self._rpc)
+        app.router.add_route("GET", "/rest/v1/rpc/{function}", self._rpc)
+        for method in ("GET", "HEAD", "POST", "PATCH", "DELETE"):
+            app.router.add_route(method, "/rest/v1/{table}", self._table)
+
+    # --- Truy cập trực tiếp (nạp dữ liệu cho benchmark) ---
+    def register_function(self, name, function):
+        """function(service, params) -> danh sách dòng hoặc giá trị JSON."""
+        self.functions[name] = lambda params: function(self, params)
+
+    def insert_rows(self, table, rows):
+        with self._lock:
+            self.tables[table].extend(self._prepare(row) for row in rows)
+
+    def delete_where(self, table, predicate):
+        with self._lock:
+            before = len(self.tables[table])
+            self.tables[table] = [row for row in self.tables[table] if not predicate(row)]
+            return before - len(self.tables[table])
+
+    def rows(self, table):
+        with self._lock:
+            return list(self.tables[table])
+
+    def _prepare(self, row):
+        row = dict(row)
+        if row.get("id") is None:
+            row["id"] = next(self._next_id)
+        embedding = row.get("embedding")
+        if isinstance(embedding, str):
+            row["embedding"] = np.asarray(json.loads(embedding), dtype=np.float32)
+        elif embedding is not None:
+            row["embedding"] = np.asarray(embedding, dtype=np.float32)
+        return row
+
+    # --- RPC ---
+    def match_documents(self, params, table="documents"):
+        query = params["query_embedding"]
+        query = np.asarray(json.loads(query) if isinstance(query, str) else query, dtype=np.float32)
+        containment = params.get("filter") or {}
+        rows = [row for row in self.tables[table]
+                if row.get("embedding") is not None and _contains(row.get("metadata") or {}, containment)]
+        if not rows:
+            return []
+        matrix = np.vstack([row["embedding"] for row in rows])
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+        scores = (matrix @ query) / np.where(norms == 0, 1.0, norms)
+        order = np.argsort(-scores, kind="stable")
+        if params.get("match_count"):
+            order = order[:int(params["match_count"])]
+        return [{"id": rows[i]["id"], "content": rows[i].get("content"), "metadata": rows[i].get("metadata"),
+                 "similarity": float(scores[i])} for i in order]
+
+    def set_qa_pairs_status(self, params, table="qa_pairs"):
+        """Như set_qa_pairs_status trong sql/qa_pairs.sql: đổi metadata.status của nhiều dòng, trả về số dòng đã cập nhật."""
+        ids = {str(pair_id) for pair_id in params["pair_ids"]}
+        updated = 0
+        for row in self.tables[table]:
+            if str(row.get("id")) in ids:
+                row["metadata"] = {**(row.get("metadata") or {}), "status": params["new_status"]}
+                updated += 1
+        return updated
+
+    async def _rpc(self, request):
+        await self._delay(self.latency)
+        name = request.match_info["function"]
+        if name not in self.functions:
+            return web.json_response({"code": "PGRST202", "details": None, "hint": None,
+                                      "message": f"Could not find the function {name}"}, status=404)
+        params = await request.json() if request.method == "POST" and request.can_read_body else dict(request.query)
+        with self._lock:
+            result = self.functions[name](params)
+        if not isinstance(result, list):
+            return web.json_response(result)
+        return self._respond(request, *self._query(request, result))
+
+    # --- Bảng ---
+    async def _table(self, request):
+        await self._delay(self.latency)
+        name = request.match_info["table"]
+        handler = {"GET": self._select, "HEAD": self._select, "POST": self._insert,
+                   "PATCH": self._update, "DELETE": self._delete}[request.method]
+        body = await request.json() if request.method in ("POST", "PATCH") else None
+        with self._lock:
+            return handler(request, name, body)
+
+    def _select(self, request, table, body):
+        return self._respond(request, *self._query(request, self.tables[table]))
+
+    def _insert(self, request, table, body):
+        rows = [self._prepare(row) for row in (body if isinstance(body, list) else [body])]
+        resolution = self._prefer(request).get("resolution")
+        conflict = request.query.get("on_conflict", "id")
+        existing = {row.get(conflict): i for i, row in enumerate(self.tables[table])}
+        if resolution is None and any(row.get(conflict) in existing for row in rows):
+            return web.json_response({"code": "23505", "details": None, "hint": None,
+                                      "message": "duplicate key value violates unique constraint"}, status=409)
+        written = []
+        for row in rows:
+            key = row.get(conflict)
+            if key in existing:
+                if resolution == "ignore-duplicates":
+                    continue
+                merged = {**self.tables[table][existing[key]], **row}
+                self.tables[table][existing[key]] = merged
+                written.append(merged)
+            else:
+                existing[key] = len(self.tables[table])
+                self.tables[table].append(row)
+                written.append(row)
+        return self._respond(request, written, len(written), 0, status=201)
+
+    def _update(self, request, table, body):
+        updated = []
+        for i, row in enumerate(self.tables[table]):
+            if self._matches(row, request.query):
+                self.tables[table][i] = self._prepare({**row, **body})
+                updated.append(self.tables[table][i])
+        return self._respond(request, updated, len(updated), 0)
+
+    def _delete(self, request, table, body):
+        keep, removed = [], []
+        for row in self.tables[table]:
+            (removed if self._matches(row, request.query) else keep).append(row)
+        self.tables[table] = keep
+        return self._respond(request, removed, len(removed), 0)
+
+    # --- Truy vấn ---
+    @staticmethod
+    def _prefer(request):
+        prefer = {}
+        for value in request.headers.getall("Prefer", []):
+            for item in value.split(","):
+                key, _, setting = item.strip().partition("=")
+                prefer[key] = setting
+        return prefer
+
+    @staticmethod
+    def _matches(row, query):
+        for key, value in query.items():
+            if key in _RESERVED_PARAMS:
+                continue
+            node = _parse_logic(key, value) if key in ("and", "or") else ("filter", key, value)
+            if not _evaluate(row, node):
+                return False
+        return True
+
+    def _query(self, request, rows):
+        """Lọc, sắp xếp và cắt trang; trả về (dòng của trang, tổng số dòng khớp, offset)."""
+        rows = [row for row in rows if self._matches(row, request.query)]
+        order = request.query.get("order")
+        if order:
+            for item in reversed(_split_top_level(order)):
+                column, _, direction = item.partition(".")
+                descending = direction.startswith("desc")
+                rows.sort(key=lambda row: _sort_key(_column_value(row, column)), reverse=descending)
+        offset = int(request.query.get("offset", 0))
+        limit = request.query.get("limit")
+        page = rows[offset:offset + int(limit)] if limit is not None else rows[offset:]
+        return page, len(rows), offset
+
+    @staticmethod
+    def _project(row, select):
+        if not select or select == "*":
+            return {key: _serialize(value) for key, value in row.items()}
+        projected = {}
+        for field in _split_top_level(select):
+            alias, column = None, field
+            if re.match(r"^\w+:[^:]", field):
+                alias, column = field.split(":", 1)
+            if column == "*":
+                projected.update({key: _serialize(value) for key, value in row.items()})
+            else:
+                projected[alias or _output_name(column)] = _serialize(_column_value(row, column))
+        return projected
+
+    def _respond(self, request, rows, total, offset, status=200):
+        prefer = self._prefer(request)
+        headers = {}
+        if prefer.get("count") in ("exact", "planned", "estimated"):
+            headers["Content-Range"] = (f"{offset}-{offset + len(rows) - 1}/{total}" if rows else f"*/{total}")
+        if request.method == "HEAD":
+            return web.Response(status=200, headers=headers)
+        if request.method != "GET" and prefer.get("return") != "representation" and not request.path.startswith("/rest/v1/rpc/"):
+            return web.Response(status=201 if status == 201 else 204, headers=headers)
+
+        data = [self._project(row, request.query.get("select")) for row in rows]
+        if _OBJECT_MEDIA_TYPE in request.headers.get("Accept", ""):
+            if len(data) != 1:
+                return web.json_response({"code": "PGRST116", "details": f"The result contains {len(data)} rows",
+                                          "hint": None, "message": "JSON object requested, multiple (or no) rows returned"},
+                                         status=406)
+            return web.json_response(data[0], status=status, headers=headers)
+        return web.json_response(data, status=status, headers=headers)
+
+
+class ServiceThread:
+    """Chạy các dịch vụ giả lập trên một event loop nền, mỗi dịch vụ một cổng ngẫu nhiên trên localhost."""
+
+    def __init__(self, *services, host="127.0.0.1"):
+        self.services = services
+        self.host = host
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._runners = []
+
+    def start(self):
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        return [service.url for service in self.services]
+
+    async def _start(self):
+        for service in self.services:
+            runner = web.AppRunner(service.app(), access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, self.host, 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            service.url = f"http://{self.host}:{port}"
+            self._runners.append(runner)
+
+    def stop(self):
+        async def cleanup():
+            for runner in self._runners:
+                await runner.cleanup()
+        asyncio.run_coroutine_threadsafe(cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,504 @@
+"""
+Bộ benchmark offline: chạy luồng hỏi đáp giống iSTQB_ChatBot.py, ingest tài liệu và
+render trang Admin trên các dịch vụ OpenAI/Supabase giả lập (benchmarks/fake_services.py),
+không cần mạng hay API key.
+
+    python benchmarks/run_benchmarks.py --output .cache/benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --compare .cache/benchmarks/baseline.json
+
+Kết quả (p50/p95/p99 từng bước của một lượt hỏi, chunks/s khi ingest, thời gian render
+trang Admin theo số câu trả lời chờ duyệt) được ghi ra JSON; --compare so với một lần chạy
+trước và trả về mã lỗi 1 nếu có chỉ số chậm đi quá ngưỡng cho phép.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+from benchmarks.fake_services import FakeOpenAI, FakeSupabase, ServiceThread
+
+# Khoá có dạng JWT để supabase-py chấp nhận; dịch vụ giả không kiểm tra chữ ký
+FAKE_SUPABASE_KEY = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJyb2xlIjoiYW5vbiJ9.benchmark"
+
+# Embedding giả là bag-of-words nên cosine thấp hơn embedding thật: hạ ngưỡng định tuyến tương ứng
+RAG_SCORE_THRESHOLD = "0.2"
+FALLBACK_SCORE_THRESHOLD = "0.05"
+APPROVED_QA_THRESHOLD = "0.75"
+
+SCENARIOS = {
+    "en_syllabus": [
+        "What is equivalence partitioning?",
+        "What is boundary value analysis?",
+        "What are the benefits of static testing?",
+        "What is the purpose of a test plan?",
+    ],
+    "en_fallback": [
+        "What is the capital of France?",
+        "Who painted the Mona Lisa?",
+        "How do volcanoes erupt?",
+    ],
+    # Câu hỏi có sẵn câu trả lời đã duyệt (APPROVED_QA): khớp theo hash hoặc theo embedding
+    "en_approved": [
+        "Who wrote Romeo and Juliet?",
+        "Tell me who wrote Romeo and Juliet",
+        "What is the tallest mountain on Earth?",
+    ],
+    "vi_syllabus": [
+        "Phân vùng tương đương là gì?",
+        "Phân tích giá trị biên là gì?",
+        "Lợi ích của kiểm thử tĩnh là gì?",
+    ],
+    "vi_fallback": [
+        "Thủ đô của nước Pháp là gì?",
+        "Ai đã vẽ bức tranh Mona Lisa?",
+    ],
+}
+APPROVED_QA = {
+    "Who wrote Romeo and Juliet?": "Romeo and Juliet was written by William Shakespeare.",
+    "What is the tallest mountain on Earth?": "Mount Everest is the tallest mountain on Earth.",
+}
+# Câu dẫn trước mã không tìm thấy: ngắn (nằm trong phần đầu được đọc trước) và dài (mã xuất hiện giữa câu trả lời)
+NOT_FOUND_LEAD_INS = {
+    "Who painted the Mona Lisa?": "Based on the context, ",
+    "How do volcanoes erupt?": (
+        "The provided context covers software testing topics such as test levels, test techniques and "
+        "test management, but it does not describe this subject, so the answer is: "),
+}
+TRANSLATIONS = {
+    "Phân vùng tương đương là gì?": "What is equivalence partitioning?",
+    "Phân tích giá trị biên là gì?": "What is boundary value analysis?",
+    "Lợi ích của kiểm thử tĩnh là gì?": "What are the benefits of static testing?",
+    "Thủ đô của nước Pháp là gì?": "What is the capital of France?",
+    "Ai đã vẽ bức tranh Mona Lisa?": "Who painted the Mona Lisa?",
+}
+
+LATENCY_SUFFIXES = (".mean", ".p50", ".p95", ".p99")
+THROUGHPUT_SUFFIXES = ("chunks_per_second",)
+
+
+def summarize(values):
+    """Thống kê thời gian (giây): số mẫu, trung bình, p50/p95/p99, max."""
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return {"count": 0}
+    return {
+        "count": int(len(values)),
+        "mean": round(float(values.mean()), 6),
+        "p50": round(float(np.percentile(values, 50)), 6),
+        "p95": round(float(np.percentile(values, 95)), 6),
+        "p99": round(float(np.percentile(values, 99)), 6),
+        "max": round(float(values.max()), 6),
+    }
+
+
+def configure_environment(openai_url, supabase_url, cache_dir):
+    """Trỏ mọi client tới dịch vụ giả; phải gọi trước khi import src (các hằng số đọc env lúc import)."""
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": f"{openai_url}/v1",
+        "OPENAI_API_BASE": f"{openai_url}/v1",
+        "SUPABASE_URL": supabase_url,
+        "SUPABASE_KEY": FAKE_SUPABASE_KEY,
+        "ADMIN_PASSWORD": "benchmark",
+        "VECTOR_BACKEND": "supabase",
+        "CHATBOT_CACHE_DIR": cache_dir,
+        "LEXICAL_INDEX_PATH": os.path.join(cache_dir, "lexical_index.json.gz"),
+        "TRANSLATION_MEMORY_PATH": os.path.join(cache_dir, "translations.sqlite3"),
+        "RAG_SCORE_THRESHOLD": RAG_SCORE_THRESHOLD,
+        "FALLBACK_SCORE_THRESHOLD": FALLBACK_SCORE_THRESHOLD,
+        "APPROVED_QA_THRESHOLD": APPROVED_QA_THRESHOLD,
+        # Không cần tải bảng BPE của tiktoken: bộ benchmark chạy hoàn toàn offline
+        "EMBEDDING_CHECK_CTX_LENGTH": "false",
+    })
+
+
+# --- Ingest ---
+def bench_ingest(fake_supabase, data_path):
+    import ingest_data
+
+    def pdf_rows():
+        return sum(1 for row in fake_supabase.rows(ingest_data.TABLE_NAME)
+                   if str((row.get("metadata") or {}).get("source", "")).lower().endswith(".pdf"))
+
+    results = {}
+    for label in ("cold", "incremental"):
+        before = pdf_rows()
+        start = time.perf_counter()
+        ingest_data.create_vector_db(backend="supabase", data_path=data_path)
+        seconds = time.perf_counter() - start
+        chunks = pdf_rows() - before
+        results[label] = {"seconds": round(seconds, 6), "chunks": chunks,
+                          "chunks_per_second": round(chunks / seconds, 3) if chunks else None}
+    results["total_chunks"] = pdf_rows()
+    return results
+
+
+# --- Một lượt hỏi đáp ---
+def run_turn(bot, runtime, client, user_message):
+    """
+    Chạy đúng các bước của iSTQB_ChatBot.py cho một tin nhắn, đo thời gian từng bước.
+    Trả về ({bước: giây}, {bước nội bộ theo telemetry: giây}, nhánh "syllabus"/"approved"/"fallback", câu trả lời).
+    """
+    from src.approved_qa import LEARNED_SOURCE
+    from src.language_utils import LANGUAGE_NAMES, stream_translate_text
+    from src.pipeline import aprepare_turn, needs_translation
+    from src.telemetry import telemetry
+
+    timings = {}
+    start = last = time.perf_counter()
+
+    def mark(stage):
+        nonlocal last
+        now = time.perf_counter()
+        timings[stage] = now - last
+        last = now
+
+    with telemetry.turn(user_message) as turn:
+        original_lang, english_prompt = runtime.run(aprepare_turn(bot, user_message))
+        telemetry.annotate(language=original_lang, path="syllabus")
+        mark("prepare")
+
+        path = "syllabus"
+        result = bot.stream_in_syllabus(english_prompt, original_lang)
+        mark("syllabus")
+        if result and result["sources"][0].get("source") == LEARNED_SOURCE:
+            path = "approved"
+        if not result:
+            path = "fallback"
+            telemetry.annotate(path=path)
+            result = bot.stream_with_openai_and_learn(english_prompt, original_lang)
+            mark("fallback")
+
+        stream = result["stream"]
+        translate = needs_translation(original_lang, result)
+        if translate:
+            english_answer = "".join(stream)
+            mark("answer")
+            stream = stream_translate_text(english_answer, LANGUAGE_NAMES[original_lang], client)
+
+        parts = []
+        for piece in stream:
+            if not parts:
+                timings["first_token"] = time.perf_counter() - start
+            parts.append(piece)
+        mark("back_translate" if translate else "answer")
+        if path == "syllabus" and result["sources"] and result["sources"][0].get("source") == "OpenAI":
+            path = "fallback"  # mã không tìm thấy xuất hiện giữa câu trả lời, stream đã chuyển sang OpenAI
+    timings["total"] = time.perf_counter() - start
+
+    internal = {}
+    for name, seconds in turn.stages:
+        internal[name] = internal.get(name, 0.0) + seconds
+    return timings, internal, path, "".join(parts)
+
+
+def reset_caches(bot):
+    """Xoá mọi cache (câu trả lời, embedding, bộ nhớ dịch) để đo lượt hỏi 'lạnh'."""
+    from src import language_utils
+    from src.answer_cache import AnswerCache
+    from src.translation_memory import TranslationMemory
+
+    bot.answer_cache = AnswerCache()
+    bot._query_embeddings.clear()
+    language_utils._translation_memory = TranslationMemory(":memory:")
+
+
+def forget_learned(bot, fake_supabase):
+    """Xoá các câu trả lời tự học đang chờ duyệt để lượt sau vẫn đi đúng nhánh của kịch bản."""
+    from src.approved_qa import QA_TABLE_NAME, STATUS_PENDING
+
+    bot.learning_queue.flush(timeout=30)
+    fake_supabase.delete_where(QA_TABLE_NAME, lambda row: (row.get("metadata") or {}).get("status") == STATUS_PENDING)
+
+
+def seed_approved(bot, fake_supabase):
+    """Nạp các câu trả lời đã duyệt của APPROVED_QA vào kho hỏi/đáp giả."""
+    from benchmarks.fake_services import fake_embedding
+    from src.approved_qa import LEARNED_SOURCE, QA_TABLE_NAME, STATUS_APPROVED, question_hash
+
+    fake_supabase.insert_rows(QA_TABLE_NAME, [
+        {
+            "content": f"Question: {question}\nAnswer: {answer}",
+            "embedding": fake_embedding(question),
+            "metadata": {"source": LEARNED_SOURCE, "status": STATUS_APPROVED, "question": question,
+                         "answer": answer, "question_hash": question_hash(question)},
+        }
+        for question, answer in APPROVED_QA.items()
+    ])
+    bot.approved_qa.invalidate()
+
+
+def bench_turns(fake_openai, fake_supabase, iterations, warm=True):
+    from src.chatbot import NOT_FOUND_TOKEN, Chatbot
+    from src.clients import get_openai_client
+    from src.pipeline import EventLoopThread
+
+    bot = Chatbot()
+    runtime = EventLoopThread()
+    client = get_openai_client()
+
+    seed_approved(bot, fake_supabase)
+    results = {}
+    modes = ("cold", "warm") if warm else ("cold",)
+    for scenario, questions in SCENARIOS.items():
+        expected_path = scenario.split("_", 1)[1]
+        for mode in modes:
+            reset_caches(bot)
+            if mode == "warm":
+                for question in questions:
+                    run_turn(bot, runtime, client, question)
+                forget_learned(bot, fake_supabase)
+
+            stage_times, internal_times, paths, empty_answers, leaked_not_found = {}, {}, {}, 0, 0
+            fake_openai.reset_stats()
+            fake_supabase.reset_stats()
+            for i in range(iterations):
+                if mode == "cold":
+                    reset_caches(bot)
+                question = questions[i % len(questions)]
+                timings, internal, path, answer = run_turn(bot, runtime, client, question)
+                for stage, seconds in timings.items():
+                    stage_times.setdefault(stage, []).append(seconds)
+                for stage, seconds in internal.items():
+                    internal_times.setdefault(stage, []).append(seconds)
+                paths[path] = paths.get(path, 0) + 1
+                empty_answers += not answer
+                leaked_not_found += NOT_FOUND_TOKEN in answer
+                forget_learned(bot, fake_supabase)
+
+            openai_stats, supabase_stats = fake_openai.stats(), fake_supabase.stats()
+            results[f"{scenario}.{mode}"] = {
+                "stages": {stage: summarize(values) for stage, values in stage_times.items()},
+                "internal_stages": {stage: summarize(values) for stage, values in internal_times.items()},
+                "paths": paths,
+                "unexpected_path": iterations - paths.get(expected_path, 0),
+                "empty_answers": empty_answers,
+                "leaked_not_found": leaked_not_found,
+                "openai_requests_per_turn": round(openai_stats["total_requests"] / iterations, 3),
+                "supabase_requests_per_turn": round(supabase_stats["total_requests"] / iterations, 3),
+                "tokens_per_turn": {name: round(count / iterations, 1)
+                                    for name, count in openai_stats["tokens"].items()},
+                "rate_limited": openai_stats["rate_limited"] + supabase_stats["rate_limited"],
+            }
+            print(f"  {scenario:<12} {mode:<5} total p50={results[f'{scenario}.{mode}']['stages']['total']['p50']:.3f}s "
+                  f"đường đi={paths}")
+    bot.learning_queue.close()
+    return results
+
+
+# --- Lượt hỏi đồng thời ---
+def bench_concurrent(fake_openai, fake_supabase, rounds):
+    """
+    Chạy đồng thời mọi câu hỏi của các kịch bản (cache lạnh) qua aanswer_turn, như nhiều người dùng
+    cùng lúc: đo thời gian cả đợt và số request embedding (chạy với EMBEDDING_BATCH_SIZE=1 để so với
+    khi không gom lô).
+    """
+    from src.chatbot import Chatbot
+    from src.pipeline import EventLoopThread, aanswer_turn
+    from src.telemetry import telemetry
+
+    bot = Chatbot()
+    runtime = EventLoopThread()
+    seed_approved(bot, fake_supabase)
+    questions = [question for scenario in SCENARIOS.values() for question in scenario]
+
+    async def one_round():
+        return await asyncio.gather(*(aanswer_turn(bot, question) for question in questions),
+                                    return_exceptions=True)
+
+    timings, errors, embedding_requests, total_requests = [], 0, 0, 0
+    batches_before = sum(telemetry.counter_values("embedding_batches_total").values())
+    for _ in range(rounds):
+        reset_caches(bot)
+        fake_openai.reset_stats()
+        start = time.perf_counter()
+        answers = runtime.run(one_round())
+        timings.append(time.perf_counter() - start)
+        errors += sum(isinstance(answer, BaseException) for answer in answers)
+        forget_learned(bot, fake_supabase)
+        stats = fake_openai.stats()
+        embedding_requests += stats["requests"].get("POST /v1/embeddings", 0)
+        total_requests += stats["total_requests"]
+    bot.learning_queue.close()
+
+    result = {
+        "users": len(questions),
+        "round": summarize(timings),
+        "errors": errors,
+        "embedding_requests_per_round": round(embedding_requests / rounds, 3),
+        "openai_requests_per_round": round(total_requests / rounds, 3),
+        "embedding_batches": sum(telemetry.counter_values("embedding_batches_total").values()) - batches_before,
+    }
+    print(f"  {len(questions)} lượt đồng thời: p50={result['round']['p50']:.3f}s "
+          f"embedding={result['embedding_requests_per_round']} request/đợt")
+    return result
+
+
+# --- Trang Admin ---
+def bench_admin(fake_supabase, sizes, repeats):
+    from streamlit.testing.v1 import AppTest
+    from src.approved_qa import LEARNED_SOURCE, QA_TABLE_NAME
+
+    def is_pending(row):
+        return (row.get("metadata") or {}).get("status") == "pending"
+
+    results = {}
+    for size in sizes:
+        fake_supabase.delete_where(QA_TABLE_NAME, is_pending)
+        fake_supabase.insert_rows(QA_TABLE_NAME, [
+            {
+                "id": f"00000000-0000-4000-8000-{i:012d}",
+                "content": f"Question: Benchmark question number {i}?\nAnswer: " + "Generated answer text. " * 20,
+                "metadata": {"source": LEARNED_SOURCE, "status": "pending"},
+            }
+            for i in range(size)
+        ])
+
+        timings, errors = [], 0
+        fake_supabase.reset_stats()
+        for _ in range(repeats):
+            app = AppTest.from_file(os.path.join(ROOT, "pages", "Admin.py"), default_timeout=300)
+            app.session_state["logged_in"] = True
+            start = time.perf_counter()
+            app.run()
+            timings.append(time.perf_counter() - start)
+            errors += len(app.exception)
+        stats = fake_supabase.stats()
+        results[str(size)] = {
+            "render": summarize(timings),
+            "errors": errors,
+            "supabase_requests_per_render": round(stats["total_requests"] / repeats, 3),
+            "supabase_bytes_per_render": int(stats["response_bytes"] / repeats),
+        }
+        print(f"  admin {size:>6} dòng chờ duyệt: p50={results[str(size)]['render']['p50']:.3f}s "
+              f"{results[str(size)]['supabase_bytes_per_render']} bytes/lần")
+    fake_supabase.delete_where(QA_TABLE_NAME, is_pending)
+    return results
+
+
+# --- So sánh ---
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(current, baseline, tolerance, min_delta=0.005):
+    """
+    So sánh với một lần chạy trước: thời gian tăng quá tolerance (và quá min_delta giây)
+    hoặc thông lượng giảm quá tolerance đều bị coi là regression.
+    """
+    now, before = flatten(current["results"]), flatten(baseline["results"])
+    regressions = []
+    for key, value in sorted(now.items()):
+        base = before.get(key)
+        if not base:
+            continue
+        if key.endswith(LATENCY_SUFFIXES) and value > base * (1 + tolerance) and value - base > min_delta:
+            regressions.append((key, base, value))
+        elif key.endswith(THROUGHPUT_SUFFIXES) and value < base * (1 - tolerance):
+            regressions.append((key, base, value))
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline cho ISTQB chatbot.")
+    parser.add_argument("--iterations", type=int, default=10, help="Số lượt hỏi cho mỗi kịch bản")
+    parser.add_argument("--admin-sizes", default="10,100,1000,5000", help="Số dòng chờ duyệt khi đo trang Admin")
+    parser.add_argument("--admin-repeats", type=int, default=3)
+    parser.add_argument("--skip", default="",
+                        help="Bỏ qua các phần: turns,concurrent,admin (ingest luôn chạy để nạp dữ liệu)")
+    parser.add_argument("--no-warm", action="store_true", help="Không đo lượt hỏi khi cache đã nóng")
+    parser.add_argument("--concurrent-rounds", type=int, default=3, help="Số đợt hỏi đồng thời")
+    parser.add_argument("--data-path", default=os.path.join(ROOT, "data"))
+    parser.add_argument("--chat-latency", type=float, default=0.2, help="Độ trễ mỗi lần gọi chat (giây)")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Độ trễ mỗi token khi stream (giây)")
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--supabase-latency", type=float, default=0.02)
+    parser.add_argument("--openai-rpm", type=int, default=None, help="Giới hạn request/phút của OpenAI giả (429)")
+    parser.add_argument("--supabase-rpm", type=int, default=None)
+    parser.add_argument("--jitter", type=float, default=0.0, help="Dao động độ trễ (tỉ lệ, seed cố định)")
+    parser.add_argument("--output", default=None, help="File JSON kết quả")
+    parser.add_argument("--compare", default=None, help="File JSON của lần chạy trước để so sánh")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Ngưỡng regression (0.2 = chậm hơn 20%%)")
+    args = parser.parse_args(argv)
+    skip = {item.strip() for item in args.skip.split(",") if item.strip()}
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    fake_openai = FakeOpenAI(latency=args.chat_latency, token_latency=args.token_latency,
+                             embedding_latency=args.embedding_latency, requests_per_minute=args.openai_rpm,
+                             jitter=args.jitter, translations=TRANSLATIONS, not_found_lead_ins=NOT_FOUND_LEAD_INS)
+    fake_supabase = FakeSupabase(latency=args.supabase_latency, requests_per_minute=args.supabase_rpm,
+                                 jitter=args.jitter)
+
+    results = {}
+    with ServiceThread(fake_openai, fake_supabase), tempfile.TemporaryDirectory() as cache_dir:
+        configure_environment(fake_openai.url, fake_supabase.url, cache_dir)
+
+        print("Ingest tài liệu...")
+        results["ingest"] = bench_ingest(fake_supabase, args.data_path)
+        if "turns" not in skip:
+            print("Lượt hỏi đáp...")
+            results["turns"] = bench_turns(fake_openai, fake_supabase, args.iterations, warm=not args.no_warm)
+        if "concurrent" not in skip:
+            print("Lượt hỏi đồng thời...")
+            results["concurrent"] = bench_concurrent(fake_openai, fake_supabase, args.concurrent_rounds)
+        if "admin" not in skip:
+            print("Trang Admin...")
+            sizes = [int(size) for size in args.admin_sizes.split(",") if size.strip()]
+            results["admin"] = bench_admin(fake_supabase, sizes, args.admin_repeats)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        ROOT, ".cache", "benchmarks", f"results-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Đã ghi kết quả vào {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"Phát hiện {len(regressions)} chỉ số kém đi so với {args.compare}:")
+            for key, base, value in regressions:
+                print(f"  {key}: {base:g} -> {value:g}")
+            return 1
+        print(f"Không có regression so với {args.compare} (ngưỡng {args.tolerance:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
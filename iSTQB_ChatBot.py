@@ -1,23 +1,63 @@
+# Import trước tiên: mốc 0 của báo cáo khởi động. Các thư viện nặng (LangChain, OpenAI, Supabase)
+# chỉ được import trong build_backend, trên luồng nền
+from src.startup import STARTUP_WARMUP, start_in_background, startup, warm_up
+import os
 import streamlit as st
 from dotenv import load_dotenv
-from src.chatbot import Chatbot
-from src.language_utils import detect_language, translate_text
-from openai import OpenAI
+from src.service_client import CHATBOT_SERVICE_URL, ChatServiceClient
+from src.telemetry import telemetry
 import streamlit.components.v1 as components
 
 # Tải biến môi trường
 load_dotenv()
 
-# Khởi tạo OpenAI client một lần để tái sử dụng
-client = OpenAI()
+# Hiện sidebar debug (thời gian từng bước, số liệu) khi bật CHATBOT_DEBUG hoặc mở trang với ?debug=1
+DEBUG_SIDEBAR = os.environ.get("CHATBOT_DEBUG", "false").lower() == "true"
 
 # Thiết lập tiêu đề và icon cho trang
 st.set_page_config(page_title="ISTQB Chatbot", page_icon="🤖")
 
+def build_backend():
+    # Chạy trên luồng nền: import LangChain/OpenAI/Supabase, tạo Chatbot và event loop nền
+    # (client async được tạo trên chính loop đó), rồi khởi động nóng (hồ sơ ngôn ngữ, connection...)
+    with startup.phase("import_backend"):
+        from src.chatbot import Chatbot
+        from src.pipeline import EventLoopThread
+    with startup.phase("init_chatbot"):
+        bot = Chatbot()
+        async_loop = EventLoopThread()
+    startup.mark("backend_ready")
+    if STARTUP_WARMUP:
+        warm_up(bot, run_async=async_loop.run)
+    startup.log()
+    return bot, async_loop
+
+@st.cache_resource
+def start_backend():
+    # Bắt đầu khởi tạo chatbot ở nền (một lần cho cả process) để giao diện hiện ra ngay
+    return start_in_background(build_backend, name="chatbot-startup")
+
+def get_backend():
+    # Chờ chatbot khởi tạo xong (thường đã xong trước khi người dùng gửi câu hỏi đầu tiên)
+    backend = start_backend()
+    try:
+        if backend.done():
+            return backend.result()
+        with st.spinner("Đang khởi động chatbot..."):
+            return backend.result()
+    except Exception:
+        # Không cache lần khởi tạo lỗi: lần chạy sau sẽ thử lại
+        start_backend.clear()
+        raise
+
 @st.cache_resource
-def load_chatbot():
-    # Tải chatbot và cache lại để dùng cho các lần sau
-    return Chatbot()
+def load_service_client():
+    # Client của dịch vụ HTTP/SSE (src/service.py), dùng khi có CHATBOT_SERVICE_URL
+    return ChatServiceClient()
+
+def _is_syllabus_source(source):
+    # Nguồn giáo trình là file trong thư mục data; dấu phân cách là "\\" hay "/" tuỳ hệ điều hành lúc ingest
+    return bool(source) and 'data/' in str(source).replace('\\', '/')
 
 def display_grouped_sources(sources_list):
     # Hàm hỗ trợ để nhóm và hiển thị nguồn tham khảo một cách tối ưu
@@ -27,8 +67,8 @@ def display_grouped_sources(sources_list):
     st.write("---")
     
     # Tách các nguồn ra làm 2 loại: giáo trình và các nguồn khác (OpenAI)
-    syllabus_sources = [s for s in sources_list if s.get('source') and 'data\\' in s.get('source')]
-    other_sources = [s for s in sources_list if not s.get('source') or 'data\\' not in s.get('source')]
+    syllabus_sources = [s for s in sources_list if _is_syllabus_source(s.get('source'))]
+    other_sources = [s for s in sources_list if not _is_syllabus_source(s.get('source'))]
 
     # Luôn ưu tiên hiển thị nguồn từ giáo trình nếu có
     if syllabus_sources:
@@ -56,8 +96,102 @@ def display_grouped_sources(sources_list):
              else:
                  st.markdown(f"- **Nguồn**: `{source_name}`")
 
+def display_debug_sidebar():
+    # Sidebar debug: các chỉ số tổng hợp, thời gian từng bước của các lượt hỏi gần đây và file metrics
+    with st.sidebar:
+        st.subheader("🛠️ Debug")
+        summary = telemetry.summary()
+        col1, col2 = st.columns(2)
+        col1.metric("Lượt hỏi", summary["turns"])
+        col2.metric("Lỗi", summary["errors"])
+        col1.metric("Tỉ lệ dự phòng", f"{summary['fallback_rate']:.0%}")
+        col2.metric("Trúng cache", f"{summary['cache_hit_rate']:.0%}")
+        st.caption(f"Tổng token: {summary['tokens']} · Token ngữ cảnh tiết kiệm: {summary['context_tokens_saved']}")
+
+        for turn in telemetry.recent_turns(10):
+            label = f"{turn['duration']:.2f}s · {turn.get('path', '?')} · {turn['question'][:30]}"
+            with st.expander(label):
+                st.caption(f"Trace ID: `{turn['trace_id']}` · Ngôn ngữ: {turn.get('language', '?')}")
+                st.table({
+                    "Bước": [stage["stage"] for stage in turn["stages"]],
+                    "Giây": [f"{stage['seconds']:.3f}" for stage in turn["stages"]],
+                })
+                if turn["tokens"]:
+                    st.caption(f"Token: {turn['tokens']}")
+                if turn["error"]:
+                    st.error(turn["error"])
+
+        with st.expander("Khởi động"):
+            report = startup.summary()
+            st.caption(" · ".join(f"{name}: {seconds:.2f}s" for name, seconds in report["marks"].items()))
+            if report["phases"]:
+                st.table({
+                    "Bước": [phase["phase"] for phase in report["phases"]],
+                    "Giây": [f"{phase['seconds']:.3f}" for phase in report["phases"]],
+                })
+
+        st.download_button("Tải metrics (Prometheus)", telemetry.render_prometheus(),
+                           file_name="metrics.txt", mime="text/plain")
+
+def answer_locally(user_message):
+    # Xử lý lượt hỏi ngay trong tiến trình Streamlit; trả về (câu trả lời, nguồn)
+    from src.clients import get_openai_client
+    from src.language_utils import LANGUAGE_NAMES, stream_translate_text
+    from src.pipeline import aprepare_turn, needs_translation
+
+    bot, async_loop = get_backend()
+    # Phát hiện ngôn ngữ và dịch prompt sang tiếng Anh;
+    # ở chế độ cross-lingual câu hỏi được giữ nguyên và câu trả lời sinh ra bằng ngôn ngữ của người dùng
+    original_lang, english_prompt = async_loop.run(aprepare_turn(bot, user_message))
+    telemetry.annotate(language=original_lang, path="syllabus")
+
+    final_result = None
+
+    # 1. Tìm trong giáo trình trước
+    with st.spinner("Đang tìm trong giáo trình..."):
+        syllabus_result = bot.stream_in_syllabus(english_prompt, original_lang)
+
+    if syllabus_result:
+        # Nếu tìm thấy, hiển thị kết quả theo giáo trình
+        final_result = syllabus_result
+    else:
+        # 2. Nếu không tìm thấy, thông báo và tìm bằng OpenAI
+        telemetry.annotate(path="fallback")
+        placeholder = st.empty()
+        placeholder.write("Giáo trình chưa có thông tin này. Xin hãy đợi tôi hỏi OpenAI...")
+
+        with st.spinner("Đang liên hệ với OpenAI..."):
+            openai_result = bot.stream_with_openai_and_learn(english_prompt, original_lang)
+
+        final_result = openai_result
+        placeholder.empty() # Xóa thông báo tạm thời
+
+    # 3. Hiển thị dần câu trả lời khi các token về tới
+    if needs_translation(original_lang, final_result):
+        # Cần câu trả lời tiếng Anh đầy đủ trước khi dịch ngược, sau đó stream bản dịch
+        with st.spinner("Đang dịch câu trả lời..."):
+            english_answer = "".join(final_result["stream"])
+        final_answer = st.write_stream(stream_translate_text(english_answer, LANGUAGE_NAMES[original_lang], get_openai_client()))
+    else:
+        final_answer = st.write_stream(final_result["stream"])
+    # Đọc nguồn sau khi stream xong: stream giáo trình có thể chuyển sang câu trả lời của OpenAI giữa chừng
+    return final_answer, final_result.get('sources', [])
+
+def answer_with_service(user_message):
+    # Gọi dịch vụ HTTP/SSE: toàn bộ luồng phát hiện ngôn ngữ/dịch/truy xuất/trả lời chạy phía dịch vụ
+    with st.spinner("Đang tìm câu trả lời..."):
+        final_result = service.stream(user_message)
+    telemetry.annotate(language=final_result.get('language'), path="service",
+                       service_trace_id=final_result.get('trace_id'))
+    final_answer = st.write_stream(final_result["stream"])
+    return final_answer, final_result.get('sources', [])
+
 # --- Main App ---
-bot = load_chatbot()
+if CHATBOT_SERVICE_URL:
+    service = load_service_client()
+else:
+    # Chỉ bắt đầu khởi tạo, không chờ: ô nhập liệu hiện ra trong lúc chatbot khởi động ở nền
+    start_backend()
 
 st.title("🤖 ISTQB Chatbot")
 st.caption("Trợ lý AI giúp bạn tra cứu thông tin từ giáo trình ISTQB")
@@ -70,6 +204,9 @@ if "messages" not in st.session_state:
 if "processing" not in st.session_state:
     st.session_state.processing = False
 
+if DEBUG_SIDEBAR or st.query_params.get("debug") == "1":
+    display_debug_sidebar()
+
 # Hiển thị các tin nhắn đã có trong lịch sử
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
@@ -77,6 +214,9 @@ for message in st.session_state.messages:
         if message["role"] == "assistant":
             display_grouped_sources(message.get("sources", []))
 
+# Giao diện đã sẵn sàng nhận câu hỏi (time-to-interactive của lần chạy đầu tiên sau khi khởi động)
+startup.mark("ui_ready")
+
 if prompt := st.chat_input("Hãy nhập câu hỏi của bạn...", disabled=st.session_state.processing):
     st.session_state.messages.append({"role": "user", "content": prompt})
     st.session_state.processing = True
@@ -87,44 +227,15 @@ if prompt := st.chat_input("Hãy nhập câu hỏi của bạn...", disabled=st.
 if st.session_state.processing:
     user_message = st.session_state.messages[-1]["content"]
     
-    with st.chat_message("assistant"):
-        # Dịch prompt sang tiếng Anh
-        original_lang = detect_language(user_message)
-        english_prompt = user_message
-        if original_lang == 'vi':
-            english_prompt = translate_text(user_message, "English", client)
-
-        final_result = None
-        
-        # 1. Tìm trong giáo trình trước
-        with st.spinner("Đang tìm trong giáo trình..."):
-            syllabus_result = bot.search_in_syllabus(english_prompt)
-
-        if syllabus_result:
-            # Nếu tìm thấy, hiển thị kết quả theo giáo trình
-            final_result = syllabus_result
+    with st.chat_message("assistant"), telemetry.turn(user_message):
+        if CHATBOT_SERVICE_URL:
+            final_answer, sources = answer_with_service(user_message)
         else:
-            # 2. Nếu không tìm thấy, thông báo và tìm bằng OpenAI
-            placeholder = st.empty()
-            placeholder.write("Giáo trình chưa có thông tin này. Xin hãy đợi tôi hỏi OpenAI...")
-            
-            with st.spinner("Đang liên hệ với OpenAI..."):
-                openai_result = bot.search_with_openai_and_learn(english_prompt)
-            
-            final_result = openai_result
-            placeholder.empty() # Xóa thông báo tạm thời
-
-        # 3. Xử lý và hiển thị kết quả cuối cùng
-        english_answer = final_result.get('answer', "Xin lỗi, đã có lỗi xảy ra.")
-        sources = final_result.get('sources', [])
+            final_answer, sources = answer_locally(user_message)
 
-        # Dịch ngược câu trả lời nếu cần
-        final_answer = english_answer
-        if original_lang == 'vi' and english_answer:
-            final_answer = translate_text(english_answer, "Vietnamese", client)
-        
-        # st.write(final_answer)
-        # display_grouped_sources(sources)
+        if not final_answer:
+            final_answer = "Xin lỗi, đã có lỗi xảy ra."
+        display_grouped_sources(sources)
         
         # Lưu tin nhắn hoàn chỉnh vào lịch sử
         assistant_message = {"role": "assistant", "content": final_answer}
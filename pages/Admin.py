@@ -1,7 +1,11 @@
 import streamlit as st
 import os
+import sys
 from dotenv import load_dotenv
-from supabase import create_client, Client
+
+# Cho phép import package src khi Streamlit chạy trang này
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.approved_qa import QA_TABLE_NAME, STATUS_APPROVED, STATUS_PENDING
 
 # --- Cấu hình và Kết nối ---
 
@@ -19,37 +23,78 @@ def init_connection():
     if not SUPABASE_URL or not SUPABASE_KEY:
         st.error("Lỗi: Vui lòng cung cấp SUPABASE_URL và SUPABASE_KEY trong file .env")
         return None
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
-
-supabase = init_connection()
+    # Dùng chung pool connection (và chính sách thử lại) với chatbot trong cùng process
+    # Import muộn: trang đăng nhập hiện ra mà không phải chờ tải thư viện Supabase
+    from src.clients import get_supabase_client
+    return get_supabase_client(SUPABASE_URL, SUPABASE_KEY)
 
 # --- Các hàm xử lý dữ liệu ---
-def get_pending_documents():
-    """Lấy tất cả các tài liệu có trạng thái 'pending'."""
+ITEMS_PER_PAGE = 5
+
+def count_pending_documents():
+    """Đếm số tài liệu 'pending' bằng một truy vấn HEAD (không tải dữ liệu dòng nào)."""
     try:
-        response = supabase.table('documents').select('id, content, metadata').eq('metadata->>status', 'pending').order('id').execute()
-        return response.data
+        response = supabase.table(QA_TABLE_NAME).select('id', count='exact', head=True).eq('metadata->>status', STATUS_PENDING).execute()
+        return response.count or 0
+    except Exception as e:
+        st.error(f"Lỗi khi đếm dữ liệu: {e}")
+        return 0
+
+def get_pending_page(after_id=None, limit=ITEMS_PER_PAGE):
+    """
+    Lấy một trang tài liệu 'pending' theo keyset (id > after_id, sắp theo id):
+    chỉ tải nội dung của các dòng được hiển thị.
+    """
+    try:
+        query = supabase.table(QA_TABLE_NAME).select('id, content').eq('metadata->>status', STATUS_PENDING)
+        if after_id is not None:
+            query = query.gt('id', after_id)
+        return query.order('id').limit(limit).execute().data
     except Exception as e:
         st.error(f"Lỗi khi lấy dữ liệu: {e}")
         return []
 
-def approve_document(doc_id):
-    # Cập nhật trạng thái của tài liệu thành 'approved'
+def approve_documents(doc_ids):
+    # Đổi trạng thái thành 'approved' cho nhiều tài liệu trong một lệnh (RPC cập nhật JSONB trên server)
+    try:
+        supabase.rpc('set_qa_pairs_status', {'pair_ids': list(doc_ids), 'new_status': STATUS_APPROVED}).execute()
+        return True
+    except Exception as e:
+        if getattr(e, 'code', None) != 'PGRST202':
+            st.error(f"Lỗi khi duyệt: {e}")
+            return False
+    # Chưa tạo hàm set_qa_pairs_status (xem sql/qa_pairs.sql): đọc rồi ghi lại từng dòng
     try:
-        current_data = supabase.table('documents').select('metadata').eq('id', doc_id).single().execute().data
-        if current_data:
-            metadata = current_data['metadata']
-            metadata['status'] = 'approved'
-            supabase.table('documents').update({'metadata': metadata}).eq('id', doc_id).execute()
+        rows = supabase.table(QA_TABLE_NAME).select('id, metadata').in_('id', list(doc_ids)).execute().data
+        for row in rows:
+            metadata = row['metadata'] or {}
+            metadata['status'] = STATUS_APPROVED
+            supabase.table(QA_TABLE_NAME).update({'metadata': metadata}).eq('id', row['id']).execute()
+        return True
     except Exception as e:
         st.error(f"Lỗi khi duyệt: {e}")
+        return False
 
-def reject_document(doc_id):
-    # Xóa một tài liệu khỏi cơ sở dữ liệu
+def reject_documents(doc_ids):
+    # Xóa nhiều tài liệu khỏi cơ sở dữ liệu trong một lệnh
     try:
-        supabase.table('documents').delete().eq('id', doc_id).execute()
+        supabase.table(QA_TABLE_NAME).delete().in_('id', list(doc_ids)).execute()
+        return True
     except Exception as e:
         st.error(f"Lỗi khi xóa: {e}")
+        return False
+
+def toggle_selection(doc_id):
+    # Callback của checkbox: cập nhật danh sách đã chọn trước khi trang chạy lại
+    if st.session_state[f"select_{doc_id}"]:
+        st.session_state.admin_selected.add(doc_id)
+    else:
+        st.session_state.admin_selected.discard(doc_id)
+
+def reset_pagination():
+    # Quay về trang đầu (dùng sau khi dữ liệu thay đổi)
+    st.session_state.admin_cursors = [None]
+    st.session_state.admin_selected = set()
 
 # --- Giao diện trang Admin ---
 st.set_page_config(page_title="Admin - Duyệt câu trả lời", layout="wide")
@@ -59,6 +104,9 @@ st.title("👨‍💼 Trang quản trị - Duyệt kiến thức mới")
 if 'logged_in' not in st.session_state:
     st.session_state['logged_in'] = False
 
+# Chỉ kết nối Supabase sau khi đăng nhập (lần mở trang đầu tiên chỉ cần form đăng nhập)
+supabase = init_connection() if st.session_state['logged_in'] else None
+
 def login_form():
     """Hiển thị form đăng nhập."""
     st.header("Đăng nhập")
@@ -78,42 +126,58 @@ def admin_dashboard():
     
     st.header("Các câu trả lời đang chờ duyệt")
     
-    if 'admin_page_number' not in st.session_state:
-        st.session_state.admin_page_number = 0
+    # Con trỏ keyset: id cuối cùng của trang trước, cho từng trang đã xem
+    if 'admin_cursors' not in st.session_state:
+        reset_pagination()
 
-    pending_docs = get_pending_documents()
+    total_items = count_pending_documents()
 
-    if not pending_docs:
+    if not total_items:
         st.info("Hiện không có câu trả lời nào đang chờ duyệt.")
         return
 
     # --- Logic Phân trang ---
-    ITEMS_PER_PAGE = 5
-    total_items = len(pending_docs)
     total_pages = (total_items + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
-
-    if st.session_state.admin_page_number >= total_pages and total_pages > 0:
-        st.session_state.admin_page_number = 0
-
-    start_index = st.session_state.admin_page_number * ITEMS_PER_PAGE
-    end_index = start_index + ITEMS_PER_PAGE
-    paginated_docs = pending_docs[start_index:end_index]
+    page_number = len(st.session_state.admin_cursors) - 1
+
+    paginated_docs = get_pending_page(st.session_state.admin_cursors[-1])
+    if not paginated_docs and page_number > 0:
+        # Trang hiện tại đã hết dữ liệu (vừa duyệt/xóa): quay về trang đầu
+        reset_pagination()
+        st.rerun()
+
+    selected = st.session_state.admin_selected
+    st.caption(f"Tổng cộng {total_items} câu trả lời · đã chọn {len(selected)}")
+
+    # --- Thao tác hàng loạt ---
+    bulk_col1, bulk_col2, _ = st.columns([1, 1, 3])
+    with bulk_col1:
+        if st.button(f"✅ Duyệt đã chọn ({len(selected)})", key="bulk_approve", use_container_width=True, disabled=not selected):
+            st.session_state.confirm_action = {"type": "approve", "ids": sorted(selected)}
+            st.rerun()
+    with bulk_col2:
+        if st.button(f"❌ Xóa đã chọn ({len(selected)})", key="bulk_reject", use_container_width=True, disabled=not selected):
+            st.session_state.confirm_action = {"type": "reject", "ids": sorted(selected)}
+            st.rerun()
 
     for doc in paginated_docs:
         doc_id = doc.get('id')
         content = doc.get('content', 'N/A')
         
         with st.container():
-            col1, col2, col3 = st.columns([4, 1, 1])
+            col0, col1, col2, col3 = st.columns([0.3, 3.7, 1, 1])
+            with col0:
+                st.checkbox("Chọn", value=doc_id in selected, key=f"select_{doc_id}", label_visibility="collapsed",
+                            on_change=toggle_selection, args=(doc_id,))
             with col1:
                 st.markdown(f"**ID:** `{doc_id}`")
             with col2:
                 if st.button("✅ Duyệt", key=f"approve_{doc_id}", use_container_width=True):
-                    st.session_state.confirm_action = {"type": "approve", "id": doc_id}
+                    st.session_state.confirm_action = {"type": "approve", "ids": [doc_id]}
                     st.rerun()
             with col3:
                 if st.button("❌ Xóa", key=f"reject_{doc_id}", use_container_width=True):
-                    st.session_state.confirm_action = {"type": "reject", "id": doc_id}
+                    st.session_state.confirm_action = {"type": "reject", "ids": [doc_id]}
                     st.rerun()
 
             st.text_area("Nội dung:", value=content, height=150, disabled=True, key=f"content_{doc_id}")
@@ -124,31 +188,35 @@ def admin_dashboard():
         st.write("")
         pag_col1, pag_col2, pag_col3 = st.columns([2, 3, 2])
         with pag_col1:
-            if st.button("⬅️ Trang trước", use_container_width=True, disabled=(st.session_state.admin_page_number == 0)):
-                st.session_state.admin_page_number -= 1
+            if st.button("⬅️ Trang trước", use_container_width=True, disabled=(page_number == 0)):
+                st.session_state.admin_cursors.pop()
                 st.rerun()
         with pag_col2:
-            st.markdown(f"<div style='text-align: center; margin-top: 0.5rem;'>Trang {st.session_state.admin_page_number + 1} / {total_pages}</div>", unsafe_allow_html=True)
+            st.markdown(f"<div style='text-align: center; margin-top: 0.5rem;'>Trang {page_number + 1} / {total_pages}</div>", unsafe_allow_html=True)
         with pag_col3:
-            if st.button("Trang sau ➡️", use_container_width=True, disabled=(st.session_state.admin_page_number + 1 >= total_pages)):
-                st.session_state.admin_page_number += 1
+            if st.button("Trang sau ➡️", use_container_width=True, disabled=(page_number + 1 >= total_pages or len(paginated_docs) < ITEMS_PER_PAGE)):
+                st.session_state.admin_cursors.append(paginated_docs[-1]['id'])
                 st.rerun()
 
 # --- Xử lý Dialog Xác nhận ---
+def describe_ids(doc_ids):
+    return f"ID: `{doc_ids[0]}`" if len(doc_ids) == 1 else f"{len(doc_ids)} mục đã chọn"
+
 if 'confirm_action' in st.session_state:
     action = st.session_state.confirm_action
     action_type = action['type']
-    doc_id = action['id']
+    doc_ids = action['ids']
 
     if action_type == "approve":
         @st.dialog("Xác nhận duyệt")
         def approve_dialog():
-            st.write(f"Bạn có chắc muốn **duyệt** kiến thức với ID: `{doc_id}` không?")
+            st.write(f"Bạn có chắc muốn **duyệt** kiến thức với {describe_ids(doc_ids)} không?")
             col1, col2 = st.columns(2)
             if col1.button("✅ Có, duyệt ngay", use_container_width=True):
-                approve_document(doc_id)
-                st.toast(f"Đã duyệt thành công ID: {doc_id}", icon="✅")
+                if approve_documents(doc_ids):
+                    st.toast(f"Đã duyệt thành công {describe_ids(doc_ids)}", icon="✅")
                 del st.session_state.confirm_action
+                reset_pagination()
                 st.rerun()
             if col2.button("Hủy bỏ", use_container_width=True):
                 del st.session_state.confirm_action
@@ -158,12 +226,13 @@ if 'confirm_action' in st.session_state:
     elif action_type == "reject":
         @st.dialog("⚠️ Xác nhận xóa")
         def reject_dialog():
-            st.write(f"Bạn có chắc muốn **xóa** kiến thức với ID: `{doc_id}` không? Hành động này không thể hoàn tác.")
+            st.write(f"Bạn có chắc muốn **xóa** kiến thức với {describe_ids(doc_ids)} không? Hành động này không thể hoàn tác.")
             col1, col2 = st.columns(2)
             if col1.button("❌ Có, xóa ngay", type="primary", use_container_width=True):
-                reject_document(doc_id)
-                st.toast(f"Đã xóa thành công ID: {doc_id}", icon="🗑️")
+                if reject_documents(doc_ids):
+                    st.toast(f"Đã xóa thành công {describe_ids(doc_ids)}", icon="🗑️")
                 del st.session_state.confirm_action
+                reset_pagination()
                 st.rerun()
             if col2.button("Hủy bỏ", use_container_width=True):
                 del st.session_state.confirm_action
@@ -0,0 +1,256 @@
+import os
+import re
+import sys
+import glob
+import hashlib
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from pypdf import PdfReader
+
+# Cho phép import package src khi chạy trực tiếp `python scripts/build_answer_bank.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ingest_data import DATA_PATH, iter_pdf_chunks
+from src.answer_cache import normalize_question
+from src.approved_qa import ANSWER_BANK_SOURCE
+from src.chatbot import Chatbot
+from src.context_builder import CONTEXT_TOKEN_BUDGET, count_tokens
+from src.language_utils import translate_text
+from src.rate_limit import RateLimiter
+
+load_dotenv()
+
+# Namespace cố định để id của mỗi câu hỏi trong ngân hàng ổn định giữa các lần chạy (ghi đè, không nhân bản)
+BANK_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "istqb-chatbot/answer-bank")
+# Tăng khi đổi cách đặt câu hỏi/prompt để buộc sinh lại toàn bộ ngân hàng
+BANK_VERSION = "1"
+LANGUAGES = ("en", "vi")
+
+# Số mục được sinh song song và giới hạn tốc độ của OpenAI Chat (có thể chỉnh trong .env)
+BANK_WORKERS = int(os.environ.get("ANSWER_BANK_WORKERS", "8"))
+CHAT_RPM = int(os.environ.get("CHAT_RPM", "3500"))
+CHAT_TPM = int(os.environ.get("CHAT_TPM", "160000"))
+WRITE_BATCH_SIZE = 100
+
+# Trang mở đầu mỗi chương: "1. Fundamentals of Testing – 180 minutes", "Keywords", danh sách thuật ngữ,
+# rồi "Learning Objectives for Chapter 1:" với các dòng "FL-1.1.1 (K1) Identify typical test objectives"
+_CHAPTER = re.compile(r"^(\d+)\.\s+(.+?)\s+[–-]\s+\d+\s+minutes", re.M)
+_KEYWORDS = re.compile(r"^Keywords\s*$(.*?)^Learning Objectives for Chapter", re.M | re.S)
+_OBJECTIVE = re.compile(r"^(FL-\d+\.\d+\.\d+)\s*\((K\d)\)\s*(.+)$")
+_SECTION = re.compile(r"^\d+\.\d+\.?\s")
+
+
+def parse_chapter_page(text):
+    """
+    Tách mục tiêu học tập và thuật ngữ từ trang mở đầu một chương.
+    Trả về (số chương, [(mã, mức K, nội dung)], [thuật ngữ]); (None, [], []) nếu không phải trang mở đầu.
+    """
+    chapter = _CHAPTER.search(text)
+    keywords = _KEYWORDS.search(text)
+    if not chapter or not keywords:
+        return None, [], []
+
+    # Thuật ngữ có thể bị ngắt dòng ("risk \nmonitoring", "risk-\nbased")
+    joined = re.sub(r"-\s*\n\s*", "-", keywords.group(1).strip())
+    terms = [re.sub(r"\s+", " ", term).strip() for term in joined.split(",")]
+
+    objectives = []
+    lines = [line.strip() for line in text[keywords.end():].splitlines()]
+    for line in lines:
+        match = _OBJECTIVE.match(line)
+        if match:
+            objectives.append(list(match.groups()))
+        elif objectives and line and not _SECTION.match(line):
+            # Mục tiêu dài bị ngắt sang dòng sau
+            objectives[-1][2] += " " + line
+    objectives = [(code, level, re.sub(r"\s+", " ", content).strip()) for code, level, content in objectives]
+    return int(chapter.group(1)), objectives, [term for term in terms if term]
+
+
+def extract_entries(data_path=DATA_PATH):
+    """
+    Các mục của ngân hàng câu trả lời trong mọi file PDF: mỗi mục tiêu học tập (FL-x.y.z) và mỗi thuật ngữ
+    (không trùng). Mỗi mục có câu hỏi chính (tiếng Anh) và các cách hỏi ngắn khác (mã mục tiêu, thuật ngữ).
+    """
+    entries = {}
+    for path in sorted(glob.glob(os.path.join(data_path, "*.pdf"))):
+        for page_number, page in enumerate(PdfReader(path).pages):
+            chapter, objectives, terms = parse_chapter_page(page.extract_text(extraction_mode="plain"))
+            for code, level, content in objectives:
+                entries.setdefault(code, {
+                    "id": code, "kind": "objective", "text": content, "level": level, "chapter": chapter,
+                    "page": page_number, "question": content, "aliases": [code],
+                })
+            for term in terms:
+                entries.setdefault(f"term:{normalize_question(term)}", {
+                    "id": f"term:{normalize_question(term)}", "kind": "term", "text": term, "chapter": chapter,
+                    "page": page_number, "question": f"What is {term}?", "aliases": [term],
+                })
+    return list(entries.values())
+
+
+def entry_hash(entry):
+    """Hash định nghĩa của một mục: đổi nội dung mục tiêu/thuật ngữ hoặc BANK_VERSION thì phải sinh lại."""
+    payload = f"{BANK_VERSION}\x00{entry['kind']}\x00{entry['id']}\x00{entry['text']}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def row_id(entry, language, question):
+    return str(uuid.uuid5(BANK_ID_NAMESPACE, f"{entry['id']}\x00{language}\x00{normalize_question(question)}"))
+
+
+def current_chunk_hashes(data_path=DATA_PATH):
+    """content_hash của mọi chunk trong PDF hiện tại (cùng cách chia với scripts/ingest_data.py)."""
+    return {chunk.metadata["content_hash"]
+            for _, _, chunks in iter_pdf_chunks(data_path) for chunk in chunks}
+
+
+def fetch_bank(store):
+    """Các mục đã có trong ngân hàng: {mã mục: {"ids", "entry_hashes", "chunk_hashes", "languages"}}."""
+    bank = {}
+    for row_id_, metadata in store.rows_by_source(ANSWER_BANK_SOURCE):
+        info = bank.setdefault(metadata.get("entry_id"), {
+            "ids": [], "entry_hashes": set(), "chunk_hashes": set(), "languages": set()})
+        info["ids"].append(row_id_)
+        info["entry_hashes"].add(metadata.get("entry_hash"))
+        info["chunk_hashes"].update(metadata.get("chunk_hashes") or [])
+        info["languages"].add(metadata.get("language"))
+    return bank
+
+
+def is_fresh(entry, info, chunk_hashes):
+    """Mục không cần sinh lại: cùng định nghĩa, đủ hai ngôn ngữ và mọi chunk nguồn vẫn còn nguyên trong PDF."""
+    return bool(info is not None
+                and info["entry_hashes"] == {entry_hash(entry)}
+                and info["languages"] >= set(LANGUAGES)
+                and info["chunk_hashes"]
+                and info["chunk_hashes"] <= chunk_hashes)
+
+
+class AnswerBankBuilder:
+    """
+    Sinh câu trả lời cho từng mục bằng chính luồng RAG của Chatbot (chỉ dựa trên giáo trình), rồi dịch câu hỏi
+    và câu trả lời sang tiếng Việt. Các mục chạy song song trên thread pool, mọi lời gọi chat qua RateLimiter.
+    """
+
+    def __init__(self, bot, chunk_hashes, workers=BANK_WORKERS, limiter=None):
+        self.bot = bot
+        self.chunk_hashes = chunk_hashes
+        self.workers = workers
+        self.limiter = limiter or RateLimiter(CHAT_RPM, CHAT_TPM)
+
+    def _translate(self, text):
+        self.limiter.acquire(2 * count_tokens(text) + 50)
+        return translate_text(text, "Vietnamese")
+
+    def generate(self, entry):
+        """Các dòng (id, câu hỏi, câu trả lời, None, metadata) của một mục; [] nếu giáo trình không có câu trả lời."""
+        self.limiter.acquire(CONTEXT_TOKEN_BUDGET + 500)
+        result = self.bot.answer_from_syllabus(entry["question"])
+        if result is None:
+            return []
+
+        chunk_hashes = sorted({source["content_hash"] for source in result["sources"] if source.get("content_hash")})
+        if not chunk_hashes or not set(chunk_hashes) <= self.chunk_hashes:
+            raise RuntimeError("Vector store chưa khớp với PDF hiện tại, hãy chạy scripts/ingest_data.py trước")
+        # Chỉ giữ nguồn và trang (đủ để hiển thị), không lưu lại toàn bộ metadata của chunk
+        pages = dict.fromkeys((source.get("source"), source.get("page")) for source in result["sources"])
+        metadata = {
+            "source": ANSWER_BANK_SOURCE,
+            "entry_id": entry["id"],
+            "entry_kind": entry["kind"],
+            "entry_hash": entry_hash(entry),
+            "chunk_hashes": chunk_hashes,
+            "sources": [{"source": source, "page": page} for source, page in pages],
+        }
+
+        answers = {"en": result["answer"], "vi": self._translate(result["answer"])}
+        if answers["vi"] == answers["en"]:
+            # translate_text trả về nguyên văn khi lỗi: để lần chạy sau sinh lại mục này
+            raise RuntimeError("Không dịch được câu trả lời sang tiếng Việt")
+        questions = {"en": [entry["question"], *entry["aliases"]]}
+        # Mã mục tiêu (FL-x.y.z) giống nhau ở mọi ngôn ngữ nên chỉ có ở bản tiếng Anh
+        translated = [entry["question"], *(entry["aliases"] if entry["kind"] == "term" else [])]
+        english = {normalize_question(question) for question in questions["en"]}
+        # Bản dịch trùng nguyên văn tiếng Anh (thuật ngữ giữ nguyên) thì bỏ, tránh hai dòng cùng hash câu hỏi
+        questions["vi"] = [question for question in map(self._translate, translated)
+                           if normalize_question(question) not in english]
+
+        return [
+            (row_id(entry, language, question), question, answers[language], None, {**metadata, "language": language})
+            for language in LANGUAGES
+            for question in dict.fromkeys(questions[language])
+        ]
+
+    def run(self, entries, write):
+        """Sinh song song, gọi write(rows) theo từng lô. Trả về (mã các mục đã ghi, mã các mục không có câu trả lời, {mã: lỗi})."""
+        written, not_found, errors, pending = set(), [], {}, []
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            futures = {pool.submit(self.generate, entry): entry for entry in entries}
+            for done, future in enumerate(as_completed(futures), 1):
+                entry = futures[future]
+                try:
+                    rows = future.result()
+                except Exception as e:
+                    errors[entry["id"]] = str(e)
+                    continue
+                if not rows:
+                    not_found.append(entry["id"])
+                    continue
+                written.add(entry["id"])
+                pending.extend(rows)
+                if len(pending) >= WRITE_BATCH_SIZE:
+                    write(pending)
+                    pending = []
+                if done % 20 == 0:
+                    print(f"  Đã xử lý {done}/{len(entries)} mục...")
+        if pending:
+            write(pending)
+        return written, not_found, errors
+
+
+def build_answer_bank(data_path=DATA_PATH, force=False):
+    print("Đọc mục tiêu học tập và thuật ngữ từ giáo trình...")
+    entries = extract_entries(data_path)
+    if not entries:
+        print(f"Không tìm thấy mục tiêu học tập/thuật ngữ nào trong {data_path}.")
+        return
+    print(f"Tìm thấy {sum(e['kind'] == 'objective' for e in entries)} mục tiêu học tập "
+          f"và {sum(e['kind'] == 'term' for e in entries)} thuật ngữ.")
+
+    bot = Chatbot(learn=False)
+    store = bot.approved_qa
+    chunk_hashes = current_chunk_hashes(data_path)
+    bank = fetch_bank(store)
+
+    stale = [entry for entry in entries if force or not is_fresh(entry, bank.get(entry["id"]), chunk_hashes)]
+    removed = [info for entry_id, info in bank.items() if entry_id not in {entry["id"] for entry in entries}]
+    print(f"Cần sinh: {len(stale)}, không đổi: {len(entries) - len(stale)}, mục đã bỏ: {len(removed)}.")
+
+    new_ids = set()
+
+    def write(rows):
+        new_ids.update(store.put_approved(rows))
+
+    written, not_found, errors = AnswerBankBuilder(bot, chunk_hashes).run(stale, write) if stale else (set(), [], {})
+
+    # Dòng cũ của các mục vừa sinh lại (cách hỏi đổi, nguồn đổi, giờ không còn câu trả lời) và của mục đã bỏ;
+    # mục bị lỗi giữ nguyên dòng cũ để lần chạy sau thử lại
+    stale_ids = [row for info in removed for row in info["ids"]]
+    for entry in stale:
+        if entry["id"] not in errors and entry["id"] in bank:
+            stale_ids.extend(row for row in bank[entry["id"]]["ids"] if row not in new_ids)
+    if stale_ids:
+        store.delete(stale_ids)
+
+    bot.learning_queue.close()
+    print(f"Đã ghi {len(written)} mục ({len(new_ids)} câu hỏi), xoá {len(stale_ids)} dòng cũ, "
+          f"{len(not_found)} mục giáo trình không có câu trả lời, {len(errors)} lỗi.")
+    for entry_id, error in list(errors.items())[:10]:
+        print(f"  Lỗi {entry_id}: {error}")
+    return {"written": len(written), "rows": len(new_ids), "deleted": len(stale_ids),
+            "not_found": not_found, "errors": errors}
+
+
+if __name__ == "__main__":
+    build_answer_bank(force="--force" in sys.argv[1:])
@@ -1,10 +1,24 @@
 import os
+import sys
+import hashlib
+import threading
+import time
+import uuid
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFDirectoryLoader
+from langchain_core.documents import Document
+from pypdf import PdfReader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import SupabaseVectorStore
-from langchain_openai import OpenAIEmbeddings
-from supabase import Client, create_client
+
+# Cho phép import package src khi chạy trực tiếp `python scripts/ingest_data.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.answer_cache import bump_corpus_version
+from src.clients import create_embeddings, get_supabase_client
+from src.rate_limit import RateLimiter
+from src.lexical_index import LexicalIndex
+from src.local_vector_store import LocalVectorStore, VECTOR_BACKEND, LOCAL_VECTOR_STORE_PATH
 
 load_dotenv()
 
@@ -12,40 +26,333 @@ DATA_PATH = "data/"
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
-def create_vector_db():
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        print("Lỗi: Vui lòng cung cấp SUPABASE_URL và SUPABASE_KEY trong file .env")
-        return
+TABLE_NAME = "documents"
+# Namespace cố định để id của chunk (uuid5 từ content hash) luôn ổn định giữa các lần chạy
+CHUNK_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "istqb-chatbot/documents")
+PAGE_SIZE = 1000
+DELETE_BATCH_SIZE = 200
+
+# Cấu hình song song và giới hạn tốc độ của OpenAI Embeddings (có thể chỉnh trong .env)
+PARSE_WORKERS = int(os.environ.get("INGEST_PARSE_WORKERS", str(os.cpu_count() or 2)))
+EMBED_WORKERS = int(os.environ.get("INGEST_EMBED_WORKERS", "4"))
+INSERT_WORKERS = int(os.environ.get("INGEST_INSERT_WORKERS", "2"))
+PAGES_PER_TASK = int(os.environ.get("INGEST_PAGES_PER_TASK", "8"))
+EMBED_BATCH_SIZE = int(os.environ.get("INGEST_EMBED_BATCH_SIZE", "100"))
+EMBEDDING_RPM = int(os.environ.get("EMBEDDING_RPM", "3000"))
+EMBEDDING_TPM = int(os.environ.get("EMBEDDING_TPM", "1000000"))
+
+
+def chunk_hash(chunk):
+    """
+    Hash nội dung ổn định của một chunk: nguồn (chuẩn hoá đường dẫn) và nội dung.
+    Không gồm số trang: chèn thêm một trang không làm các chunk phía sau phải embed lại
+    (vị trí mới của chúng được cập nhật vào metadata, xem chunk_location).
+    """
+    source = str(chunk.metadata.get("source", "")).replace("\\", "/")
+    payload = f"{source}\x00{chunk.page_content}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
 
-    print("Bắt đầu tải tài liệu...")
-    loader = PyPDFDirectoryLoader(DATA_PATH)
-    documents = loader.load()
-    print(f"Đã tải {len(documents)} trang.")
+def chunk_location(metadata):
+    """Vị trí của chunk (nguồn, trang, start_index) dạng chuỗi, để so sánh metadata đã lưu với lần đọc mới."""
+    return tuple(str(metadata.get(key)) for key in ("source", "page", "start_index"))
 
-    print("Bắt đầu chia nhỏ văn bản...")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+
+def chunk_id(content_hash):
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, content_hash))
+
+
+def split_pdf_pages(path, start, stop):
+    """
+    Đọc và chia nhỏ các trang [start, stop) của một file PDF (chạy trong process con).
+    Metadata giống PyPDFLoader (source, page, page_label), mỗi chunk kèm start_index và content_hash.
+    Văn bản mỗi trang được strip() như PyPDFParser của langchain-community.
+    """
+    reader = PdfReader(path)
+    documents = [
+        Document(
+            page_content=reader.pages[page_number].extract_text(extraction_mode="plain").strip(),
+            metadata={
+                "source": path,
+                "page": page_number,
+                "page_label": reader.page_labels[page_number],
+                "total_pages": len(reader.pages),
+            },
+        )
+        for page_number in range(start, stop)
+    ]
+    # start_index: vị trí của chunk trong trang, để chatbot ghép lại các chunk liền nhau khi dựng ngữ cảnh
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100, add_start_index=True)
     chunks = text_splitter.split_documents(documents)
+    for chunk in chunks:
+        chunk.metadata["content_hash"] = chunk_hash(chunk)
+    return path, len(documents), chunks
+
+
+def iter_pdf_chunks(data_path=DATA_PATH, workers=PARSE_WORKERS, pages_per_task=PAGES_PER_TASK):
+    """
+    Đọc song song các file PDF trong data_path bằng process pool, mỗi tác vụ xử lý
+    một dải trang; trả về (file, số trang, chunks) ngay khi từng tác vụ xong.
+    """
+    # Đường dẫn dạng str(Path) như PyPDFDirectoryLoader (dấu phân cách của hệ điều hành)
+    paths = sorted(str(path) for path in Path(data_path).glob("*.pdf"))
+    if not paths:
+        return
+    tasks = []
+    for path in paths:
+        page_count = len(PdfReader(path).pages)
+        tasks.extend((path, start, min(start + pages_per_task, page_count))
+                     for start in range(0, page_count, pages_per_task))
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(tasks)))) as pool:
+        futures = [pool.submit(split_pdf_pages, *task) for task in tasks]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def load_chunks():
+    """Đọc tất cả file PDF trong DATA_PATH và chia thành chunk, mỗi chunk kèm content_hash trong metadata."""
+    print("Bắt đầu tải và chia nhỏ tài liệu...")
+    chunks = []
+    for _, _, file_chunks in iter_pdf_chunks():
+        chunks.extend(file_chunks)
     print(f"Đã chia thành {len(chunks)} chunks.")
+    return chunks
+
+
+class IngestProgress:
+    """Theo dõi tiến độ và thông lượng của quá trình ingest."""
+
+    def __init__(self, report_interval=5.0):
+        self.started_at = time.monotonic()
+        self.report_interval = report_interval
+        self._last_report = self.started_at
+        self._lock = threading.Lock()
+        self.parsed = 0
+        self.queued = 0
+        self.embedded = 0
+        self.inserted = 0
+        self.tokens = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+            now = time.monotonic()
+            if now - self._last_report >= self.report_interval:
+                self._last_report = now
+                print(self.summary())
 
-    print("Bắt đầu lưu trữ vector vào Supabase...")
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return (
+            f"[{elapsed:6.1f}s] đã chia {self.parsed} | cần embed {self.queued} | "
+            f"đã embed {self.embedded} | đã lưu {self.inserted} | "
+            f"{self.embedded / elapsed:.1f} chunks/s | {self.tokens / elapsed:.0f} tokens/s"
+        )
 
-    # Xóa dữ liệu cũ để đảm bảo sạch sẽ (tùy chọn)
+
+def count_tokens(texts):
     try:
-        supabase.table('documents').delete().gt('id', -1).execute()
-        print("Đã xóa dữ liệu cũ trong bảng 'documents'.")
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return sum(len(tokens) for tokens in encoding.encode_batch(texts))
     except Exception:
-        print("Bảng 'documents' chưa tồn tại, sẽ được tạo mới.")
+        return sum(len(text) for text in texts) // 4
+
+
+def fetch_manifest(supabase):
+    """
+    Lấy danh sách chunk PDF đã lưu trong bảng documents: {content_hash: [(id, vị trí), ...]}
+    (vị trí theo chunk_location).
+    Các dòng PDF cũ chưa có content_hash được trả về riêng để xoá.
+    Các dòng không phải PDF (câu hỏi/đáp tự học...) không bao giờ được đụng tới.
+    """
+    manifest, legacy_ids = {}, []
+    offset = 0
+    while True:
+        rows = (
+            supabase.table(TABLE_NAME)
+            .select("id, metadata->>content_hash, metadata->>source, metadata->>page, metadata->>start_index")
+            .ilike("metadata->>source", "%.pdf")
+            .order("id")
+            .range(offset, offset + PAGE_SIZE - 1)
+            .execute()
+            .data
+        )
+        for row in rows:
+            if row.get("content_hash"):
+                manifest.setdefault(row["content_hash"], []).append((row["id"], chunk_location(row)))
+            else:
+                legacy_ids.append(row["id"])
+        if len(rows) < PAGE_SIZE:
+            return manifest, legacy_ids
+        offset += PAGE_SIZE
+
+
+def fetch_local_manifest(vector_store):
+    """Giống fetch_manifest nhưng đọc từ LocalVectorStore (VECTOR_BACKEND=local)."""
+    manifest, legacy_ids = {}, []
+    for row_id, metadata in vector_store.rows():
+        if not str(metadata.get("source", "")).lower().endswith(".pdf"):
+            continue
+        if metadata.get("content_hash"):
+            manifest.setdefault(metadata["content_hash"], []).append((row_id, chunk_location(metadata)))
+        else:
+            legacy_ids.append(row_id)
+    return manifest, legacy_ids
+
+
+def delete_rows(supabase, ids):
+    for i in range(0, len(ids), DELETE_BATCH_SIZE):
+        supabase.table(TABLE_NAME).delete().in_("id", ids[i:i + DELETE_BATCH_SIZE]).execute()
+
+
+def update_metadata_rows(supabase, metadata_by_id):
+    for row_id, metadata in metadata_by_id.items():
+        supabase.table(TABLE_NAME).update({"metadata": metadata}).eq("id", row_id).execute()
+
+
+class EmbeddingPipeline:
+    """
+    Embed các lô chunk bằng một nhóm worker song song (tôn trọng giới hạn RPM/TPM),
+    đồng thời lưu các lô đã embed vào Supabase trên một nhóm worker khác.
+    """
+
+    def __init__(self, vector_store, progress, embed_workers=EMBED_WORKERS, insert_workers=INSERT_WORKERS,
+                 batch_size=EMBED_BATCH_SIZE, rate_limiter=None):
+        self.vector_store = vector_store
+        self.progress = progress
+        self.batch_size = batch_size
+        self.rate_limiter = rate_limiter or RateLimiter(EMBEDDING_RPM, EMBEDDING_TPM)
+        self._embed_pool = ThreadPoolExecutor(max_workers=embed_workers, thread_name_prefix="embed")
+        self._insert_pool = ThreadPoolExecutor(max_workers=insert_workers, thread_name_prefix="insert")
+        self._pending = []
+        self._buffer = []
+
+    def submit(self, chunks):
+        """Đưa chunk vào pipeline; mỗi khi đủ một lô sẽ gửi đi embed ngay."""
+        self._buffer.extend(chunks)
+        self.progress.add(queued=len(chunks))
+        while len(self._buffer) >= self.batch_size:
+            self._submit_batch(self._buffer[:self.batch_size])
+            self._buffer = self._buffer[self.batch_size:]
+
+    def _submit_batch(self, batch):
+        self._pending.append(self._embed_pool.submit(self._embed_batch, batch))
+
+    def _embed_batch(self, batch):
+        texts = [chunk.page_content for chunk in batch]
+        tokens = count_tokens(texts)
+        self.rate_limiter.acquire(tokens)
+        vectors = self.vector_store.embeddings.embed_documents(texts)
+        self.progress.add(embedded=len(batch), tokens=tokens)
+        return self._insert_pool.submit(self._insert_batch, batch, vectors)
+
+    def _insert_batch(self, batch, vectors):
+        self.vector_store.add_vectors(
+            vectors,
+            batch,
+            [chunk_id(chunk.metadata["content_hash"]) for chunk in batch],
+        )
+        self.progress.add(inserted=len(batch))
+
+    def finish(self):
+        """Gửi lô cuối, chờ mọi lô embed và insert hoàn tất (lỗi đầu tiên sẽ được ném ra)."""
+        if self._buffer:
+            self._submit_batch(self._buffer)
+            self._buffer = []
+        try:
+            for embed_future in self._pending:
+                embed_future.result().result()
+        finally:
+            self._embed_pool.shutdown(cancel_futures=True)
+            self._insert_pool.shutdown()
+
+
+def create_vector_db(backend=VECTOR_BACKEND, data_path=DATA_PATH):
+    progress = IngestProgress()
+    embeddings = create_embeddings(model="text-embedding-3-small")
+
+    if backend == "local":
+        vector_store = LocalVectorStore(LOCAL_VECTOR_STORE_PATH, embeddings)
+        read_manifest = lambda: fetch_local_manifest(vector_store)
+        delete_stale = vector_store.delete
+        update_moved = vector_store.update_metadata
+    else:
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            print("Lỗi: Vui lòng cung cấp SUPABASE_URL và SUPABASE_KEY trong file .env")
+            return
+        supabase = get_supabase_client(SUPABASE_URL, SUPABASE_KEY)
+        vector_store = SupabaseVectorStore(
+            client=supabase,
+            embedding=embeddings,
+            table_name=TABLE_NAME,
+            chunk_size=500
+        )
+        read_manifest = lambda: fetch_manifest(supabase)
+        delete_stale = lambda ids: delete_rows(supabase, ids)
+        update_moved = lambda metadata_by_id: update_metadata_rows(supabase, metadata_by_id)
+
+    # Lấy manifest song song với việc đọc PDF
+    print(f"Bắt đầu tải và chia nhỏ tài liệu, đồng thời đọc dữ liệu đã lưu ({backend})...")
+    with ThreadPoolExecutor(max_workers=1) as manifest_pool:
+        manifest_future = manifest_pool.submit(read_manifest)
+
+        pipeline = EmbeddingPipeline(vector_store, progress)
+        current = {}
+        try:
+            for _, _, file_chunks in iter_pdf_chunks(data_path):
+                progress.add(parsed=len(file_chunks))
+                manifest, legacy_ids = manifest_future.result()
+
+                new_chunks = []
+                for chunk in file_chunks:
+                    content_hash = chunk.metadata["content_hash"]
+                    if content_hash in current:
+                        continue
+                    current[content_hash] = chunk
+                    if content_hash not in manifest:
+                        new_chunks.append(chunk)
+                # Chunk mới/thay đổi được embed ngay trong khi các trang khác vẫn đang được đọc
+                pipeline.submit(new_chunks)
+        finally:
+            pipeline.finish()
+
+    manifest, legacy_ids = manifest_future.result()
+    stale_ids = list(legacy_ids)
+    moved = {}
+    for content_hash, stored in manifest.items():
+        # Chunk đã bị xoá/sửa trong PDF, hoặc bị lưu trùng nhiều lần
+        ids = [row_id for row_id, _ in stored]
+        stale_ids.extend(ids if content_hash not in current else ids[1:])
+        # Chunk không đổi nhưng đã dời chỗ (ví dụ có trang mới chèn phía trước): chỉ cập nhật metadata
+        if content_hash in current and stored[0][1] != chunk_location(current[content_hash].metadata):
+            moved[stored[0][0]] = current[content_hash].metadata
+
+    print(f"Chunk mới/thay đổi: {progress.queued}, không đổi: {len(current) - progress.queued}, "
+          f"dời chỗ: {len(moved)}, cần xoá: {len(stale_ids)}.")
+    if stale_ids:
+        delete_stale(stale_ids)
+        print(f"Đã xoá {len(stale_ids)} chunk cũ.")
+    if moved:
+        update_moved(moved)
+        print(f"Đã cập nhật vị trí của {len(moved)} chunk.")
+
+    # Cập nhật từng phần chỉ mục BM25 theo content_hash
+    lexical_index = LexicalIndex()
+    added, removed, updated = lexical_index.sync(current)
+    if added or removed or updated or not os.path.exists(lexical_index.path):
+        lexical_index.save()
+        print(f"Đã cập nhật chỉ mục BM25: thêm {added}, xoá {removed}, cập nhật vị trí {updated} chunk.")
+
+    print(progress.summary())
+    if not progress.queued and not stale_ids and not moved:
+        print("Dữ liệu đã cập nhật, không cần làm gì thêm.")
+        return
 
-    SupabaseVectorStore.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        client=supabase,
-        table_name="documents",
-        chunk_size=500
-    )
-    print("Hoàn tất! Dữ liệu đã được lưu vào Supabase.")
+    # Báo cho cache câu trả lời của chatbot biết tài liệu đã thay đổi
+    bump_corpus_version()
+    print(f"Hoàn tất! Dữ liệu đã được lưu vào {backend}.")
 
 if __name__ == "__main__":
-    create_vector_db()
\ No newline at end of file
+    create_vector_db()
@@ -0,0 +1,64 @@
+-- Chạy trong Supabase SQL Editor (một lần): kho hỏi/đáp tự học tách khỏi bảng documents của giáo trình.
+-- Mỗi dòng: content = "Question: ...\nAnswer: ...", embedding = embedding của câu hỏi,
+-- metadata = {source, status ('pending' | 'approved'), question, answer, question_hash}.
+-- Ngân hàng câu trả lời sinh sẵn (scripts/build_answer_bank.py, source = 'ISTQB_Answer_Bank') thêm
+-- language, entry_id, entry_hash, chunk_hashes và sources (các trang giáo trình đã dùng).
+
+create table if not exists qa_pairs (
+  id uuid primary key default gen_random_uuid(),
+  content text,
+  metadata jsonb,
+  embedding vector(1536)
+);
+
+-- Tra cứu theo hash câu hỏi và danh sách chờ duyệt của trang Admin (đếm, phân trang keyset theo id)
+create index if not exists qa_pairs_question_hash_idx on qa_pairs ((metadata->>'question_hash'));
+create index if not exists qa_pairs_status_id_idx on qa_pairs ((metadata->>'status'), id);
+-- Đọc lại ngân hàng câu trả lời khi sinh lại từng phần
+create index if not exists qa_pairs_source_id_idx on qa_pairs ((metadata->>'source'), id);
+create index if not exists qa_pairs_embedding_idx on qa_pairs using hnsw (embedding vector_cosine_ops);
+
+-- Giống match_documents nhưng trên qa_pairs (chatbot luôn lọc {"status": "approved"})
+create or replace function match_qa_pairs(query_embedding vector(1536), filter jsonb default '{}')
+returns table (id uuid, content text, metadata jsonb, similarity float)
+language plpgsql
+as $$
+begin
+  return query
+  select qa_pairs.id, qa_pairs.content, qa_pairs.metadata,
+         1 - (qa_pairs.embedding <=> query_embedding) as similarity
+  from qa_pairs
+  where qa_pairs.metadata @> filter
+  order by qa_pairs.embedding <=> query_embedding;
+end;
+$$;
+
+-- Đổi metadata->>'status' của nhiều dòng trong một câu lệnh (trang Admin duyệt hàng loạt).
+-- Trả về số dòng đã được cập nhật.
+create or replace function set_qa_pairs_status(pair_ids uuid[], new_status text)
+returns integer
+language sql
+as $$
+  with updated as (
+    update qa_pairs
+    set metadata = jsonb_set(coalesce(metadata, '{}'::jsonb), '{status}', to_jsonb(new_status))
+    where id = any(pair_ids)
+    returning 1
+  )
+  select count(*)::integer from updated;
+$$;
+
+-- Chuyển các câu tự học cũ từ documents sang qa_pairs. Embedding cũ là của cả câu hỏi lẫn câu trả lời:
+-- các câu này vẫn khớp theo hash câu hỏi, còn khớp theo embedding thì kém chính xác hơn.
+with moved as (
+  delete from documents
+  where metadata->>'source' = 'OpenAI_Generated_Q&A'
+  returning id, content, metadata, embedding
+)
+insert into qa_pairs (id, content, metadata, embedding)
+select id, content,
+       metadata || jsonb_build_object(
+         'question', substring(content from '^Question: (.*?)\nAnswer: '),
+         'answer', substring(content from '\nAnswer: (.*)$')),
+       embedding
+from moved;
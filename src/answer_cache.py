@@ -0,0 +1,249 @@
+import asyncio
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# Thư mục lưu các file cache dùng chung giữa app và script ingest
+CACHE_DIR = os.environ.get("CHATBOT_CACHE_DIR", ".cache")
+CORPUS_VERSION_FILE = os.path.join(CACHE_DIR, "corpus_version")
+
+# Giá trị đánh dấu "không có trong cache" (phân biệt với kết quả None đã được cache)
+MISS = object()
+
+
+def normalize_question(text):
+    """Chuẩn hoá câu hỏi để so khớp chính xác: chữ thường, gộp khoảng trắng, bỏ dấu câu cuối."""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(" ?!.。")
+
+
+def read_corpus_version():
+    """Đọc phiên bản hiện tại của kho tài liệu (do scripts/ingest_data.py ghi ra)."""
+    try:
+        with open(CORPUS_VERSION_FILE, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return "0"
+
+
+def bump_corpus_version():
+    """Tăng phiên bản kho tài liệu để mọi cache câu trả lời tự huỷ."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    version = str(time.time_ns())
+    with open(CORPUS_VERSION_FILE, "w", encoding="utf-8") as f:
+        f.write(version)
+    return version
+
+
+class _Entry:
+    __slots__ = ("value", "embedding", "expires_at")
+
+    def __init__(self, value, embedding, expires_at):
+        self.value = value
+        self.embedding = embedding
+        self.expires_at = expires_at
+
+
+class _Flight:
+    """Một lời gọi upstream đang chạy, để các yêu cầu trùng lặp cùng chờ kết quả."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class AnswerCache:
+    """
+    Cache câu trả lời có TTL và LRU, tra cứu theo câu hỏi đã chuẩn hoá
+    hoặc theo độ tương đồng cosine của embedding câu hỏi.
+    Mỗi namespace (ví dụ 'syllabus', 'openai') có không gian khoá riêng.
+    """
+
+    def __init__(self, max_entries=1000, ttl_seconds=6 * 3600,
+                 similarity_threshold=0.95, version_check_interval=5.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.version_check_interval = version_check_interval
+
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._ainflight = {}
+        self._lock = threading.Lock()
+        self._matrix = {}  # namespace -> (danh sách khoá, ma trận embedding đã chuẩn hoá)
+
+        self._corpus_version = read_corpus_version()
+        self._version_checked_at = time.monotonic()
+
+    # --- Quản lý phiên bản kho tài liệu ---
+    def _check_corpus_version(self):
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_check_interval:
+            return
+        self._version_checked_at = now
+        version = read_corpus_version()
+        if version != self._corpus_version:
+            self._corpus_version = version
+            self._entries.clear()
+            self._matrix.clear()
+
+    def invalidate(self):
+        """Xoá toàn bộ cache (ví dụ sau khi nạp lại tài liệu)."""
+        with self._lock:
+            self._entries.clear()
+            self._matrix.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # --- Tra cứu ---
+    def _semantic_lookup(self, namespace, embedding, now):
+        if namespace not in self._matrix:
+            keys, vectors = [], []
+            for key, entry in self._entries.items():
+                if key[0] == namespace and entry.embedding is not None:
+                    keys.append(key)
+                    vectors.append(entry.embedding)
+            matrix = np.vstack(vectors) if vectors else None
+            self._matrix[namespace] = (keys, matrix)
+
+        keys, matrix = self._matrix[namespace]
+        if matrix is None:
+            return None
+
+        query = _unit(embedding)
+        scores = matrix @ query
+        for idx in np.argsort(-scores):
+            if scores[idx] < self.similarity_threshold:
+                break
+            entry = self._entries.get(keys[idx])
+            if entry is not None and entry.expires_at > now:
+                return keys[idx]
+        return None
+
+    def get(self, namespace, question, embedding=None):
+        """Trả về giá trị đã cache hoặc MISS."""
+        key = (namespace, normalize_question(question))
+        now = time.monotonic()
+        with self._lock:
+            self._check_corpus_version()
+
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                self._remove(key)
+                entry = None
+
+            if entry is None and embedding is not None:
+                similar_key = self._semantic_lookup(namespace, embedding, now)
+                if similar_key is not None:
+                    key, entry = similar_key, self._entries[similar_key]
+
+            if entry is None:
+                return MISS
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def put(self, namespace, question, value, embedding=None):
+        key = (namespace, normalize_question(question))
+        vector = _unit(embedding) if embedding is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(value, vector, time.monotonic() + self.ttl_seconds)
+            self._matrix.pop(namespace, None)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        self._matrix.pop(key[0], None)
+
+    # --- Single-flight ---
+    def get_or_compute(self, namespace, question, compute, embedding=None):
+        """
+        Trả về giá trị đã cache; nếu chưa có thì gọi compute() đúng một lần
+        cho mọi yêu cầu giống hệt nhau đang đến cùng lúc.
+        """
+        value = self.get(namespace, question, embedding)
+        if value is not MISS:
+            return value
+
+        key = (namespace, normalize_question(question))
+        with self._lock:
+            flight = self._inflight.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+
+        if not is_leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = compute()
+            self.put(namespace, question, value, embedding)
+            flight.value = value
+            return value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    async def aget_or_compute(self, namespace, question, compute, embedding=None):
+        """
+        Phiên bản async của get_or_compute; compute là hàm trả về coroutine.
+        Nếu task đang tính bị huỷ, các task đang chờ không bị huỷ theo: một trong số chúng tính lại.
+        """
+        key = (namespace, normalize_question(question))
+        loop = asyncio.get_running_loop()
+        while True:
+            value = self.get(namespace, question, embedding)
+            if value is not MISS:
+                return value
+            future = self._ainflight.get(key)
+            if future is None or future.get_loop() is not loop:
+                break
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # Chính task này bị huỷ
+                # Task đang tính bị huỷ (và đã bỏ future khỏi _ainflight): tra lại, task đầu tiên tới đây tính tiếp
+
+        future = loop.create_future()
+        self._ainflight[key] = future
+        try:
+            value = await compute()
+            self.put(namespace, question, value, embedding)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Đánh dấu đã xử lý để asyncio không cảnh báo khi không có ai chờ
+            raise
+        finally:
+            if self._ainflight.get(key) is future:
+                del self._ainflight[key]
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,229 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+
+from src.answer_cache import CACHE_DIR, normalize_question
+from src.telemetry import log_event
+
+# Bảng và hàm tìm kiếm của kho hỏi/đáp trên Supabase (tạo bằng sql/qa_pairs.sql)
+QA_TABLE_NAME = "qa_pairs"
+QA_QUERY_NAME = "match_qa_pairs"
+LOCAL_QA_STORE_PATH = os.environ.get("LOCAL_QA_STORE_PATH", os.path.join(CACHE_DIR, "qa_store"))
+# Độ tương đồng tối thiểu giữa câu hỏi mới và một câu hỏi đã duyệt để trả lời thẳng, không gọi LLM
+APPROVED_QA_THRESHOLD = float(os.environ.get("APPROVED_QA_THRESHOLD", "0.9"))
+# Số câu gần nhất được xét khi tra theo embedding, để ưu tiên câu trả lời cùng ngôn ngữ với người hỏi
+APPROVED_QA_CANDIDATES = int(os.environ.get("APPROVED_QA_CANDIDATES", "3"))
+# Chu kỳ (giây) tải lại danh sách hash câu hỏi đã duyệt (để thấy các câu vừa được Admin duyệt)
+APPROVED_QA_REFRESH_SECONDS = float(os.environ.get("APPROVED_QA_REFRESH_SECONDS", "60"))
+
+LEARNED_SOURCE = "OpenAI_Generated_Q&A"
+# Ngân hàng câu trả lời sinh sẵn từ giáo trình (scripts/build_answer_bank.py), lưu ở trạng thái đã duyệt
+ANSWER_BANK_SOURCE = "ISTQB_Answer_Bank"
+STATUS_PENDING = "pending"
+STATUS_APPROVED = "approved"
+PAGE_SIZE = 1000
+DELETE_BATCH_SIZE = 200
+
+
+def question_hash(question):
+    """Hash của câu hỏi đã chuẩn hoá (cùng cách chuẩn hoá với AnswerCache)."""
+    return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+
+
+class ApprovedQAStore:
+    """
+    Kho hỏi/đáp tự học, tách khỏi bảng documents của giáo trình.
+    Mỗi dòng có embedding của câu hỏi, câu trả lời nằm trong metadata. Câu chờ duyệt
+    được lưu cùng kho nhưng chỉ câu đã duyệt mới được tra cứu: trước theo hash câu hỏi
+    (bảng băm trong bộ nhớ), sau đó theo độ tương đồng embedding.
+    """
+
+    def __init__(self, vector_store, client=None, threshold=APPROVED_QA_THRESHOLD,
+                 refresh_seconds=APPROVED_QA_REFRESH_SECONDS):
+        self.vector_store = vector_store
+        # Client Supabase để đọc danh sách đã duyệt; None khi dùng LocalVectorStore
+        self.client = client
+        self.threshold = threshold
+        self.refresh_seconds = refresh_seconds
+        self._by_hash = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        # Cờ "đang tải lại nền" có khoá riêng, để người gọi không phải chờ khoá của lần tải đang chạy
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+
+    # --- Tra cứu ---
+    def lookup_by_hash(self, question, language="en"):
+        """
+        Câu trả lời đã duyệt cho đúng câu hỏi này (sau khi chuẩn hoá), hoặc None.
+        Ưu tiên câu trả lời bằng language; nếu không có thì trả về bản bằng ngôn ngữ khác
+        (kết quả luôn kèm "language" để người gọi dịch lại khi cần).
+        """
+        self._refresh()
+        by_language = self._by_hash.get(question_hash(question))
+        if not by_language:
+            return None
+        return _result(by_language.get(language) or next(iter(by_language.values())))
+
+    def lookup_by_embedding(self, embedding, language="en"):
+        """
+        Câu trả lời đã duyệt có câu hỏi gần nhất, nếu độ tương đồng đạt ngưỡng; ngược lại None.
+        Trong các câu đạt ngưỡng, ưu tiên câu trả lời bằng language (như lookup_by_hash).
+        """
+        self._reload_local()
+        try:
+            matches = self.vector_store.similarity_search_by_vector_with_relevance_scores(
+                embedding, k=APPROVED_QA_CANDIDATES, filter={"status": STATUS_APPROVED})
+        except Exception as e:
+            log_event("approved_qa_lookup_failed", logging.WARNING, error=str(e))
+            return None
+        candidates = [document.metadata for document, score in matches
+                      if score >= self.threshold and document.metadata.get("answer")]
+        if not candidates:
+            return None
+        same_language = [metadata for metadata in candidates if _language(metadata) == language]
+        return _result((same_language or candidates)[0])
+
+    def preload(self):
+        """Tải trước danh sách đã duyệt (khởi động nóng), để lượt hỏi đầu tiên không phải chờ."""
+        self._refresh()
+
+    def invalidate(self):
+        """Buộc tải lại danh sách đã duyệt ở lần tra cứu tiếp theo."""
+        self._loaded_at = None
+
+    def _refresh(self):
+        """
+        Chỉ lần tải đầu tiên (hoặc sau invalidate) mới chặn người gọi; khi danh sách đã cũ,
+        tra cứu vẫn dùng bản hiện có và việc tải lại chạy trên một luồng nền.
+        """
+        if self._loaded_at is None:
+            self._reload()
+        elif time.monotonic() - self._loaded_at >= self.refresh_seconds:
+            with self._refresh_lock:
+                if self._refreshing:
+                    return
+                self._refreshing = True
+            threading.Thread(target=self._background_reload, name="approved-qa-refresh", daemon=True).start()
+
+    def _background_reload(self):
+        try:
+            self._reload()
+        finally:
+            self._refreshing = False
+
+    def _reload(self):
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+                return
+            try:
+                # hash câu hỏi -> {ngôn ngữ câu trả lời: metadata}
+                by_hash = {}
+                for metadata in self._fetch_approved():
+                    if metadata.get("answer"):
+                        key = metadata.get("question_hash") or question_hash(metadata.get("question", ""))
+                        by_hash.setdefault(key, {})[_language(metadata)] = metadata
+                self._by_hash = by_hash
+            except Exception as e:
+                log_event("approved_qa_refresh_failed", logging.WARNING, error=str(e))
+            self._loaded_at = time.monotonic()
+
+    def _fetch_approved(self):
+        """Metadata của mọi câu đã duyệt (không tải embedding)."""
+        return [metadata for _, metadata in self._fetch(status=STATUS_APPROVED)]
+
+    def rows_by_source(self, source):
+        """Danh sách (id, metadata) của mọi dòng có metadata.source này (không tải embedding)."""
+        return self._fetch(source=source)
+
+    def _reload_local(self):
+        # LocalVectorStore: kho có thể đã được tiến trình khác ghi lại (job ngân hàng câu trả lời)
+        if self.client is None:
+            self.vector_store.reload_if_changed()
+
+    def _fetch(self, **filters):
+        if self.client is None:
+            self._reload_local()
+            return [(row_id, metadata) for row_id, metadata in self.vector_store.rows()
+                    if all(metadata.get(key) == value for key, value in filters.items())]
+        rows, offset = [], 0
+        while True:
+            query = self.client.table(QA_TABLE_NAME).select("id, metadata")
+            for key, value in filters.items():
+                query = query.eq(f"metadata->>{key}", value)
+            page = query.order("id").range(offset, offset + PAGE_SIZE - 1).execute().data
+            rows.extend((row["id"], row["metadata"]) for row in page)
+            if len(page) < PAGE_SIZE:
+                return rows
+            offset += PAGE_SIZE
+
+    # --- Ghi ---
+    def add_pending(self, items):
+        """
+        Lưu các bộ (câu hỏi, câu trả lời, embedding câu hỏi hoặc None, ngôn ngữ hoặc None = tiếng Anh)
+        ở trạng thái chờ duyệt. Chỉ các câu chưa có embedding mới được embed, trong một lời gọi cho cả lô.
+        """
+        rows = [
+            (str(uuid.uuid4()), question, answer_text, embedding,
+             {"source": LEARNED_SOURCE, "status": STATUS_PENDING, **({"language": language} if language else {})})
+            for question, answer_text, embedding, language in items
+        ]
+        return self._write(rows)
+
+    def put_approved(self, items):
+        """
+        Ghi (ghi đè theo id) các bộ (id, câu hỏi, câu trả lời, embedding câu hỏi hoặc None, metadata thêm)
+        ở trạng thái đã duyệt, dùng được ngay không qua Admin (ngân hàng câu trả lời sinh sẵn).
+        """
+        rows = [(row_id, question, answer_text, embedding, {**extra, "status": STATUS_APPROVED})
+                for row_id, question, answer_text, embedding, extra in items]
+        ids = self._write(rows)
+        self.invalidate()
+        return ids
+
+    def delete(self, ids):
+        """Xoá các dòng theo id."""
+        ids = [str(i) for i in ids]
+        if self.client is None:
+            self.vector_store.delete(ids)
+        else:
+            for i in range(0, len(ids), DELETE_BATCH_SIZE):
+                self.client.table(QA_TABLE_NAME).delete().in_("id", ids[i:i + DELETE_BATCH_SIZE]).execute()
+        self.invalidate()
+
+    def _write(self, rows):
+        # Import muộn: trang Admin chỉ cần các hằng số của module này, không cần LangChain
+        from langchain_core.documents import Document
+
+        if not rows:
+            return []
+        missing = [question for _, question, _, embedding, _ in rows if embedding is None]
+        computed = iter(self.vector_store.embeddings.embed_documents(missing) if missing else [])
+        vectors = [embedding if embedding is not None else next(computed) for _, _, _, embedding, _ in rows]
+        documents = [
+            Document(
+                page_content=f"Question: {question}\nAnswer: {answer_text}",
+                metadata={
+                    **extra,
+                    "question": question,
+                    "answer": answer_text,
+                    "question_hash": question_hash(question),
+                },
+            )
+            for _, question, answer_text, _, extra in rows
+        ]
+        return self.vector_store.add_vectors(vectors, documents, [row_id for row_id, *_ in rows])
+
+
+def _language(metadata):
+    # Câu trả lời học từ luồng dịch (không có "language") là tiếng Anh
+    return metadata.get("language", "en")
+
+
+def _result(metadata):
+    # Câu trong ngân hàng câu trả lời kèm nguồn là các trang giáo trình đã dùng để sinh ra nó
+    sources = metadata.get("sources") or [{"source": LEARNED_SOURCE, "page": None}]
+    return {"answer": metadata["answer"], "sources": sources, "language": _language(metadata)}
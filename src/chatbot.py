@@ -1,11 +1,24 @@
 import os
+import re
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 from langchain_community.vectorstores import SupabaseVectorStore
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain.schema.runnable import RunnablePassthrough
 from langchain.schema.output_parser import StrOutputParser
-from supabase import create_client, Client
+from langchain_core.callbacks import BaseCallbackHandler
+from src.answer_cache import AnswerCache, MISS
+from src.clients import create_chat_model, create_embeddings, get_supabase_client
+from src.context_builder import ContextBuilder
+from src.embedding_batcher import BatchingEmbeddings
+from src.approved_qa import ApprovedQAStore, QA_TABLE_NAME, QA_QUERY_NAME, LOCAL_QA_STORE_PATH
+from src.learning_queue import LearningQueue
+from src.local_vector_store import LocalVectorStore, VECTOR_BACKEND, LOCAL_VECTOR_STORE_PATH
+from src.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from src.telemetry import log_event, telemetry as default_telemetry
 
 # Tải biến môi trường
 load_dotenv()
@@ -13,82 +26,637 @@ load_dotenv()
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
+# Ngưỡng độ tương đồng (similarity của match_documents) để định tuyến câu hỏi:
+# >= RAG_SCORE_THRESHOLD: chắc chắn thuộc giáo trình, < FALLBACK_SCORE_THRESHOLD: hỏi thẳng OpenAI,
+# ở giữa: chạy RAG rồi dự phòng như cũ (hoặc chạy song song nếu bật SPECULATIVE_FALLBACK).
+# Chạy song song chỉ có ở API async (asearch_in_syllabus); stream_in_syllabus luôn chạy tuần tự vì
+# lời gọi LLM đồng bộ không huỷ được khi nhánh RAG thắng
+RAG_SCORE_THRESHOLD = float(os.environ.get("RAG_SCORE_THRESHOLD", "0.55"))
+FALLBACK_SCORE_THRESHOLD = float(os.environ.get("FALLBACK_SCORE_THRESHOLD", "0.25"))
+SPECULATIVE_FALLBACK = os.environ.get("SPECULATIVE_FALLBACK", "false").lower() == "true"
+# Chế độ cross-lingual: truy xuất thẳng bằng câu hỏi gốc (text-embedding-3-small đa ngôn ngữ) và trả lời
+# bằng ngôn ngữ của người dùng trong cùng lời gọi RAG, bỏ hai lần dịch trước và sau
+CROSS_LINGUAL = os.environ.get("CROSS_LINGUAL", "false").lower() == "true"
+
+# Mã "không tìm thấy" không phụ thuộc ngôn ngữ: LLM trả về nguyên mã này dù câu hỏi bằng tiếng gì
+NOT_FOUND_TOKEN = "NOT_FOUND_IN_SYLLABUS"
+# Nhận cả khi LLM viết lệch chữ hoa/thường hoặc thay "_" bằng dấu cách
+_NOT_FOUND = re.compile(r"NOT[_ ]FOUND[_ ]IN[_ ]SYLLABUS", re.IGNORECASE)
+# Khi stream, số ký tự đầu của câu trả lời RAG được đọc trước (chưa hiển thị) để nhận ra cả mã không tìm thấy
+# đứng sau một câu dẫn ("Based on the context, NOT_FOUND_IN_SYLLABUS") và chuyển sang nhánh dự phòng
+NOT_FOUND_PEEK_CHARS = int(os.environ.get("NOT_FOUND_PEEK_CHARS", "120"))
+
+ROUTE_RAG = "rag"
+ROUTE_FALLBACK = "fallback"
+ROUTE_BORDERLINE = "borderline"
+ROUTE_APPROVED_QA = "approved_qa"
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """Callback LangChain ghi nhận số token thực tế (usage_metadata) của mỗi lời gọi LLM vào một bước."""
+
+    run_inline = True
+
+    def __init__(self, telemetry, stage):
+        self.telemetry = telemetry
+        self.stage = stage
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    self.telemetry.add_tokens(self.stage, usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+
+
 class Chatbot:
-    def __init__(self):
-        if not SUPABASE_URL or not SUPABASE_KEY:
+    def __init__(self, answer_cache=None, rag_threshold=RAG_SCORE_THRESHOLD,
+                 fallback_threshold=FALLBACK_SCORE_THRESHOLD, speculative_fallback=SPECULATIVE_FALLBACK,
+                 vector_backend=VECTOR_BACKEND, telemetry=None, cross_lingual=CROSS_LINGUAL, learn=True):
+        if vector_backend == "supabase" and (not SUPABASE_URL or not SUPABASE_KEY):
             raise ValueError("Vui lòng cung cấp SUPABASE_URL và SUPABASE_KEY trong file .env")
 
-        # 1. Khởi tạo các thành phần cần thiết
-        embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-        self.llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
-        supabase_client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-        # 2. Kết nối tới Vector Store trên Supabase
-        self.vector_store = SupabaseVectorStore(
-            client=supabase_client,
-            embedding=embeddings,
-            table_name="documents",
-            query_name="match_documents"
-        )
-        self.retriever = self.vector_store.as_retriever(search_kwargs={"k": 5})
+        # 1. Khởi tạo các thành phần cần thiết (dùng pool connection, timeout và thử lại chung của src.clients)
+        # Embedding của câu hỏi (từ nhiều phiên đồng thời) và của hàng đợi tự học được gom thành lô
+        self.embeddings = BatchingEmbeddings(create_embeddings(model="text-embedding-3-small"), telemetry=telemetry)
+        # stream_usage: lấy số token thực tế kể cả khi stream, phục vụ đo đạc
+        self.llm = create_chat_model(model_name="gpt-3.5-turbo", temperature=0, stream_usage=True)
+        # Đo thời gian/token từng bước (hook mở rộng qua telemetry.add_hook)
+        self.telemetry = telemetry or default_telemetry
+
+        # 2. Kết nối tới Vector Store (Supabase hoặc kho cục bộ memory-mapped)
+        # Giáo trình và kho hỏi/đáp tự học là hai collection riêng; các dòng tự học cũ còn trong
+        # documents (có metadata.status) bị loại khỏi truy xuất giáo trình
+        if vector_backend == "local":
+            self.vector_store = LocalVectorStore(LOCAL_VECTOR_STORE_PATH, self.embeddings)
+            self.approved_qa = ApprovedQAStore(LocalVectorStore(LOCAL_QA_STORE_PATH, self.embeddings))
+            self._retrieval_filter = {"filter": {"status": None}}
+        elif vector_backend == "supabase":
+            supabase_client = get_supabase_client(SUPABASE_URL, SUPABASE_KEY)
+            self.vector_store = SupabaseVectorStore(
+                client=supabase_client,
+                embedding=self.embeddings,
+                table_name="documents",
+                query_name="match_documents"
+            )
+            self.approved_qa = ApprovedQAStore(
+                SupabaseVectorStore(
+                    client=supabase_client,
+                    embedding=self.embeddings,
+                    table_name=QA_TABLE_NAME,
+                    query_name=QA_QUERY_NAME
+                ),
+                client=supabase_client,
+            )
+            self._retrieval_filter = {"postgrest_filter": "metadata->>status.is.null"}
+        else:
+            raise ValueError(f"VECTOR_BACKEND không hợp lệ: {vector_backend}")
+
+        # Cache câu trả lời (khớp chính xác hoặc theo embedding) dùng chung giữa các phiên
+        self.answer_cache = answer_cache or AnswerCache()
+        # Nhớ embedding của các câu hỏi gần đây để nhánh dự phòng không phải tính lại
+        self._query_embeddings = OrderedDict()
+        self._query_embeddings_lock = threading.Lock()
+
+        # Ghép ngữ cảnh RAG: gộp chunk chồng lấp, bỏ đoạn trùng, giới hạn theo ngân sách token
+        self.context_builder = ContextBuilder()
+
+        # Chỉ mục BM25 của giáo trình (do scripts/ingest_data.py tạo), dùng cho truy xuất lai
+        self.lexical_index = LexicalIndex()
+
+        # Hàng đợi ghi nền cho tính năng tự học (ghi vào kho hỏi/đáp ở trạng thái chờ duyệt)
+        self.learning_queue = LearningQueue(self.approved_qa, telemetry=self.telemetry)
+
+        # Định tuyến theo điểm liên quan của kết quả truy xuất
+        self.rag_threshold = rag_threshold
+        self.fallback_threshold = fallback_threshold
+        self.speculative_fallback = speculative_fallback
+        # Cross-lingual: câu hỏi giữ nguyên ngôn ngữ gốc; learn=False: không ghi tri thức mới (dùng khi đánh giá)
+        self.cross_lingual = cross_lingual
+        self.learn = learn
         
         # 3. Định nghĩa các câu trả lời và prompt mẫu
-        self.NOT_FOUND_IN_SYLLABUS = "Tôi không tìm thấy thông tin về điều này trong tài liệu."
-        
+        self.NOT_FOUND_IN_SYLLABUS = NOT_FOUND_TOKEN
+
+        # Cùng một prompt cho hai chế độ: câu hỏi tiếng Anh (đã dịch) thì trả lời tiếng Anh,
+        # câu hỏi gốc (cross-lingual) thì trả lời bằng ngôn ngữ đó; mã không tìm thấy giữ nguyên
         self.rag_prompt = PromptTemplate.from_template(
             "You are an AI assistant for answering questions about the ISTQB syllabus.\n"
             "Answer the question based ONLY on the context provided below.\n"
-            f"If the context does not contain the answer, reply with exactly this phrase: '{self.NOT_FOUND_IN_SYLLABUS}'\n\n"
+            "Write the answer in the same language as the question; the context may be in another language.\n"
+            f"If the context does not contain the answer, reply with exactly this token: '{self.NOT_FOUND_IN_SYLLABUS}'"
+            " (do not translate it and do not add anything else)\n\n"
             "Context: {context}\n\n"
             "Question: {question}\n\n"
             "Helpful Answer:"
         )
         
-        self.general_prompt = PromptTemplate.from_template("Answer the following question concisely: {question}")
+        self.general_prompt = PromptTemplate.from_template(
+            "Answer the following question concisely, in the same language as the question: {question}")
 
-    def search_in_syllabus(self, question):
+    def search_in_syllabus(self, question, language=None):
         """
         Chỉ tìm kiếm câu trả lời trong giáo trình (Supabase).
+        Câu hỏi đã có câu trả lời được duyệt thì trả lời thẳng, không gọi LLM.
         Trả về kết quả nếu tìm thấy, ngược lại trả về None.
+        Kết quả (kể cả None) được cache theo câu hỏi.
+        language: ngôn ngữ của người dùng; ở chế độ cross-lingual, kết quả được gắn "language"
+        (kết quả không có "language" là tiếng Anh).
+        """
+        language = self._answer_language(language)
+        namespace = self._namespace("syllabus", language)
+        cached = self._cache_get(namespace, question)
+        if cached is not MISS:
+            return cached
+
+        approved = self._approved_by_hash(question, language)
+        if approved is not None:
+            return approved
+
+        # Trúng thuật ngữ mạnh trong BM25: trả lời luôn mà không cần gọi embedding
+        lexical_docs = self._lexical_search(question)
+        if self.lexical_index.is_strong_hit(question, lexical_docs):
+            docs = [doc for doc, _ in lexical_docs]
+            return self.answer_cache.get_or_compute(
+                namespace, question, lambda: self._answer_from_docs(question, docs, language))
+
+        query_embedding = self._embed_query(question)
+        return self.answer_cache.get_or_compute(
+            namespace, question,
+            lambda: self._answer_from_syllabus(question, query_embedding, lexical_docs, language),
+            embedding=query_embedding,
+        )
+
+    def approved_answer(self, question, language=None):
+        """
+        Câu trả lời đã duyệt hoặc sinh sẵn trong ngân hàng cho đúng câu hỏi này (sau khi chuẩn hoá), hoặc None.
+        Kết quả trúng được ghi vào cache để search_in_syllabus trả về ngay, không tra lại lần nữa.
+        """
+        language = self._answer_language(language)
+        approved = self._approved_by_hash(question, language)
+        if approved is not None:
+            self.answer_cache.put(self._namespace("syllabus", language), question, approved)
+        return approved
+
+    def answer_from_syllabus(self, question, language=None):
+        """
+        Trả lời chỉ từ giáo trình, không qua cache, kho hỏi/đáp và định tuyến theo điểm
+        (dùng cho scripts/build_answer_bank.py). Trả về None nếu giáo trình không có câu trả lời.
         """
-        retrieved_docs = self.retriever.invoke(question)
+        lexical_docs = self._lexical_search(question)
+        docs, _ = self._retrieve(self._embed_query(question), lexical_docs)
+        return self._answer_from_docs(question, docs, self._answer_language(language))
 
+    def _cache_get(self, namespace, question, embedding=None):
+        cached = self.answer_cache.get(namespace, question, embedding)
+        self.telemetry.record_cache(namespace, cached is not MISS)
+        return cached
+
+    def _namespace(self, namespace, language):
+        """
+        Namespace của cache câu trả lời: ở chế độ cross-lingual câu trả lời được sinh bằng ngôn ngữ
+        người dùng, nên cùng một câu hỏi (ví dụ thuật ngữ tiếng Anh) có một mục riêng cho mỗi ngôn ngữ.
+        """
+        return f"{namespace}:{language}" if language else namespace
+
+    def _answer_language(self, language):
+        """Ngôn ngữ của câu trả lời sinh ra: ngôn ngữ người dùng (cross-lingual) hoặc None (tiếng Anh)."""
+        return language if self.cross_lingual else None
+
+    def _result(self, answer_text, sources, language=None):
+        result = {"answer": answer_text, "sources": sources}
+        if language:
+            result["language"] = language
+        return result
+
+    def _is_not_found(self, answer_text):
+        return bool(_NOT_FOUND.search(answer_text))
+
+    def _usage(self, stage):
+        """Config cho chain LangChain để ghi nhận token của lời gọi LLM vào bước tương ứng."""
+        return {"callbacks": [TokenUsageCallback(self.telemetry, stage)]}
+
+    def _approved_by_hash(self, question, language=None):
+        # Ưu tiên câu trả lời đã duyệt cùng ngôn ngữ với câu trả lời sẽ sinh ra (None: tiếng Anh)
+        approved = self.approved_qa.lookup_by_hash(question, language or "en")
+        return self._record_approved(approved, "hash")
+
+    def _approved_by_embedding(self, query_embedding, language=None):
+        with self.telemetry.stage("approved_qa_lookup"):
+            approved = self.approved_qa.lookup_by_embedding(query_embedding, language or "en")
+        return self._record_approved(approved, "embedding")
+
+    def _record_approved(self, approved, match):
+        self.telemetry.record_cache(f"approved_qa_{match}", approved is not None)
+        if approved is not None:
+            self.telemetry.count("retrieval_routes_total", route=ROUTE_APPROVED_QA)
+            self.telemetry.annotate(route=ROUTE_APPROVED_QA)
+        return approved
+
+    def _remember_embedding(self, question, embedding):
+        with self._query_embeddings_lock:
+            self._query_embeddings[question] = embedding
+            while len(self._query_embeddings) > 256:
+                self._query_embeddings.popitem(last=False)
+        return embedding
+
+    def _cached_embedding(self, question):
+        # Đọc một lần bằng get(): luồng khác có thể vừa đẩy câu hỏi này ra khỏi cache
+        with self._query_embeddings_lock:
+            return self._query_embeddings.get(question)
+
+    def _embed_query(self, question):
+        embedding = self._cached_embedding(question)
+        if embedding is not None:
+            return embedding
+        with self.telemetry.stage("embed_query"):
+            embedding = self.embeddings.embed_query(question)
+        return self._remember_embedding(question, embedding)
+
+    async def _aembed_query(self, question):
+        embedding = self._cached_embedding(question)
+        if embedding is not None:
+            return embedding
+        with self.telemetry.stage("embed_query"):
+            embedding = await self.embeddings.aembed_query(question)
+        return self._remember_embedding(question, embedding)
+
+    def _lexical_search(self, question):
+        """Trả về danh sách (document, điểm BM25) của 5 chunk khớp từ khoá nhất."""
+        with self.telemetry.stage("lexical_search"):
+            self.lexical_index.reload_if_changed()
+            return self.lexical_index.search(question, k=5)
+
+    def _retrieve(self, query_embedding, lexical_docs=()):
+        """
+        Truy xuất lai: 5 chunk gần nhất theo vector, gộp với kết quả BM25 bằng RRF.
+        Trả về (danh sách document, nhánh định tuyến theo điểm vector).
+        """
+        with self.telemetry.stage("retrieve"):
+            if isinstance(self.vector_store, LocalVectorStore):
+                # scripts/ingest_data.py (tiến trình khác) có thể đã ghi lại kho cục bộ
+                self.vector_store.reload_if_changed()
+            scored_docs = self.vector_store.similarity_search_by_vector_with_relevance_scores(
+                query_embedding, k=5, **self._retrieval_filter)
+        docs = reciprocal_rank_fusion(scored_docs, lexical_docs, k=5) if lexical_docs else [doc for doc, _ in scored_docs]
+        route = self._route(scored_docs)
+        self.telemetry.count("retrieval_routes_total", route=route)
+        self.telemetry.annotate(route=route)
+        return docs, route
+
+    async def _aretrieve(self, query_embedding, lexical_docs=()):
+        return await asyncio.to_thread(self._retrieve, query_embedding, lexical_docs)
+
+    def _route(self, scored_docs):
+        """Chọn nhánh xử lý dựa trên điểm cao nhất của kết quả truy xuất."""
+        top_score = max((score for _, score in scored_docs), default=0.0)
+        if top_score >= self.rag_threshold:
+            return ROUTE_RAG
+        if top_score < self.fallback_threshold:
+            return ROUTE_FALLBACK
+        return ROUTE_BORDERLINE
+
+    def _rag_inputs(self, question, retrieved_docs):
+        """Input cho rag_chain và danh sách chunk thực sự nằm trong ngữ cảnh (dùng làm nguồn)."""
+        with self.telemetry.stage("build_context"):
+            context, used_docs, stats = self.context_builder.build(retrieved_docs)
+        self.telemetry.record_context(stats["context_tokens"], stats["saved_tokens"])
+        self.telemetry.annotate(context_tokens=stats["context_tokens"])
+        return {"context": context, "question": question}, used_docs
+
+    def _answer_from_syllabus(self, question, query_embedding, lexical_docs=(), language=None):
+        approved = self._approved_by_embedding(query_embedding, language)
+        if approved is not None:
+            return approved
+
+        retrieved_docs, route = self._retrieve(query_embedding, lexical_docs)
+
+        # Điểm quá thấp: bỏ qua lời gọi RAG, chuyển thẳng sang dự phòng
+        if route == ROUTE_FALLBACK:
+            return None
+        return self._answer_from_docs(question, retrieved_docs, language)
+
+    def _answer_from_docs(self, question, retrieved_docs, language=None):
         if retrieved_docs:
-            context = "\n\n".join([doc.page_content for doc in retrieved_docs])
             rag_chain = (self.rag_prompt | self.llm | StrOutputParser())
-            answer_text = rag_chain.invoke({"context": context, "question": question})
+            inputs, used_docs = self._rag_inputs(question, retrieved_docs)
+            with self.telemetry.stage("rag_llm"):
+                answer_text = rag_chain.invoke(inputs, self._usage("rag_llm"))
 
-            if self.NOT_FOUND_IN_SYLLABUS not in answer_text:
+            if not self._is_not_found(answer_text):
                 # Tìm thấy câu trả lời hợp lệ trong ngữ cảnh
-                sources = [doc.metadata for doc in retrieved_docs]
-                return {"answer": answer_text, "sources": sources}
+                sources = [doc.metadata for doc in used_docs]
+                return self._result(answer_text, sources, language)
         
         # Nếu không tìm thấy tài liệu hoặc LLM không tìm thấy câu trả lời
         return None
 
-    def search_with_openai_and_learn(self, question):
+    def search_with_openai_and_learn(self, question, language=None):
         """
         Lấy câu trả lời từ OpenAI và thực hiện tính năng tự học.
+        Câu hỏi lặp lại được trả lời từ cache nên không bị học trùng.
         """
+        language = self._answer_language(language)
+        namespace = self._namespace("openai", language)
+        cached = self._cache_get(namespace, question)
+        if cached is not MISS:
+            return cached
+
+        query_embedding = self._embed_query(question)
+        return self.answer_cache.get_or_compute(
+            namespace, question,
+            lambda: self._answer_with_openai_and_learn(question, language),
+            embedding=query_embedding,
+        )
+
+    def _answer_with_openai_and_learn(self, question, language=None):
         general_chain = self.general_prompt | self.llm | StrOutputParser()
-        answer_text = general_chain.invoke({"question": question})
+        with self.telemetry.stage("fallback_llm"):
+            answer_text = general_chain.invoke({"question": question}, self._usage("fallback_llm"))
+        self._learn(question, answer_text, language)
+        return self._openai_result(answer_text, language)
 
+    def _openai_result(self, answer_text, language=None):
+        return self._result(answer_text, [{"source": "OpenAI", "page": None}], language)
+
+    def _learn(self, question, answer_text, language=None):
         # --- TÍNH NĂNG TỰ HỌC ---
+        # Ghi nền qua hàng đợi, người dùng không phải chờ embedding và insert
+        if not self.learn:
+            return
+        with self.telemetry.stage("learn_enqueue"):
+            self.learning_queue.submit(question, answer_text, self._cached_embedding(question), language)
+
+    # --- API bất đồng bộ ---
+    async def asearch_in_syllabus(self, question, language=None):
+        """
+        Phiên bản async của search_in_syllabus.
+        Tìm BM25 và gọi embedding chạy cùng lúc; nếu BM25 trúng mạnh thì huỷ lời gọi embedding.
+        """
+        language = self._answer_language(language)
+        namespace = self._namespace("syllabus", language)
+        cached = self._cache_get(namespace, question)
+        if cached is not MISS:
+            return cached
+
+        approved = self._approved_by_hash(question, language)
+        if approved is not None:
+            return approved
+
+        embedding_task = asyncio.create_task(self._aembed_query(question))
+        embedding_task.add_done_callback(lambda task: task.cancelled() or task.exception())
         try:
-            print("INFO: Adding new knowledge to the database with 'pending' status...")
-            new_content = f"Question: {question}\nAnswer: {answer_text}"
-            new_metadata = {"source": "OpenAI_Generated_Q&A", "status": "pending"}
-            
-            self.vector_store.add_texts(
-                texts=[new_content],
-                metadatas=[new_metadata]
-            )
-            print("INFO: Successfully added new knowledge with 'pending' status.")
-        except Exception as e:
-            print(f"ERROR: Could not add new knowledge to database: {e}")
-        # --- KẾT THÚC TÍNH NĂNG TỰ HỌC ---
-
-        return {
-            "answer": answer_text,
-            "sources": [{"source": "OpenAI", "page": None}] 
-        }
+            lexical_docs = await asyncio.to_thread(self._lexical_search, question)
+        except BaseException:
+            embedding_task.cancel()
+            raise
+        if self.lexical_index.is_strong_hit(question, lexical_docs):
+            embedding_task.cancel()
+            docs = [doc for doc, _ in lexical_docs]
+            return await self.answer_cache.aget_or_compute(
+                namespace, question, lambda: self._aanswer_from_docs(question, docs, language=language))
+
+        query_embedding = await embedding_task
+        return await self.answer_cache.aget_or_compute(
+            namespace, question,
+            lambda: self._aanswer_from_syllabus(question, query_embedding, lexical_docs, language),
+            embedding=query_embedding,
+        )
+
+    async def _aanswer_from_syllabus(self, question, query_embedding, lexical_docs=(), language=None):
+        # Tra kho hỏi/đáp đã duyệt song song với truy xuất giáo trình
+        approved, (retrieved_docs, route) = await asyncio.gather(
+            asyncio.to_thread(self._approved_by_embedding, query_embedding, language),
+            self._aretrieve(query_embedding, lexical_docs),
+        )
+        if approved is not None:
+            return approved
+        if route == ROUTE_FALLBACK:
+            return None
+        return await self._aanswer_from_docs(question, retrieved_docs, route, query_embedding, language)
+
+    async def _aanswer_from_docs(self, question, retrieved_docs, route=ROUTE_RAG, query_embedding=None,
+                                 language=None):
+        if not retrieved_docs:
+            return None
+
+        # Vùng biên: chạy nhánh dự phòng song song và huỷ nhánh thua
+        speculative = None
+        fallback_namespace = self._namespace("openai", language)
+        if (route == ROUTE_BORDERLINE and self.speculative_fallback
+                and self.answer_cache.get(fallback_namespace, question, query_embedding) is MISS):
+            general_chain = self.general_prompt | self.llm | StrOutputParser()
+            speculative = asyncio.create_task(
+                general_chain.ainvoke({"question": question}, self._usage("speculative_fallback_llm")))
+            speculative.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+        rag_chain = (self.rag_prompt | self.llm | StrOutputParser())
+        try:
+            inputs, used_docs = self._rag_inputs(question, retrieved_docs)
+            with self.telemetry.stage("rag_llm"):
+                answer_text = await rag_chain.ainvoke(inputs, self._usage("rag_llm"))
+        except BaseException:
+            if speculative:
+                speculative.cancel()
+            raise
+
+        if not self._is_not_found(answer_text):
+            if speculative:
+                speculative.cancel()
+            sources = [doc.metadata for doc in used_docs]
+            return self._result(answer_text, sources, language)
+
+        if speculative:
+            # Câu trả lời dự phòng đã sẵn sàng: lưu vào cache để asearch_with_openai_and_learn dùng ngay
+            try:
+                fallback_text = await speculative
+            except Exception as e:
+                # Nhánh dự phòng song song lỗi: để asearch_with_openai_and_learn gọi lại như bình thường
+                log_event("speculative_fallback_failed", logging.WARNING, error=str(e))
+                return None
+            self._learn(question, fallback_text, language)
+            self.answer_cache.put(fallback_namespace, question, self._openai_result(fallback_text, language),
+                                  query_embedding)
+        return None
+
+    async def asearch_with_openai_and_learn(self, question, language=None):
+        """
+        Phiên bản async của search_with_openai_and_learn.
+        """
+        language = self._answer_language(language)
+        namespace = self._namespace("openai", language)
+        cached = self._cache_get(namespace, question)
+        if cached is not MISS:
+            return cached
+
+        query_embedding = await self._aembed_query(question)
+        return await self.answer_cache.aget_or_compute(
+            namespace, question,
+            lambda: self._aanswer_with_openai_and_learn(question, language),
+            embedding=query_embedding,
+        )
+
+    async def _aanswer_with_openai_and_learn(self, question, language=None):
+        general_chain = self.general_prompt | self.llm | StrOutputParser()
+        with self.telemetry.stage("fallback_llm"):
+            answer_text = await general_chain.ainvoke({"question": question}, self._usage("fallback_llm"))
+        self._learn(question, answer_text, language)
+        return self._openai_result(answer_text, language)
+
+    # --- Streaming ---
+    def stream_in_syllabus(self, question, language=None):
+        """
+        Phiên bản streaming của search_in_syllabus.
+        Trả về {"stream": generator các token, "sources": [...]} nếu tìm thấy, ngược lại trả về None.
+        Mã NOT_FOUND_IN_SYLLABUS ở phần đầu câu trả lời (NOT_FOUND_PEEK_CHARS ký tự) cho kết quả None như
+        bản không stream. Nếu mã chỉ xuất hiện muộn hơn, stream bỏ mã đó và chuyển sang câu trả lời của
+        stream_with_openai_and_learn; khi đó "sources" được thay bằng nguồn của câu trả lời dự phòng,
+        nên người gọi cần đọc "sources" sau khi đã stream xong.
+        Không chạy nhánh dự phòng song song ở vùng biên (SPECULATIVE_FALLBACK chỉ áp dụng cho API async).
+        """
+        language = self._answer_language(language)
+        namespace = self._namespace("syllabus", language)
+        cached = self._cache_get(namespace, question)
+        if cached is not MISS:
+            return _cached_stream(cached)
+
+        approved = self._approved_by_hash(question, language)
+        if approved is not None:
+            return _cached_stream(approved)
+
+        lexical_docs = self._lexical_search(question)
+        if self.lexical_index.is_strong_hit(question, lexical_docs):
+            query_embedding = None
+            retrieved_docs = [doc for doc, _ in lexical_docs]
+        else:
+            query_embedding = self._embed_query(question)
+            cached = self._cache_get(namespace, question, query_embedding)
+            if cached is not MISS:
+                return _cached_stream(cached)
+
+            approved = self._approved_by_embedding(query_embedding, language)
+            if approved is not None:
+                self.answer_cache.put(namespace, question, approved, query_embedding)
+                return _cached_stream(approved)
+
+            retrieved_docs, route = self._retrieve(query_embedding, lexical_docs)
+            if route == ROUTE_FALLBACK:
+                self.answer_cache.put(namespace, question, None, query_embedding)
+                return None
+
+        if not retrieved_docs:
+            self.answer_cache.put(namespace, question, None, query_embedding)
+            return None
+
+        rag_chain = (self.rag_prompt | self.llm | StrOutputParser())
+        inputs, used_docs = self._rag_inputs(question, retrieved_docs)
+        chunks = self.telemetry.timed_stream("rag_llm", rag_chain.stream(inputs, self._usage("rag_llm")))
+        with self.telemetry.stage("rag_first_token"):
+            not_found, buffered = self._peek_not_found(chunks)
+        if not_found:
+            chunks.close()
+            self.answer_cache.put(namespace, question, None, query_embedding)
+            return None
+
+        result = self._stream_result(None, [doc.metadata for doc in used_docs], language)
+
+        def on_complete(answer_text):
+            self.answer_cache.put(namespace, question, self._result(answer_text, result["sources"], language),
+                                  query_embedding)
+
+        def on_not_found():
+            # Giống bản không stream: câu hỏi này không có trong giáo trình, trả lời bằng nhánh dự phòng
+            self.answer_cache.put(namespace, question, None, query_embedding)
+            self.telemetry.annotate(path="fallback")
+            fallback = self.stream_with_openai_and_learn(question, language)
+            result["sources"] = fallback["sources"]
+            return fallback["stream"]
+
+        result["stream"] = _stream_unless_not_found(buffered, chunks, on_complete, on_not_found)
+        return result
+
+    def stream_with_openai_and_learn(self, question, language=None):
+        """
+        Phiên bản streaming của search_with_openai_and_learn.
+        Tính năng tự học chạy sau khi đã stream xong câu trả lời.
+        """
+        language = self._answer_language(language)
+        namespace = self._namespace("openai", language)
+        query_embedding = self._embed_query(question)
+        cached = self._cache_get(namespace, question, query_embedding)
+        if cached is not MISS:
+            return _cached_stream(cached)
+
+        general_chain = self.general_prompt | self.llm | StrOutputParser()
+        chunks = self.telemetry.timed_stream(
+            "fallback_llm", general_chain.stream({"question": question}, self._usage("fallback_llm")))
+
+        def on_complete(answer_text):
+            self._learn(question, answer_text, language)
+            self.answer_cache.put(namespace, question, self._openai_result(answer_text, language), query_embedding)
+
+        return self._stream_result(_stream_then([], chunks, on_complete), self._openai_result("")["sources"],
+                                   language)
+
+    def _stream_result(self, stream, sources, language=None):
+        result = {"stream": stream, "sources": sources}
+        if language:
+            result["language"] = language
+        return result
+
+    def _peek_not_found(self, chunks):
+        """
+        Đọc trước các token cho tới khi gặp mã NOT_FOUND_IN_SYLLABUS hoặc đã đủ NOT_FOUND_PEEK_CHARS ký tự.
+        Trả về (not_found, các token đã đọc).
+        """
+        buffered, length = [], 0
+        for chunk in chunks:
+            buffered.append(chunk)
+            length += len(chunk)
+            if self._is_not_found("".join(buffered)):
+                return True, buffered
+            if length >= NOT_FOUND_PEEK_CHARS:
+                break
+        return False, buffered
+
+
+def _stream_then(buffered, chunks, on_complete):
+    """Phát lại các token đã đọc trước, stream phần còn lại rồi gọi on_complete với toàn bộ văn bản."""
+    parts = list(buffered)
+    yield from buffered
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    on_complete("".join(parts))
+
+
+def _stream_unless_not_found(buffered, chunks, on_complete, on_not_found):
+    """
+    Như _stream_then, nhưng luôn giữ lại đoạn cuối đủ dài để chứa một phần mã NOT_FOUND_IN_SYLLABUS.
+    Nếu mã xuất hiện: đóng stream RAG (phần chứa mã không được hiển thị) rồi stream tiếp câu trả lời
+    do on_not_found() trả về; on_complete chỉ được gọi khi câu trả lời không chứa mã.
+    """
+    hold = len(NOT_FOUND_TOKEN) - 1
+    text, emitted = "".join(buffered), 0
+    while True:
+        if _NOT_FOUND.search(text, max(0, emitted - hold)):
+            chunks.close()
+            if emitted:
+                yield "\n\n"
+            yield from on_not_found()
+            return
+        if len(text) - hold > emitted:
+            yield text[emitted:len(text) - hold]
+            emitted = len(text) - hold
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        text += chunk
+    if len(text) > emitted:
+        yield text[emitted:]
+    on_complete(text)
+
+
+def _cached_stream(cached):
+    if cached is None:
+        return None
+    return {"stream": iter([cached["answer"]]), **{key: value for key, value in cached.items() if key != "answer"}}
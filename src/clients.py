@@ -0,0 +1,359 @@
+import asyncio
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
+from dotenv import load_dotenv
+
+from src.telemetry import log_event, telemetry
+
+load_dotenv()
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+
+# Timeout (giây): kết nối, chờ một connection rảnh trong pool và đọc phản hồi của từng dịch vụ
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_POOL_TIMEOUT = float(os.environ.get("HTTP_POOL_TIMEOUT", "30"))
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "60"))
+EMBEDDING_TIMEOUT = float(os.environ.get("EMBEDDING_TIMEOUT", "20"))
+# OpenAIEmbeddings tách văn bản dài theo token (cần bảng BPE của tiktoken, tải về ở lần dùng đầu);
+# tắt khi chạy hoàn toàn offline (benchmark với dịch vụ giả), lúc đó văn bản được gửi nguyên dạng chuỗi
+EMBEDDING_CHECK_CTX_LENGTH = os.environ.get("EMBEDDING_CHECK_CTX_LENGTH", "true").lower() == "true"
+SUPABASE_TIMEOUT = float(os.environ.get("SUPABASE_TIMEOUT", "20"))
+# Dịch vụ HTTP/SSE của chatbot (src/service.py): một lượt hỏi có thể mất lâu hơn một lời gọi OpenAI
+CHATBOT_SERVICE_TIMEOUT = float(os.environ.get("CHATBOT_SERVICE_TIMEOUT", "180"))
+# Số request đồng thời tối đa tới mỗi dịch vụ (request vượt quá phải chờ connection rảnh)
+# và số connection keep-alive được giữ lại để tránh bắt tay TLS lại
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "20"))
+SUPABASE_MAX_CONNECTIONS = int(os.environ.get("SUPABASE_MAX_CONNECTIONS", "10"))
+CHATBOT_SERVICE_MAX_CONNECTIONS = int(os.environ.get("CHATBOT_SERVICE_MAX_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+# Thử lại với backoff luỹ thừa (có jitter) khi gặp 429/5xx hoặc lỗi kết nối
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.environ.get("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.environ.get("HTTP_BACKOFF_MAX", "20"))
+# Ngân sách thử lại: mỗi request nạp thêm chừng này lượt (tối đa HTTP_RETRY_BUDGET_MAX), mỗi lần
+# thử lại tiêu một lượt, để khi dịch vụ quá tải thì số lần thử lại không nhân lên theo lưu lượng
+HTTP_RETRY_BUDGET_RATIO = float(os.environ.get("HTTP_RETRY_BUDGET_RATIO", "0.2"))
+HTTP_RETRY_BUDGET_MAX = float(os.environ.get("HTTP_RETRY_BUDGET_MAX", "10"))
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+# Chỉ các lỗi chắc chắn request chưa tới server (an toàn kể cả với POST không idempotent)
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+SERVICES = {
+    "openai": {"timeout": OPENAI_TIMEOUT, "max_connections": OPENAI_MAX_CONNECTIONS},
+    "supabase": {"timeout": SUPABASE_TIMEOUT, "max_connections": SUPABASE_MAX_CONNECTIONS},
+    # POST /ask, /stream chạy trọn một lượt hỏi (nhiều lời gọi LLM, có thể ghi tri thức mới): thử lại khi
+    # 503/504 có thể nhân chi phí lên nhiều lần, nên chỉ thử lại khi chưa kết nối được
+    "chatbot": {"timeout": CHATBOT_SERVICE_TIMEOUT, "max_connections": CHATBOT_SERVICE_MAX_CONNECTIONS,
+                "retry_statuses": frozenset(), "retry_errors": CONNECT_ERRORS},
+}
+
+
+class RetryPolicy:
+    """
+    Backoff luỹ thừa có jitter (tôn trọng Retry-After) và ngân sách thử lại dùng chung của một dịch vụ.
+    statuses/errors: mã HTTP và lỗi transport được thử lại.
+    """
+
+    def __init__(self, service, max_retries=HTTP_MAX_RETRIES, backoff_base=HTTP_BACKOFF_BASE,
+                 backoff_max=HTTP_BACKOFF_MAX, budget_ratio=HTTP_RETRY_BUDGET_RATIO,
+                 budget_max=HTTP_RETRY_BUDGET_MAX, statuses=RETRY_STATUSES, errors=RETRY_ERRORS):
+        self.service = service
+        self.statuses = statuses
+        self.errors = errors
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.budget_ratio = budget_ratio
+        self.budget_max = budget_max
+        self._budget = budget_max
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        with self._lock:
+            self._budget = min(self._budget + self.budget_ratio, self.budget_max)
+
+    def should_retry(self, attempt, reason):
+        """Cho phép thử lại lần thứ attempt + 1 nếu chưa quá số lần tối đa và ngân sách còn."""
+        if attempt >= self.max_retries:
+            return False
+        with self._lock:
+            if self._budget < 1:
+                telemetry.count("http_retries_total", service=self.service, reason=reason, outcome="budget_exhausted")
+                return False
+            self._budget -= 1
+        telemetry.count("http_retries_total", service=self.service, reason=reason, outcome="retried")
+        return True
+
+    def delay(self, attempt, response=None):
+        retry_after = _retry_after(response) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return min(self.backoff_base * (2 ** attempt) * (1 + random.random()), self.backoff_max)
+
+
+def _retry_after(response):
+    # Retry-After dạng số giây hoặc ngày giờ HTTP
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryTransport(httpx.BaseTransport):
+    """Transport đồng bộ: gửi qua transport có pool connection, thử lại theo RetryPolicy."""
+
+    def __init__(self, transport, policy):
+        self.transport = transport
+        self.policy = policy
+
+    def handle_request(self, request):
+        self.policy.on_request()
+        attempt = 0
+        while True:
+            try:
+                response = self.transport.handle_request(request)
+            except self.policy.errors as e:
+                if not self.policy.should_retry(attempt, type(e).__name__):
+                    raise
+                delay = self.policy.delay(attempt)
+            else:
+                if (response.status_code not in self.policy.statuses
+                        or not self.policy.should_retry(attempt, str(response.status_code))):
+                    return response
+                delay = self.policy.delay(attempt, response)
+                response.close()
+            log_event("http_retry", logging.WARNING, service=self.policy.service, attempt=attempt + 1,
+                      delay=round(delay, 3), url=str(request.url.copy_with(query=None)))
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncRetryTransport(httpx.AsyncBaseTransport):
+    """Phiên bản async của RetryTransport."""
+
+    def __init__(self, transport, policy):
+        self.transport = transport
+        self.policy = policy
+
+    async def handle_async_request(self, request):
+        self.policy.on_request()
+        attempt = 0
+        while True:
+            try:
+                response = await self.transport.handle_async_request(request)
+            except self.policy.errors as e:
+                if not self.policy.should_retry(attempt, type(e).__name__):
+                    raise
+                delay = self.policy.delay(attempt)
+            else:
+                if (response.status_code not in self.policy.statuses
+                        or not self.policy.should_retry(attempt, str(response.status_code))):
+                    return response
+                delay = self.policy.delay(attempt, response)
+                await response.aclose()
+            log_event("http_retry", logging.WARNING, service=self.policy.service, attempt=attempt + 1,
+                      delay=round(delay, 3), url=str(request.url.copy_with(query=None)))
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+# --- Client dùng chung trong process ---
+_clients = {}
+_policies = {}
+# Client/transport async theo từng event loop: connection async gắn với loop đã mở chúng, nên mỗi loop
+# (EventLoopThread của trang Streamlit, loop của dịch vụ aiohttp, loop của benchmark...) có pool riêng
+_loop_clients = weakref.WeakKeyDictionary()
+# RLock: factory của client này có thể lấy client/chính sách dùng chung khác
+_lock = threading.RLock()
+
+
+def _shared(key, factory):
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = factory()
+    return client
+
+
+def _loop_shared(key, factory):
+    """Như _shared nhưng riêng cho event loop đang chạy (phải gọi từ trong một coroutine/callback của loop)."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _loop_clients.setdefault(loop, {})
+        if key not in clients:
+            clients[key] = factory()
+        return clients[key]
+
+
+def _policy(service):
+    with _lock:
+        if service not in _policies:
+            config = SERVICES.get(service, {})
+            _policies[service] = RetryPolicy(service, statuses=config.get("retry_statuses", RETRY_STATUSES),
+                                             errors=config.get("retry_errors", RETRY_ERRORS))
+        return _policies[service]
+
+
+def _limits(service):
+    max_connections = SERVICES[service]["max_connections"]
+    return httpx.Limits(max_connections=max_connections,
+                        max_keepalive_connections=min(HTTP_KEEPALIVE_CONNECTIONS, max_connections),
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+
+
+def _timeout(service):
+    return httpx.Timeout(SERVICES[service]["timeout"], connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+
+
+def get_http_client(service="openai"):
+    """
+    httpx.Client dùng chung cho một dịch vụ ("openai", "supabase" hoặc "chatbot"): giữ connection
+    keep-alive, giới hạn số request đồng thời (max_connections), timeout riêng và thử lại với backoff.
+    Chính sách thử lại (kể cả ngân sách) dùng chung giữa client đồng bộ và async của cùng dịch vụ.
+    """
+    def factory():
+        transport = RetryTransport(httpx.HTTPTransport(limits=_limits(service)), _policy(service))
+        return httpx.Client(transport=transport, timeout=_timeout(service), follow_redirects=True)
+    return _shared(("http", service), factory)
+
+
+def _async_transport(service):
+    """Transport async (pool connection và thử lại) của một dịch vụ trên event loop đang chạy."""
+    return _loop_shared(("async_transport", service), lambda: AsyncRetryTransport(
+        httpx.AsyncHTTPTransport(limits=_limits(service)), _policy(service)))
+
+
+def get_async_http_client(service="openai"):
+    """
+    httpx.AsyncClient dùng chung cho một dịch vụ trên event loop đang chạy (mỗi loop một client,
+    vì connection async gắn với loop đã mở chúng). Phải gọi từ trong loop đó. Cùng pool connection
+    với client async của ChatOpenAI/OpenAIEmbeddings trên loop này.
+    """
+    return _loop_shared(("async_http", service), lambda: httpx.AsyncClient(
+        transport=_async_transport(service), timeout=_timeout(service), follow_redirects=True))
+
+
+class LoopLocalTransport(httpx.AsyncBaseTransport):
+    """
+    Transport async chuyển mỗi request tới pool connection của event loop đang chạy, để một
+    AsyncClient tạo một lần (như của ChatOpenAI/OpenAIEmbeddings) dùng được trên nhiều loop.
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    async def handle_async_request(self, request):
+        return await _async_transport(self.service).handle_async_request(request)
+
+    async def aclose(self):
+        # Pool của từng loop được đóng bởi aclose_async_clients
+        pass
+
+
+def _loop_local_async_client(service):
+    return httpx.AsyncClient(transport=LoopLocalTransport(service), timeout=_timeout(service), follow_redirects=True)
+
+
+async def aclose_async_clients():
+    """Đóng các client/transport async của event loop đang chạy (gọi trước khi dừng loop)."""
+    with _lock:
+        clients = _loop_clients.pop(asyncio.get_running_loop(), {})
+    # Mọi client async của loop dùng chung các transport này: đóng transport là đóng pool connection
+    for client in clients.values():
+        if isinstance(client, httpx.AsyncBaseTransport):
+            await client.aclose()
+
+
+def get_openai_client():
+    """OpenAI client dùng chung; việc thử lại do transport đảm nhận nên tắt cơ chế thử lại của SDK."""
+    from openai import OpenAI
+    return _shared("openai", lambda: OpenAI(http_client=get_http_client("openai"), max_retries=0,
+                                            timeout=_timeout("openai")))
+
+
+def get_async_openai_client():
+    """AsyncOpenAI client dùng chung trên event loop đang chạy (phải gọi từ trong loop đó)."""
+    from openai import AsyncOpenAI
+    return _loop_shared("async_openai", lambda: AsyncOpenAI(http_client=get_async_http_client("openai"),
+                                                            max_retries=0, timeout=_timeout("openai")))
+
+
+def create_chat_model(**kwargs):
+    """ChatOpenAI dùng pool connection chung của OpenAI (bản async: pool riêng của từng event loop)."""
+    from langchain_openai import ChatOpenAI
+    kwargs.setdefault("request_timeout", _timeout("openai"))
+    return ChatOpenAI(http_client=get_http_client("openai"), http_async_client=_loop_local_async_client("openai"),
+                      max_retries=0, **kwargs)
+
+
+def create_embeddings(**kwargs):
+    """OpenAIEmbeddings dùng pool connection chung, với timeout ngắn hơn lời gọi chat."""
+    from langchain_openai import OpenAIEmbeddings
+    kwargs.setdefault("request_timeout",
+                      httpx.Timeout(EMBEDDING_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT))
+    kwargs.setdefault("check_embedding_ctx_length", EMBEDDING_CHECK_CTX_LENGTH)
+    return OpenAIEmbeddings(http_client=get_http_client("openai"), http_async_client=_loop_local_async_client("openai"),
+                            max_retries=0, **kwargs)
+
+
+def get_supabase_client(url=None, key=None):
+    """
+    Supabase client dùng chung trong process. supabase-py không nhận httpx client từ ngoài, nên
+    session PostgREST (bảng, RPC) được thay bằng một session có pool giới hạn và thử lại như trên.
+    """
+    def factory():
+        from postgrest.utils import SyncClient
+        from supabase import create_client
+        from supabase.lib.client_options import SyncClientOptions
+
+        client = create_client(url or SUPABASE_URL, key or SUPABASE_KEY,
+                               options=SyncClientOptions(postgrest_client_timeout=_timeout("supabase")))
+        postgrest = client.postgrest
+        original = postgrest.session
+        postgrest.session = SyncClient(
+            base_url=original.base_url,
+            headers=original.headers,
+            timeout=_timeout("supabase"),
+            follow_redirects=True,
+            transport=RetryTransport(httpx.HTTPTransport(limits=_limits("supabase"), http2=True),
+                                     _policy("supabase")),
+        )
+        original.close()
+        return client
+    return _shared(("supabase", url or SUPABASE_URL), factory)
+
+
+def close_clients():
+    """Đóng các client đồng bộ dùng chung (client async được đóng bằng aclose_async_clients trên loop của chúng)."""
+    with _lock:
+        clients = list(_clients.items())
+        _clients.clear()
+    for key, client in clients:
+        if isinstance(client, httpx.Client):
+            client.close()
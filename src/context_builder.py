@@ -0,0 +1,232 @@
+import os
+import re
+import unicodedata
+from functools import lru_cache
+
+# Ngân sách token cho phần ngữ cảnh của prompt RAG (đếm bằng tokenizer của gpt-3.5-turbo)
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1500"))
+# Hai đoạn có độ tương đồng Jaccard (theo cụm 3 từ) từ ngưỡng này trở lên bị coi là trùng nhau
+CONTEXT_DUPLICATE_THRESHOLD = float(os.environ.get("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+# MMR (đa dạng hoá) tuỳ chọn: lambda gần 1 ưu tiên độ liên quan, gần 0 ưu tiên độ khác biệt
+CONTEXT_MMR = os.environ.get("CONTEXT_MMR", "false").lower() == "true"
+CONTEXT_MMR_LAMBDA = float(os.environ.get("CONTEXT_MMR_LAMBDA", "0.7"))
+
+SEPARATOR = "\n\n"
+# Phần chồng lấp tối thiểu (ký tự) để ghép hai chunk của cùng một trang khi không biết vị trí của chúng
+MIN_OVERLAP = 20
+# Khoảng cách tối đa (ký tự, thường là dấu xuống dòng bị bỏ khi chia) giữa hai chunk được coi là liền nhau
+MAX_GAP = 3
+# Dòng lặp lại nguyên văn (tiêu đề/chân trang của PDF...) dài từ chừng này ký tự chỉ được giữ lần đầu
+MIN_REPEATED_LINE = 15
+# Đoạn cuối bị cắt cho vừa ngân sách chỉ được giữ nếu còn ít nhất chừng này token
+MIN_TRUNCATED_TOKENS = 50
+
+_WORD = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model("gpt-3.5-turbo")
+    except Exception:
+        return None
+
+
+def count_tokens(text):
+    """Số token của văn bản theo tokenizer của gpt-3.5-turbo (ước lượng 4 ký tự/token nếu thiếu tiktoken)."""
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens):
+    encoding = _encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+def _shingles(text, size=3):
+    words = _WORD.findall(unicodedata.normalize("NFKC", text).lower())
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _overlap_merge(first, second):
+    """
+    Ghép second vào sau first nếu phần đầu của second trùng phần cuối của first
+    (như các chunk liền nhau với chunk_overlap), hoặc nếu đoạn này nằm trọn trong đoạn kia.
+    Trả về văn bản đã ghép hoặc None.
+    """
+    if second in first:
+        return first
+    if first in second:
+        return second
+    probe = second[:MIN_OVERLAP]
+    if len(probe) < MIN_OVERLAP:
+        return None
+    position = first.find(probe)
+    while position != -1:
+        tail = first[position:]
+        if second.startswith(tail):
+            return first + second[len(tail):]
+        position = first.find(probe, position + 1)
+    return None
+
+
+def _compact(text, seen_lines):
+    """Bỏ khoảng trắng thừa, dòng trống liên tiếp và các dòng dài đã xuất hiện ở đoạn trước."""
+    lines = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if len(line) >= MIN_REPEATED_LINE:
+            if line in seen_lines:
+                continue
+            seen_lines.add(line)
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    return "\n".join(lines).strip()
+
+
+class _Passage:
+    __slots__ = ("text", "docs", "rank", "start", "end", "shingles")
+
+    def __init__(self, text, docs, rank, start=None):
+        self.text = text
+        self.docs = docs
+        self.rank = rank
+        # Vị trí trong trang (start_index do scripts/ingest_data.py ghi), None với dữ liệu cũ
+        self.start = start
+        self.end = start + len(text) if start is not None else None
+        self.shingles = None
+
+
+def _join(first, second):
+    """Ghép hai đoạn của cùng một trang nếu chúng chồng lấp hoặc liền nhau; trả về _Passage hoặc None."""
+    docs, rank = first.docs + second.docs, min(first.rank, second.rank)
+    if first.start is not None and second.start is not None:
+        if second.start < first.start:
+            first, second = second, first
+        gap = second.start - first.end
+        if gap > MAX_GAP:
+            return None
+        if second.end <= first.end:
+            return _Passage(first.text, docs, rank, first.start)
+        text = first.text + ("\n" if gap > 0 else "") + second.text[max(-gap, 0):]
+        passage = _Passage(text, docs, rank, first.start)
+        passage.end = second.end
+        return passage
+    text = _overlap_merge(first.text, second.text) or _overlap_merge(second.text, first.text)
+    return _Passage(text, docs, rank) if text is not None else None
+
+
+class ContextBuilder:
+    """
+    Ghép ngữ cảnh cho prompt RAG từ các chunk đã truy xuất (theo thứ tự liên quan):
+    nối các chunk chồng lấp/liền nhau của cùng một trang, bỏ các đoạn gần trùng,
+    tuỳ chọn sắp lại theo MMR, bỏ khoảng trắng thừa và tiêu đề trang lặp lại,
+    rồi cắt cho vừa ngân sách token.
+    """
+
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD,
+                 mmr=CONTEXT_MMR, mmr_lambda=CONTEXT_MMR_LAMBDA):
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.mmr = mmr
+        self.mmr_lambda = mmr_lambda
+
+    def build(self, docs):
+        """
+        Trả về (ngữ cảnh, các Document đã dùng, thống kê). Thống kê gồm số token của cách ghép
+        cũ (nối nguyên k chunk), của ngữ cảnh mới và số token tiết kiệm được.
+        """
+        docs = list(docs)
+        raw_tokens = count_tokens(SEPARATOR.join(doc.page_content for doc in docs)) if docs else 0
+
+        passages = self._deduplicate(self._merge(docs))
+        if self.mmr:
+            passages = self._mmr(passages)
+
+        parts, used_docs, tokens, seen_lines = [], [], 0, set()
+        separator_tokens = count_tokens(SEPARATOR)
+        for passage in passages:
+            text = _compact(passage.text, seen_lines)
+            if not text:
+                continue
+            cost = count_tokens(text) + (separator_tokens if parts else 0)
+            if tokens + cost > self.token_budget:
+                remaining = self.token_budget - tokens - (separator_tokens if parts else 0)
+                if remaining >= MIN_TRUNCATED_TOKENS:
+                    parts.append(truncate_tokens(text, remaining))
+                    used_docs.extend(passage.docs)
+                break
+            parts.append(text)
+            used_docs.extend(passage.docs)
+            tokens += cost
+
+        context = SEPARATOR.join(parts)
+        context_tokens = count_tokens(context) if parts else 0
+        stats = {
+            "chunks": len(docs),
+            "passages": len(parts),
+            "raw_tokens": raw_tokens,
+            "context_tokens": context_tokens,
+            "saved_tokens": max(raw_tokens - context_tokens, 0),
+        }
+        return context, used_docs, stats
+
+    @staticmethod
+    def _page_key(doc):
+        source = str(doc.metadata.get("source", "")).replace("\\", "/")
+        return source, doc.metadata.get("page")
+
+    def _merge(self, docs):
+        """Nối các chunk chồng lấp/liền nhau của cùng một trang; đoạn ghép giữ thứ hạng tốt nhất của các chunk."""
+        passages = []
+        for rank, doc in enumerate(docs):
+            passage = _Passage(doc.page_content, [doc], rank, doc.metadata.get("start_index"))
+            key = self._page_key(doc)
+            merged = True
+            while merged:
+                merged = False
+                for other in passages:
+                    if self._page_key(other.docs[0]) != key:
+                        continue
+                    joined = _join(other, passage)
+                    if joined is not None:
+                        passages.remove(other)
+                        passage = joined
+                        merged = True
+                        break
+            passages.append(passage)
+        return sorted(passages, key=lambda passage: passage.rank)
+
+    def _deduplicate(self, passages):
+        kept = []
+        for passage in passages:
+            passage.shingles = _shingles(passage.text)
+            if all(_jaccard(passage.shingles, other.shingles) < self.duplicate_threshold for other in kept):
+                kept.append(passage)
+        return kept
+
+    def _mmr(self, passages):
+        """Maximal marginal relevance: độ liên quan theo thứ hạng, độ giống nhau theo Jaccard."""
+        remaining, selected = list(passages), []
+        while remaining:
+            def score(passage):
+                relevance = 1.0 / (passage.rank + 1)
+                redundancy = max((_jaccard(passage.shingles, other.shingles) for other in selected), default=0.0)
+                return self.mmr_lambda * relevance - (1 - self.mmr_lambda) * redundancy
+            best = max(remaining, key=score)
+            remaining.remove(best)
+            selected.append(best)
+        return selected
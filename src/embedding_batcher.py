@@ -0,0 +1,149 @@
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+from src.telemetry import log_event, telemetry as default_telemetry
+
+# Gom embedding của các lượt hỏi đồng thời thành một request: tối đa EMBEDDING_BATCH_SIZE văn bản,
+# chờ tối đa EMBEDDING_BATCH_WAIT_MS mili giây kể từ yêu cầu đầu tiên của lô
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_BATCH_WAIT_MS = float(os.environ.get("EMBEDDING_BATCH_WAIT_MS", "10"))
+# Số lô được gửi song song; khi đủ, các yêu cầu mới tiếp tục dồn vào lô kế tiếp
+EMBEDDING_BATCH_CONCURRENCY = int(os.environ.get("EMBEDDING_BATCH_CONCURRENCY", "4"))
+
+_STOP = object()
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Bọc một Embeddings (OpenAIEmbeddings): các lời gọi embed_query/embed_documents nhỏ từ nhiều
+    luồng và task được gom thành một request embed_documents, rồi trả kết quả về đúng người gọi.
+    Văn bản trùng nhau trong cùng lô chỉ được embed một lần; yêu cầu đã bị huỷ trước khi gửi
+    thì không được embed; lời gọi lớn (từ EMBEDDING_BATCH_SIZE văn bản) đi thẳng không qua lô.
+    """
+
+    def __init__(self, embeddings, max_batch_size=EMBEDDING_BATCH_SIZE, max_wait=EMBEDDING_BATCH_WAIT_MS / 1000,
+                 max_concurrency=EMBEDDING_BATCH_CONCURRENCY, telemetry=None):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.telemetry = telemetry or default_telemetry
+
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(max_concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embedding-batch")
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # --- Giao diện Embeddings ---
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        future = self._submit(texts) if len(texts) < self.max_batch_size else None
+        if future is None:
+            return self.embeddings.embed_documents(texts)
+        return future.result()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        future = self._submit(texts) if len(texts) < self.max_batch_size else None
+        if future is None:
+            return await self.embeddings.aembed_documents(texts)
+        # Huỷ task đang chờ (ví dụ BM25 đã trúng mạnh) sẽ bỏ văn bản khỏi lô nếu lô chưa được gửi
+        return await asyncio.wrap_future(future)
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+    def close(self):
+        """Gửi nốt các yêu cầu đang chờ rồi dừng luồng gom lô (tự gọi khi thoát chương trình)."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout=5.0)
+        self._pool.shutdown(wait=True)
+
+    # --- Gom lô ---
+    def _submit(self, texts):
+        """Đưa văn bản vào lô kế tiếp; trả về None nếu đã đóng (người gọi tự embed trực tiếp)."""
+        with self._lock:
+            if self._closed:
+                return None
+            future = Future()
+            self._queue.put((texts, future))
+            return future
+
+    def _run(self):
+        carry = None
+        while True:
+            item = carry if carry is not None else self._queue.get()
+            carry = None
+            if item is _STOP:
+                return
+            batch, size = [item], len(item[0])
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                if size + len(item[0]) > self.max_batch_size:
+                    carry = item
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._dispatch(batch)
+            if stop:
+                return
+
+    def _dispatch(self, batch):
+        # Chờ một chỗ gửi trước khi chốt lô: trong lúc chờ, yêu cầu mới dồn vào hàng đợi cho lô sau
+        self._slots.acquire()
+        batch = [(texts, future) for texts, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            self._slots.release()
+            return
+        self._pool.submit(self._embed_batch, batch)
+
+    def _embed_batch(self, batch):
+        try:
+            unique = list(dict.fromkeys(text for texts, _ in batch for text in texts))
+            try:
+                vectors = dict(zip(unique, self.embeddings.embed_documents(unique)))
+            except Exception as e:
+                log_event("embedding_batch_failed", logging.WARNING, texts=len(unique), error=str(e))
+                for _, future in batch:
+                    future.set_exception(e)
+                return
+            self.telemetry.count("embedding_batches_total")
+            self.telemetry.count("embedding_batch_items_total", len(batch), kind="requests")
+            self.telemetry.count("embedding_batch_items_total", len(unique), kind="texts")
+            for texts, future in batch:
+                future.set_result([list(vectors[text]) for text in texts])
+        finally:
+            self._slots.release()
@@ -1,25 +1,178 @@
-from langdetect import detect, LangDetectException
+import logging
+import re
+import unicodedata
+from langdetect import DetectorFactory, detect, LangDetectException
+from langdetect.detector_factory import init_factory
+from src.clients import get_async_openai_client, get_openai_client
+from src.translation_memory import TranslationMemory
+from src.telemetry import log_event, telemetry
+
+# Cố định seed để langdetect cho kết quả ổn định với chuỗi ngắn
+DetectorFactory.seed = 0
+
+# Ký tự chỉ có trong tiếng Việt: ă â đ ê ô ơ ư và các dấu hỏi (U+0309), nặng (U+0323)
+_VIETNAMESE_LETTERS = set("ăâđêôơư")
+_VIETNAMESE_MARKS = {"̉", "̣"}
+_LATIN_TONE_MARKS = {"̀", "́", "̃"}
+# Từ chức năng tiếng Anh; bỏ các từ trùng với tiếng Việt gõ không dấu ("a", "an", "the", "do", "to",
+# "in", "on", "it", "be", "can"...), và phải gặp ít nhất _MIN_ENGLISH_WORDS từ mới coi là tiếng Anh
+_ENGLISH_WORDS = frozenset(
+    "is are was were been does did what which who whom why how when where "
+    "of for from with by and or not this that these those its should "
+    "between difference explain define describe give list".split()
+)
+_MIN_ENGLISH_WORDS = 2
+# Từ tiếng Việt thường gặp khi gõ không dấu ("a la gi"): langdetect hay nhận nhầm thành tiếng Ý/Pháp
+_UNACCENTED_VIETNAMESE_WORDS = frozenset("gi khong nhung cua duoc nhu nao cac la".split())
+_WORD = re.compile(r"[a-z]+")
+# Ngôn ngữ mà câu trả lời có thể được dịch sang (tên dùng trong prompt dịch)
+LANGUAGE_NAMES = {"en": "English", "vi": "Vietnamese"}
+
+_translation_memory = None
+
+def _default_translation_memory():
+    global _translation_memory
+    if _translation_memory is None:
+        _translation_memory = TranslationMemory()
+    return _translation_memory
+
+def detect_language_fast(text):
+    """
+    Nhận diện nhanh tiếng Việt/tiếng Anh dựa trên dấu tiếng Việt và các từ chức năng thường gặp.
+    Trả về 'vi', 'en' hoặc None nếu chưa chắc chắn.
+    """
+    lowered = text.lower()
+    decomposed = unicodedata.normalize("NFD", lowered)
+    letters = [c for c in decomposed if c.isalpha()]
+    if not letters:
+        return None
+
+    if any(c in _VIETNAMESE_LETTERS for c in unicodedata.normalize("NFC", lowered)) \
+            or any(c in _VIETNAMESE_MARKS for c in decomposed):
+        return 'vi'
+
+    tone_marks = sum(1 for c in decomposed if c in _LATIN_TONE_MARKS)
+    if tone_marks:
+        # Dấu sắc/huyền/ngã cũng có trong tiếng Pháp, Tây Ban Nha...: phải đủ nhiều mới coi là tiếng Việt
+        return 'vi' if tone_marks >= 2 and tone_marks / len(letters) >= 0.05 else None
+
+    if all(ord(c) < 128 for c in letters):
+        words = _WORD.findall(lowered)
+        if sum(word in _ENGLISH_WORDS for word in words) >= _MIN_ENGLISH_WORDS:
+            return 'en'
+        if sum(word in _UNACCENTED_VIETNAMESE_WORDS for word in words) >= 2:
+            return 'vi'
+    # Còn lại (cụm thuật ngữ ngắn, ngôn ngữ khác...) để langdetect quyết định
+    return None
+
+def preload_language_profiles():
+    """Nạp trước hồ sơ ngôn ngữ của langdetect (mặc định chỉ nạp ở lần detect() đầu tiên, ~0.4 giây)."""
+    init_factory()
 
 def detect_language(text):
-    """Phát hiện ngôn ngữ của một đoạn văn bản."""
+    """Phát hiện ngôn ngữ của một đoạn văn bản (nhanh với tiếng Việt/Anh, còn lại dùng langdetect)."""
+    with telemetry.stage("detect_language"):
+        fast = detect_language_fast(text)
+        if fast:
+            return fast
+        try:
+            # Trả về mã ngôn ngữ (ví dụ: 'en', 'vi')
+            return detect(text)
+        except LangDetectException:
+            # Mặc định là tiếng Anh nếu không phát hiện được
+            return 'en'
+
+def _cached_translation(text, target_language, memory):
+    cached = memory.get(text, target_language)
+    telemetry.record_cache("translation", cached is not None)
+    return cached
+
+def _record_usage(usage):
+    if usage is not None:
+        telemetry.add_tokens("translate", usage.prompt_tokens, usage.completion_tokens)
+
+def translate_text(text, target_language, client=None, memory=None):
+    """Dịch văn bản sang ngôn ngữ đích bằng OpenAI API (có bộ nhớ dịch; mặc định dùng client chung)."""
+    if memory is None:
+        memory = _default_translation_memory()
+    cached = _cached_translation(text, target_language, memory)
+    if cached is not None:
+        return cached
+
+    prompt = f"Translate the following text to {target_language}: '{text}'"
+    client = client or get_openai_client()
+
+    try:
+        with telemetry.stage("translate"):
+            response = client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0,
+            )
+        _record_usage(response.usage)
+        translation = response.choices[0].message.content.strip()
+        memory.put(text, target_language, translation)
+        return translation
+    except Exception as e:
+        log_event("translate_failed", logging.ERROR, error=str(e))
+        return text # Trả về văn bản gốc nếu có lỗi
+
+async def atranslate_text(text, target_language, client=None, memory=None):
+    """Phiên bản async của translate_text, dùng AsyncOpenAI client (mặc định là client async chung)."""
+    if memory is None:
+        memory = _default_translation_memory()
+    cached = _cached_translation(text, target_language, memory)
+    if cached is not None:
+        return cached
+
+    prompt = f"Translate the following text to {target_language}: '{text}'"
+    client = client or get_async_openai_client()
+
     try:
-        # Trả về mã ngôn ngữ (ví dụ: 'en', 'vi')
-        return detect(text)
-    except LangDetectException:
-        # Mặc định là tiếng Anh nếu không phát hiện được
-        return 'en'
-
-def translate_text(text, target_language, client):
-    """Dịch văn bản sang ngôn ngữ đích bằng OpenAI API."""
+        with telemetry.stage("translate"):
+            response = await client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0,
+            )
+        _record_usage(response.usage)
+        translation = response.choices[0].message.content.strip()
+        memory.put(text, target_language, translation)
+        return translation
+    except Exception as e:
+        log_event("translate_failed", logging.ERROR, error=str(e))
+        return text # Trả về văn bản gốc nếu có lỗi
+
+def stream_translate_text(text, target_language, client=None, memory=None):
+    """Dịch văn bản sang ngôn ngữ đích, trả về generator các token để hiển thị dần."""
+    if memory is None:
+        memory = _default_translation_memory()
+    cached = _cached_translation(text, target_language, memory)
+    if cached is not None:
+        yield cached
+        return
+
     prompt = f"Translate the following text to {target_language}: '{text}'"
-    
+    client = client or get_openai_client()
+
+    parts = []
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-        )
-        return response.choices[0].message.content.strip()
+        with telemetry.stage("translate"):
+            response = client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            for chunk in response:
+                _record_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        if parts:
+            memory.put(text, target_language, "".join(parts).strip())
     except Exception as e:
-        print(f"Lỗi trong quá trình dịch: {e}")
-        return text # Trả về văn bản gốc nếu có lỗi
\ No newline at end of file
+        log_event("translate_failed", logging.ERROR, error=str(e))
+        if not parts:
+            yield text # Trả về văn bản gốc nếu có lỗi
@@ -0,0 +1,133 @@
+import atexit
+import logging
+import queue
+import random
+import threading
+import time
+
+from src.answer_cache import normalize_question
+from src.telemetry import log_event, telemetry as default_telemetry
+
+
+class LearningQueue:
+    """
+    Hàng đợi ghi nền (write-behind) cho tính năng tự học.
+    Các cặp hỏi/đáp được gom thành lô và ghi vào kho hỏi/đáp (ApprovedQAStore) ở trạng thái chờ duyệt:
+    tối đa một lời gọi embedding và một lệnh insert cho cả lô, câu hỏi trùng nhau trong cùng lô
+    chỉ được ghi một lần, lỗi được thử lại với backoff.
+    """
+
+    def __init__(self, store, max_size=1000, batch_size=16, flush_interval=2.0,
+                 max_retries=4, backoff_base=0.5, telemetry=None):
+        self.store = store
+        self.telemetry = telemetry or default_telemetry
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {"written": 0, "failed": 0, "dropped": 0, "duplicates": 0, "retries": 0}
+        self.last_error = None
+
+        self._thread = threading.Thread(target=self._run, name="learning-queue", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, question, answer_text, embedding=None, language=None):
+        """
+        Đưa một cặp hỏi/đáp vào hàng đợi (kèm embedding câu hỏi nếu đã có, để khỏi tính lại,
+        và ngôn ngữ của câu trả lời nếu không phải tiếng Anh).
+        Trả về False nếu hàng đợi đã đầy.
+        """
+        try:
+            self._queue.put_nowait((question, answer_text, embedding, language))
+            return True
+        except queue.Full:
+            self._count("dropped")
+            log_event("learning_dropped", logging.WARNING, queue_size=self._queue.maxsize)
+            return False
+
+    def stats(self):
+        """Độ sâu hàng đợi và các bộ đếm ghi thành công/thất bại."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["depth"] = self._queue.qsize()
+        stats["last_error"] = self.last_error
+        return stats
+
+    def flush(self, timeout=None):
+        """Chờ cho tới khi mọi phần tử đã vào hàng đợi được xử lý xong."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if not self._thread.is_alive():
+                return False
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout=10.0):
+        """Ghi nốt các phần tử còn lại rồi dừng luồng nền (tự gọi khi thoát chương trình)."""
+        if self._stop.is_set():
+            return
+        self.flush(timeout)
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+
+    # --- Luồng nền ---
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+        self.telemetry.count("learning_items_total", amount, result=name)
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch):
+        # Bỏ các câu hỏi trùng trong lô, giữ câu trả lời mới nhất
+        unique = {}
+        for item in batch:
+            unique[normalize_question(item[0])] = item
+        if len(unique) < len(batch):
+            self._count("duplicates", len(batch) - len(unique))
+        items = list(unique.values())
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.telemetry.stage("learning_write"):
+                    self.store.add_pending(items)
+                self._count("written", len(items))
+                log_event("learning_written", items=len(items), status="pending")
+                return
+            except Exception as e:
+                self.last_error = str(e)
+                if attempt == self.max_retries:
+                    break
+                self._count("retries")
+                time.sleep(self.backoff_base * (2 ** attempt) * (1 + random.random()))
+
+        self._count("failed", len(items))
+        log_event("learning_failed", logging.ERROR, items=len(items), error=self.last_error)
@@ -0,0 +1,212 @@
+import gzip
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+from langchain_core.documents import Document
+
+from src.answer_cache import CACHE_DIR
+
+LEXICAL_INDEX_PATH = os.environ.get("LEXICAL_INDEX_PATH", os.path.join(CACHE_DIR, "lexical_index.json.gz"))
+# Trúng mạnh (bỏ qua embedding) khi cụm thuật ngữ: điểm BM25 của chunk tốt nhất tối thiểu bao nhiêu
+# và phải gấp bao nhiêu lần chunk thứ hai (từ chung như "testing" có điểm thấp và sát nhau)
+LEXICAL_STRONG_MIN_SCORE = float(os.environ.get("LEXICAL_STRONG_MIN_SCORE", "5.0"))
+LEXICAL_STRONG_MARGIN = float(os.environ.get("LEXICAL_STRONG_MARGIN", "1.2"))
+
+# Mã mục tiêu học tập (FL-4.2.1) được giữ nguyên thành một token
+_TOKEN_PATTERN = re.compile(r"fl-\d+(?:\.\d+)*|\w+")
+_LEARNING_OBJECTIVE = re.compile(r"^fl-\d+(?:\.\d+)+$")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how in is it its of on or that the this to "
+    "was what when where which who why with explain define describe meaning mean".split()
+)
+
+
+def tokenize(text):
+    """Tách từ cho BM25: chữ thường, bỏ stopword tiếng Anh, giữ nguyên mã FL-x.y.z."""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return [token for token in _TOKEN_PATTERN.findall(text) if token not in _STOPWORDS]
+
+
+def _phrase(text):
+    return " ".join(_TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", text or "").lower()))
+
+
+class LexicalIndex:
+    """
+    Chỉ mục đảo ngược BM25 trong bộ nhớ, xây từ cùng các chunk mà scripts/ingest_data.py tạo ra.
+    Mỗi chunk được định danh bằng content_hash nên có thể cập nhật từng phần khi ingest.
+    """
+
+    def __init__(self, path=LEXICAL_INDEX_PATH, k1=1.2, b=0.75, max_fast_path_terms=4,
+                 reload_check_interval=5.0, strong_min_score=LEXICAL_STRONG_MIN_SCORE,
+                 strong_margin=LEXICAL_STRONG_MARGIN):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_fast_path_terms = max_fast_path_terms
+        self.strong_min_score = strong_min_score
+        self.strong_margin = strong_margin
+        self.reload_check_interval = reload_check_interval
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._postings = {}
+        self._total_length = 0
+        self._mtime = None
+        self._checked_at = 0.0
+        self.load()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def keys(self):
+        return set(self._docs)
+
+    # --- Cập nhật ---
+    def add(self, key, content, metadata):
+        terms = Counter(tokenize(content))
+        with self._lock:
+            if key in self._docs:
+                self._remove(key)
+            self._docs[key] = {"content": content, "metadata": metadata, "terms": dict(terms),
+                               "length": sum(terms.values())}
+            self._total_length += self._docs[key]["length"]
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[key] = tf
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        self._total_length -= doc["length"]
+        for term in doc["terms"]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+
+    def sync(self, chunks):
+        """
+        Đồng bộ chỉ mục với tập chunk hiện tại ({content_hash: Document}):
+        chỉ thêm chunk mới, xoá chunk không còn tồn tại và cập nhật metadata (trang...) của chunk
+        đã dời chỗ. Trả về (số thêm, số xoá, số cập nhật metadata).
+        """
+        stale = [key for key in self._docs if key not in chunks]
+        for key in stale:
+            self.remove(key)
+        added = updated = 0
+        for key, chunk in chunks.items():
+            if key not in self._docs:
+                self.add(key, chunk.page_content, chunk.metadata)
+                added += 1
+            elif self._docs[key]["metadata"] != chunk.metadata:
+                with self._lock:
+                    self._docs[key]["metadata"] = chunk.metadata
+                updated += 1
+        return added, len(stale), updated
+
+    # --- Lưu trữ ---
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            payload = {key: {"content": doc["content"], "metadata": doc["metadata"], "terms": doc["terms"]}
+                       for key, doc in self._docs.items()}
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        self._mtime = os.path.getmtime(self.path)
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+        docs, postings, total_length = {}, {}, 0
+        for key, doc in payload.items():
+            doc["length"] = sum(doc["terms"].values())
+            total_length += doc["length"]
+            docs[key] = doc
+            for term, tf in doc["terms"].items():
+                postings.setdefault(term, {})[key] = tf
+        with self._lock:
+            self._docs, self._postings, self._total_length = docs, postings, total_length
+
+    def reload_if_changed(self):
+        """Nạp lại chỉ mục nếu file trên đĩa đã được ingest cập nhật."""
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load()
+
+    # --- Tìm kiếm ---
+    def search(self, query, k=5):
+        """Trả về k cặp (Document, điểm BM25) tốt nhất."""
+        terms = set(tokenize(query))
+        with self._lock:
+            count = len(self._docs)
+            if not count or not terms:
+                return []
+            avg_length = self._total_length / count
+            scores = Counter()
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, tf in postings.items():
+                    length = self._docs[key]["length"]
+                    scores[key] += idf * tf * (self.k1 + 1) / (
+                        tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+            return [
+                (Document(page_content=self._docs[key]["content"], metadata=self._docs[key]["metadata"]), score)
+                for key, score in scores.most_common(k)
+            ]
+
+    def is_strong_hit(self, query, results):
+        """
+        Kết quả đủ chắc để trả lời mà không cần embedding: câu hỏi ngắn và
+        - chỉ gồm mã FL-x.y.z, mã đều xuất hiện nguyên văn trong chunk tốt nhất; hoặc
+        - là một cụm thuật ngữ xuất hiện nguyên văn trong chunk tốt nhất, chunk này có điểm BM25
+          từ strong_min_score và vượt chunk thứ hai ít nhất strong_margin lần.
+        """
+        if not results:
+            return False
+        terms = tokenize(query)
+        if not terms or len(terms) > self.max_fast_path_terms:
+            return False
+        top_content = _phrase(results[0][0].page_content)
+        if all(_LEARNING_OBJECTIVE.match(term) for term in terms):
+            return all(code in top_content for code in terms)
+        top_score = results[0][1]
+        runner_up = results[1][1] if len(results) > 1 else 0.0
+        if top_score < self.strong_min_score or top_score < runner_up * self.strong_margin:
+            return False
+        return f" {' '.join(terms)} " in f" {top_content} "
+
+
+def reciprocal_rank_fusion(*ranked_lists, k=5, rrf_k=60):
+    """Gộp nhiều danh sách (Document, điểm) đã xếp hạng bằng reciprocal-rank fusion."""
+    scores, docs = Counter(), {}
+    for ranked in ranked_lists:
+        for rank, (doc, _) in enumerate(ranked):
+            key = doc.metadata.get("content_hash") or doc.page_content
+            docs.setdefault(key, doc)
+            scores[key] += 1.0 / (rrf_k + rank + 1)
+    return [docs[key] for key, _ in scores.most_common(k)]
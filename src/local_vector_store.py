@@ -0,0 +1,327 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from src.answer_cache import CACHE_DIR
+from src.telemetry import log_event
+
+# Chọn backend cho vector store: "supabase" (mặc định) hoặc "local"
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "supabase")
+LOCAL_VECTOR_STORE_PATH = os.environ.get("LOCAL_VECTOR_STORE_PATH", os.path.join(CACHE_DIR, "vector_store"))
+LOCAL_VECTOR_STORE_QUANTIZED = os.environ.get("LOCAL_VECTOR_STORE_QUANTIZED", "false").lower() == "true"
+
+HEADER_FILE = "header.json"
+VECTORS_FILE = "embeddings.f32"
+QUANTIZED_FILE = "embeddings.i8"
+SCALES_FILE = "scales.f32"
+METADATA_FILE = "metadata.jsonl"
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Vector store cục bộ thay thế cho bảng `documents` trên Supabase.
+    Embedding (đã chuẩn hoá, nên tích vô hướng = cosine similarity như match_documents)
+    được lưu trong ma trận float32 memory-mapped, tuỳ chọn thêm bản lượng tử hoá int8;
+    nội dung và metadata nằm trong file JSONL đi kèm.
+    """
+
+    def __init__(self, path, embedding, quantized=LOCAL_VECTOR_STORE_QUANTIZED, rerank_factor=4,
+                 reload_check_interval=5.0):
+        self.path = path
+        self._embedding = embedding
+        self.quantized = quantized
+        self.rerank_factor = rerank_factor
+        self.reload_check_interval = reload_check_interval
+        # RLock: add_vectors/delete ghi lại file rồi nạp lại trong cùng khoá
+        self._lock = threading.RLock()
+        self._header_stamp = None
+        self._checked_at = 0.0
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self._load()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def __len__(self):
+        return len(self._rows)
+
+    # --- Lưu trữ ---
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _header_mtime(self):
+        try:
+            stat = os.stat(self._file(HEADER_FILE))
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _load(self):
+        # Đọc hết rồi mới gán: lỗi giữa chừng (file đang được ghi dở) không làm hỏng trạng thái đang dùng
+        stamp = self._header_mtime()
+        header = {"dim": 0, "count": 0}
+        if stamp is not None:
+            with open(self._file(HEADER_FILE), "r", encoding="utf-8") as f:
+                header = json.load(f)
+        dim, count = header["dim"], header["count"]
+
+        rows = []
+        if count:
+            with open(self._file(METADATA_FILE), "r", encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f if line.strip()][:count]
+            if len(rows) < count:
+                raise ValueError(f"{METADATA_FILE} có {len(rows)} dòng, header ghi {count}")
+        mapped = self._map_vectors(count, dim)
+        self.dim, self._rows = dim, rows
+        self._index = {row["id"]: i for i, row in enumerate(rows)}
+        self._vectors, self._quantized, self._scales = mapped
+        self._header_stamp = stamp
+
+    def reload_if_changed(self):
+        """
+        Nạp lại kho nếu tiến trình khác (scripts/ingest_data.py, job ngân hàng câu trả lời) đã ghi lại nó.
+        Header luôn được ghi sau cùng nên chỉ cần theo dõi file header.
+        """
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_check_interval:
+            return
+        self._checked_at = now
+        if self._header_mtime() == self._header_stamp:
+            return
+        with self._lock:
+            if self._header_mtime() == self._header_stamp:
+                return
+            try:
+                self._load()
+            except (OSError, ValueError) as e:
+                # Bắt gặp lúc tiến trình kia đang ghi: giữ dữ liệu cũ, thử lại ở lần kiểm tra sau
+                log_event("local_vector_store_reload_failed", logging.WARNING, path=self.path, error=str(e))
+
+    def _map_vectors(self, count, dim):
+        if not count:
+            return None, None, None
+        vectors = np.memmap(self._file(VECTORS_FILE), dtype=np.float32, mode="r", shape=(count, dim))
+        if not self.quantized:
+            return vectors, None, None
+        if not os.path.exists(self._file(QUANTIZED_FILE)):
+            self._write_quantized(np.asarray(vectors))
+        quantized = np.memmap(self._file(QUANTIZED_FILE), dtype=np.int8, mode="r", shape=(count, dim))
+        scales = np.memmap(self._file(SCALES_FILE), dtype=np.float32, mode="r", shape=(count,))
+        return vectors, quantized, scales
+
+    def _remap(self):
+        """Map lại sau khi chính tiến trình này ghi (không cần đọc lại metadata)."""
+        self._vectors, self._quantized, self._scales = self._map_vectors(len(self._rows), self.dim)
+        self._header_stamp = self._header_mtime()
+
+    def _replace(self, name, data, text=False):
+        """
+        Ghi cả file qua file tạm rồi os.replace: các memmap đang mở (luồng khác, tiến trình khác)
+        vẫn trỏ vào file cũ còn nguyên vẹn, không bao giờ đọc phải file bị cắt ngắn (SIGBUS).
+        """
+        tmp = self._file(f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w" if text else "wb", **({"encoding": "utf-8"} if text else {})) as f:
+            f.write(data)
+        os.replace(tmp, self._file(name))
+
+    def _quantize(self, vectors):
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+        return quantized.tobytes(), scales.astype(np.float32).tobytes()
+
+    def _write_quantized(self, vectors):
+        quantized, scales = self._quantize(vectors)
+        self._replace(QUANTIZED_FILE, quantized)
+        self._replace(SCALES_FILE, scales)
+
+    def _write_header(self):
+        self._replace(HEADER_FILE, json.dumps({"dim": self.dim, "count": len(self._rows)}), text=True)
+
+    def _write_metadata(self, rows):
+        self._replace(METADATA_FILE, "".join(
+            json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n" for row in rows), text=True)
+
+    def _rewrite(self, rows, vectors):
+        """Ghi lại toàn bộ dữ liệu (dùng khi cập nhật hoặc xoá dòng đã có)."""
+        self._replace(VECTORS_FILE, np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        if self.quantized or os.path.exists(self._file(QUANTIZED_FILE)):
+            self._write_quantized(vectors)
+        self._write_metadata(rows)
+        self._rows = rows
+        self._index = {row["id"]: i for i, row in enumerate(rows)}
+        self._write_header()
+        self._remap()
+
+    def add_vectors(self, vectors, documents, ids=None):
+        """Thêm (hoặc ghi đè theo id) các document với embedding đã tính sẵn."""
+        ids = [str(i) for i in ids] if ids else [str(uuid.uuid4()) for _ in documents]
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(documents), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+        new_rows = [
+            {"id": doc_id, "content": doc.page_content, "metadata": doc.metadata}
+            for doc_id, doc in zip(ids, documents)
+        ]
+
+        with self._lock:
+            if not self.dim:
+                self.dim = vectors.shape[1]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} khác với kho hiện tại ({self.dim})")
+
+            if any(doc_id in self._index for doc_id in ids) or len(set(ids)) < len(ids):
+                rows = list(self._rows)
+                matrix = np.array(self._vectors) if self._vectors is not None else np.empty((0, self.dim), np.float32)
+                index = dict(self._index)
+                for row, vector in zip(new_rows, vectors):
+                    if row["id"] in index:
+                        rows[index[row["id"]]] = row
+                        matrix[index[row["id"]]] = vector
+                    else:
+                        index[row["id"]] = len(rows)
+                        rows.append(row)
+                        matrix = np.vstack([matrix, vector[None, :]])
+                self._rewrite(rows, matrix)
+                return ids
+
+            # Chỉ thêm mới: nối vào cuối các file, không cần ghi lại toàn bộ (nối thêm không làm
+            # hỏng các memmap đang mở, vốn chỉ map số dòng cũ)
+            with open(self._file(VECTORS_FILE), "ab") as f:
+                f.write(vectors.tobytes())
+            if self.quantized or os.path.exists(self._file(QUANTIZED_FILE)):
+                quantized, scales = self._quantize(vectors)
+                with open(self._file(QUANTIZED_FILE), "ab") as f:
+                    f.write(quantized)
+                with open(self._file(SCALES_FILE), "ab") as f:
+                    f.write(scales)
+            with open(self._file(METADATA_FILE), "a", encoding="utf-8") as f:
+                for row in new_rows:
+                    f.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n")
+            for row in new_rows:
+                self._index[row["id"]] = len(self._rows)
+                self._rows.append(row)
+            self._write_header()
+            self._remap()
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = self._embedding.embed_documents(texts)
+        documents = [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+        return self.add_vectors(vectors, documents, ids)
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return False
+        remove = {str(i) for i in ids}
+        with self._lock:
+            keep = [i for i, row in enumerate(self._rows) if row["id"] not in remove]
+            if len(keep) == len(self._rows):
+                return False
+            matrix = np.asarray(self._vectors)[keep] if keep else np.empty((0, self.dim), np.float32)
+            self._rewrite([self._rows[i] for i in keep], matrix)
+        return True
+
+    def update_metadata(self, metadata_by_id):
+        """Thay metadata của các dòng theo id, giữ nguyên embedding (chỉ ghi lại file metadata)."""
+        with self._lock:
+            rows = [{**row, "metadata": metadata_by_id[row["id"]]} if row["id"] in metadata_by_id else row
+                    for row in self._rows]
+            self._write_metadata(rows)
+            self._rows = rows
+            self._write_header()
+            self._header_stamp = self._header_mtime()
+
+    def rows(self):
+        """Danh sách (id, metadata) của mọi dòng, dùng để lập manifest khi ingest."""
+        return [(row["id"], row["metadata"]) for row in self._rows]
+
+    # --- Tìm kiếm ---
+    @staticmethod
+    def _matches(metadata, filter):
+        for key, expected in filter.items():
+            value = metadata.get(key)
+            if isinstance(expected, dict) and "$in" in expected:
+                if value not in expected["$in"]:
+                    return False
+            elif value != expected:
+                # None nghĩa là khoá không tồn tại hoặc bằng null
+                return False
+        return True
+
+    def similarity_search_by_vector_with_relevance_scores(self, query, k=4, filter=None, score_threshold=None, **kwargs):
+        """Trả về k cặp (document, cosine similarity) giống match_documents của Supabase."""
+        with self._lock:
+            rows, vectors, quantized, scales = self._rows, self._vectors, self._quantized, self._scales
+        if vectors is None:
+            return []
+
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        candidates = None
+        if filter:
+            candidates = np.array([i for i, row in enumerate(rows) if self._matches(row["metadata"], filter)], dtype=np.int64)
+            if not len(candidates):
+                return []
+
+        if quantized is not None:
+            # Lọc sơ bộ bằng int8 rồi tính lại điểm chính xác bằng float32 cho nhóm ứng viên
+            coarse = (quantized @ query) * scales if candidates is None else (quantized[candidates] @ query) * scales[candidates]
+            top = _top_k(coarse, k * self.rerank_factor)
+            idx = top if candidates is None else candidates[top]
+            scores = vectors[idx] @ query
+            order = np.argsort(-scores)[:k]
+            idx, scores = idx[order], scores[order]
+        else:
+            scores = vectors @ query if candidates is None else vectors[candidates] @ query
+            top = _top_k(scores, k)
+            top = top[np.argsort(-scores[top])]
+            idx = top if candidates is None else candidates[top]
+            scores = scores[top]
+
+        results = [
+            (Document(page_content=rows[i]["content"], metadata=rows[i]["metadata"]), float(score))
+            for i, score in zip(idx, scores)
+        ]
+        if score_threshold is not None:
+            results = [(doc, score) for doc, score in results if score >= score_threshold]
+        return results
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_relevance_scores(
+            self._embedding.embed_query(query), k, filter, **kwargs
+        )
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, path=LOCAL_VECTOR_STORE_PATH, **kwargs):
+        store = cls(path, embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+
+def _top_k(scores, k):
+    k = min(k, len(scores))
+    if k == len(scores):
+        return np.arange(len(scores))
+    return np.argpartition(-scores, k - 1)[:k]
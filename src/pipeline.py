@@ -0,0 +1,152 @@
+import asyncio
+import contextvars
+import threading
+from contextlib import aclosing
+
+from src.language_utils import LANGUAGE_NAMES, detect_language, atranslate_text, stream_translate_text
+from src.telemetry import telemetry
+
+
+class EventLoopThread:
+    """
+    Event loop chạy trên một luồng nền, để code đồng bộ (như trang Streamlit)
+    gọi được các hàm async mà các client async luôn gắn với cùng một loop.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def run(self, coro, timeout=None):
+        """Chạy coroutine trên loop nền và chờ kết quả (giữ nguyên context, ví dụ trace của lượt hỏi)."""
+        context = contextvars.copy_context()
+        return asyncio.run_coroutine_threadsafe(_in_context(coro, context), self.loop).result(timeout)
+
+
+async def _in_context(coro, context):
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+async def aprepare_turn(bot, user_message, client=None):
+    """
+    Phát hiện ngôn ngữ và dịch câu hỏi sang tiếng Anh.
+    Ở chế độ cross-lingual (bot.cross_lingual) câu hỏi được giữ nguyên, không dịch; câu hỏi đã có
+    sẵn câu trả lời (ví dụ trong ngân hàng câu trả lời tiếng Việt) cũng không cần dịch.
+    Trả về (ngôn ngữ gốc, câu hỏi dùng để truy xuất).
+    """
+    original_lang = detect_language(user_message)
+    telemetry.annotate(mode="cross_lingual" if bot.cross_lingual else "translate")
+    if original_lang != 'vi' or bot.cross_lingual:
+        return original_lang, user_message
+    # Bắt đầu dịch ngay, song song với việc tra bảng băm (trên luồng phụ: lần tải danh sách đầu tiên có thể
+    # gọi mạng). Nếu trúng thì huỷ bước dịch; kết quả trúng được bot ghi vào cache nên bước tìm trong
+    # giáo trình dùng lại ngay
+    translation = asyncio.create_task(atranslate_text(user_message, "English", client))
+    try:
+        approved = await asyncio.to_thread(bot.approved_answer, user_message, original_lang)
+    except BaseException:
+        translation.cancel()
+        raise
+    if approved is not None:
+        translation.cancel()
+        return original_lang, user_message
+    return original_lang, await translation
+
+
+def needs_translation(original_lang, result):
+    """
+    Câu trả lời có cần dịch sang ngôn ngữ của người dùng không: khi câu trả lời (không có "language"
+    là tiếng Anh) khác ngôn ngữ người hỏi, ví dụ câu trả lời tiếng Anh của luồng dịch cho người hỏi
+    tiếng Việt, hay câu trả lời đã duyệt tiếng Việt cho người hỏi tiếng Anh. Chỉ dịch sang các ngôn ngữ
+    trong LANGUAGE_NAMES (tên ngôn ngữ đích: LANGUAGE_NAMES[original_lang]).
+    """
+    return original_lang in LANGUAGE_NAMES and result.get('language', 'en') != original_lang
+
+
+async def aanswer_turn(bot, user_message, client=None):
+    """
+    Xử lý trọn một lượt hỏi đáp giống iSTQB_ChatBot.py: phát hiện ngôn ngữ, dịch,
+    tìm trong giáo trình, dự phòng bằng OpenAI và dịch ngược câu trả lời.
+    Tra câu trả lời đã duyệt chạy song song với bước dịch câu hỏi (aprepare_turn); việc ghi tri thức mới
+    (nếu có) nằm trong hàng đợi nền nên chạy song song với bước dịch ngược.
+    """
+    with telemetry.turn(user_message) as turn:
+        original_lang, english_prompt = await aprepare_turn(bot, user_message, client)
+        telemetry.annotate(language=original_lang, path="syllabus")
+
+        final_result = await bot.asearch_in_syllabus(english_prompt, language=original_lang)
+        if not final_result:
+            telemetry.annotate(path="fallback")
+            final_result = await bot.asearch_with_openai_and_learn(english_prompt, language=original_lang)
+
+        english_answer = final_result.get('answer', "Xin lỗi, đã có lỗi xảy ra.")
+        final_answer = english_answer
+        if needs_translation(original_lang, final_result) and english_answer:
+            final_answer = await atranslate_text(english_answer, LANGUAGE_NAMES[original_lang], client)
+
+    return {
+        "answer": final_answer,
+        "sources": final_result.get('sources', []),
+        "language": original_lang,
+        "trace_id": turn.trace_id,
+    }
+
+
+async def astream_turn(bot, user_message, client=None, sync_client=None):
+    """
+    Phiên bản streaming của aanswer_turn (cho dịch vụ HTTP/SSE): async generator các sự kiện
+    ("meta", {...}), ("token", văn bản)... và cuối cùng ("done", {...}). "sources" trong "done" là nguồn cuối cùng
+    (stream giáo trình có thể chuyển sang câu trả lời của OpenAI giữa chừng).
+    Bước stream câu trả lời dùng API streaming đồng bộ của Chatbot, mỗi token được lấy trên một
+    luồng phụ để không chặn event loop. Cần đóng generator (aclosing) trong cùng task đã dùng nó.
+    """
+    with telemetry.turn(user_message) as turn:
+        original_lang, english_prompt = await aprepare_turn(bot, user_message, client)
+        telemetry.annotate(language=original_lang, path="syllabus")
+
+        final_result = await asyncio.to_thread(bot.stream_in_syllabus, english_prompt, original_lang)
+        if not final_result:
+            telemetry.annotate(path="fallback")
+            final_result = await asyncio.to_thread(bot.stream_with_openai_and_learn, english_prompt, original_lang)
+
+        yield "meta", {"language": original_lang, "sources": final_result.get("sources", []),
+                       "trace_id": turn.trace_id}
+
+        chunks = final_result["stream"]
+        if needs_translation(original_lang, final_result):
+            # Cần câu trả lời tiếng Anh đầy đủ trước khi dịch ngược, sau đó stream bản dịch
+            english_answer = "".join(await asyncio.to_thread(list, chunks))
+            chunks = stream_translate_text(english_answer, LANGUAGE_NAMES[original_lang], sync_client)
+
+        parts = []
+        async with aclosing(_aiter_in_thread(chunks)) as tokens:
+            async for chunk in tokens:
+                parts.append(chunk)
+                yield "token", chunk
+
+    yield "done", {"answer": "".join(parts) or "Xin lỗi, đã có lỗi xảy ra.",
+                   "sources": final_result.get("sources", []), "trace_id": turn.trace_id}
+
+
+_END = object()
+
+
+async def _aiter_in_thread(chunks):
+    """Duyệt một generator đồng bộ (gọi mạng) từ code async, mỗi bước chạy trên một luồng phụ."""
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, _END)
+            if chunk is _END:
+                return
+            yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            try:
+                close()
+            except ValueError:
+                # Generator đang chạy dở trên luồng phụ (bị huỷ giữa chừng): để luồng đó tự kết thúc
+                pass
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Giới hạn số request và số token mỗi phút theo kiểu token bucket.
+    Dùng được từ nhiều luồng (acquire) lẫn từ code async (aacquire).
+    Giới hạn nào là None thì không áp dụng.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        for name, per_minute in (("requests", requests_per_minute), ("tokens", tokens_per_minute)):
+            if per_minute:
+                # [sức chứa, lượng hiện có, tốc độ nạp mỗi giây, thời điểm nạp cuối]
+                self._buckets[name] = [float(per_minute), float(per_minute), per_minute / 60.0, time.monotonic()]
+
+    def _reserve(self, tokens):
+        """Trừ quota nếu đủ và trả về 0, ngược lại trả về số giây cần chờ."""
+        wanted = {"requests": 1, "tokens": tokens}
+        now = time.monotonic()
+        wait = 0.0
+        for name, bucket in self._buckets.items():
+            capacity, level, rate, updated = bucket
+            level = min(capacity, level + (now - updated) * rate)
+            bucket[1], bucket[3] = level, now
+            amount = min(wanted[name], capacity)
+            if level < amount:
+                wait = max(wait, (amount - level) / rate)
+        if wait == 0.0:
+            for name, bucket in self._buckets.items():
+                bucket[1] -= min(wanted[name], bucket[0])
+        return wait
+
+    def acquire(self, tokens=0):
+        """Chờ (chặn luồng) cho tới khi có đủ quota cho một request dùng `tokens` token."""
+        while True:
+            with self._lock:
+                wait = self._reserve(tokens)
+            if wait == 0.0:
+                return
+            time.sleep(wait)
+
+    def try_acquire(self, tokens=0):
+        """Lấy quota nếu đủ ngay (trả về 0), ngược lại không chờ mà trả về số giây cần chờ."""
+        with self._lock:
+            return self._reserve(tokens)
+
+    async def aacquire(self, tokens=0):
+        """Phiên bản async của acquire."""
+        while True:
+            with self._lock:
+                wait = self._reserve(tokens)
+            if wait == 0.0:
+                return
+            await asyncio.sleep(wait)
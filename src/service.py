@@ -0,0 +1,302 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing, asynccontextmanager
+
+from aiohttp import web
+
+from src.clients import aclose_async_clients, close_clients, get_openai_client
+from src.pipeline import aanswer_turn, astream_turn
+from src.rate_limit import RateLimiter
+from src.startup import STARTUP_WARMUP, startup, warm_up
+from src.telemetry import log_event, telemetry
+
+# Chạy: python -m src.service (các client như LMS, Slack bot hay trang Streamlit gọi qua HTTP)
+SERVICE_HOST = os.environ.get("CHATBOT_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("CHATBOT_SERVICE_PORT", "8080"))
+# Số lượt hỏi xử lý đồng thời trên toàn dịch vụ (vượt quá thì xếp hàng) và số luồng cho các bước đồng bộ
+SERVICE_MAX_CONCURRENCY = int(os.environ.get("CHATBOT_SERVICE_MAX_CONCURRENCY", "32"))
+SERVICE_WORKER_THREADS = int(os.environ.get("CHATBOT_SERVICE_WORKER_THREADS", "64"))
+# Giới hạn của từng client (theo API key, header X-Client-Id hoặc địa chỉ IP); 0 là không giới hạn
+SERVICE_CLIENT_CONCURRENCY = int(os.environ.get("CHATBOT_SERVICE_CLIENT_CONCURRENCY", "4"))
+SERVICE_CLIENT_RPM = int(os.environ.get("CHATBOT_SERVICE_CLIENT_RPM", "60"))
+# API key của các client, dạng "lms:key1,slack:key2"; để trống thì không yêu cầu xác thực
+SERVICE_API_KEYS = os.environ.get("CHATBOT_SERVICE_API_KEYS", "")
+SERVICE_REQUEST_TIMEOUT = float(os.environ.get("CHATBOT_SERVICE_REQUEST_TIMEOUT", "120"))
+# Thời gian tối đa chờ các request đang chạy và hàng đợi tự học khi tắt dịch vụ
+SERVICE_SHUTDOWN_TIMEOUT = float(os.environ.get("CHATBOT_SERVICE_SHUTDOWN_TIMEOUT", "30"))
+MAX_QUESTION_CHARS = int(os.environ.get("CHATBOT_SERVICE_MAX_QUESTION_CHARS", "2000"))
+MAX_TRACKED_CLIENTS = 10000
+
+BOT = web.AppKey("bot", object)
+STATE = web.AppKey("state", object)
+
+
+def parse_api_keys(value):
+    """"lms:key1,slack:key2" -> {"key1": "lms", "key2": "slack"}."""
+    keys = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, key = item.partition(":")
+        if not key:
+            raise ValueError(f"CHATBOT_SERVICE_API_KEYS không hợp lệ: {item!r} (cần dạng tên:key)")
+        keys[key.strip()] = name.strip()
+    return keys
+
+
+class ClientLimits:
+    """
+    Giới hạn số request mỗi phút và số request đồng thời của từng client.
+    Chỉ dùng trên event loop của dịch vụ nên không cần khoá.
+    """
+
+    def __init__(self, concurrency=SERVICE_CLIENT_CONCURRENCY, requests_per_minute=SERVICE_CLIENT_RPM,
+                 max_clients=MAX_TRACKED_CLIENTS):
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.max_clients = max_clients
+        # client -> [RateLimiter, số request đang chạy], theo thứ tự dùng gần nhất
+        self._clients = OrderedDict()
+
+    def acquire(self, client_id):
+        """Giữ một chỗ cho client và trả về 0, hoặc trả về số giây nên chờ trước khi thử lại."""
+        state = self._clients.get(client_id)
+        if state is None:
+            self._evict_idle()
+            state = self._clients[client_id] = [RateLimiter(self.requests_per_minute or None), 0]
+        self._clients.move_to_end(client_id)
+        if self.concurrency and state[1] >= self.concurrency:
+            return 1.0
+        wait = state[0].try_acquire()
+        if wait:
+            return wait
+        state[1] += 1
+        return 0.0
+
+    def release(self, client_id):
+        state = self._clients.get(client_id)
+        if state is not None:
+            state[1] -= 1
+
+    def _evict_idle(self):
+        # Bỏ client ít dùng nhất không còn request nào đang chạy
+        if len(self._clients) < self.max_clients:
+            return
+        for client_id, state in self._clients.items():
+            if state[1] == 0:
+                del self._clients[client_id]
+                return
+
+
+class ServiceState:
+    def __init__(self, api_keys, limits, max_concurrency):
+        self.api_keys = api_keys
+        self.limits = limits
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.draining = False
+        self.started_at = time.time()
+        self.executor = None
+
+
+def _error(status, message, **headers):
+    body = json.dumps({"error": message}, ensure_ascii=False)
+    return status(text=body, content_type="application/json", headers=headers or None)
+
+
+def _client_id(request, state):
+    if state.api_keys:
+        authorization = request.headers.get("Authorization", "")
+        key = authorization[7:].strip() if authorization.startswith("Bearer ") else request.headers.get("X-API-Key")
+        if key not in state.api_keys:
+            raise _error(web.HTTPUnauthorized, "API key không hợp lệ")
+        return state.api_keys[key]
+    return request.headers.get("X-Client-Id") or request.remote or "unknown"
+
+
+async def _read_question(request):
+    try:
+        payload = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise _error(web.HTTPBadRequest, "Body phải là JSON dạng {\"question\": \"...\"}")
+    question = payload.get("question") if isinstance(payload, dict) else None
+    if not isinstance(question, str) or not question.strip():
+        raise _error(web.HTTPBadRequest, "Thiếu câu hỏi (question)")
+    if len(question) > MAX_QUESTION_CHARS:
+        raise _error(web.HTTPBadRequest, f"Câu hỏi dài quá {MAX_QUESTION_CHARS} ký tự")
+    return question.strip()
+
+
+@asynccontextmanager
+async def _slot(request, endpoint):
+    """Kiểm tra xác thực và giới hạn của client, rồi chờ một chỗ trong giới hạn đồng thời chung."""
+    state = request.app[STATE]
+    if state.draining:
+        raise _error(web.HTTPServiceUnavailable, "Dịch vụ đang tắt", **{"Retry-After": "5"})
+    client_id = _client_id(request, state)
+    question = await _read_question(request)
+
+    wait = state.limits.acquire(client_id)
+    if wait:
+        telemetry.count("service_rejected_total", endpoint=endpoint, reason="client_limit")
+        log_event("service_rate_limited", logging.WARNING, client=client_id, endpoint=endpoint, retry_after=wait)
+        raise _error(web.HTTPTooManyRequests, "Vượt quá giới hạn request của client",
+                     **{"Retry-After": str(max(1, math.ceil(wait)))})
+    try:
+        async with state.semaphore:
+            state.in_flight += 1
+            telemetry.count("service_requests_total", endpoint=endpoint)
+            try:
+                yield question
+            finally:
+                state.in_flight -= 1
+    finally:
+        state.limits.release(client_id)
+
+
+# --- Endpoint ---
+async def handle_ask(request):
+    """POST /ask {"question": ...} -> {"answer", "sources", "language", "trace_id"}."""
+    async with _slot(request, "ask") as question:
+        try:
+            result = await asyncio.wait_for(
+                aanswer_turn(request.app[BOT], question), SERVICE_REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise _error(web.HTTPGatewayTimeout, "Hết thời gian xử lý câu hỏi")
+    return web.json_response(result, dumps=lambda data: json.dumps(data, ensure_ascii=False, default=str))
+
+
+async def handle_stream(request):
+    """
+    POST /stream {"question": ...} -> text/event-stream với các sự kiện "meta" (ngôn ngữ, nguồn,
+    trace_id), "token" ({"text": ...}) lặp lại, rồi "done" ({"answer", "sources"}) hoặc "error".
+    """
+    async with _slot(request, "stream") as question:
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream; charset=utf-8",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+        await response.prepare(request)
+
+        async def pump():
+            events = astream_turn(request.app[BOT], question, sync_client=get_openai_client())
+            async with aclosing(events):
+                async for event, data in events:
+                    await _send_event(response, event, {"text": data} if event == "token" else data)
+
+        try:
+            await asyncio.wait_for(pump(), SERVICE_REQUEST_TIMEOUT)
+        except ConnectionResetError:
+            # Client đã ngắt kết nối: dừng stream (câu trả lời đầy đủ vẫn được cache nếu đã sinh xong)
+            log_event("service_client_disconnected", logging.INFO, endpoint="stream")
+            return response
+        except Exception as e:
+            message = "Hết thời gian xử lý câu hỏi" if isinstance(e, asyncio.TimeoutError) else "Đã có lỗi xảy ra"
+            log_event("service_stream_failed", logging.ERROR, error=f"{type(e).__name__}: {e}")
+            try:
+                await _send_event(response, "error", {"error": message})
+            except ConnectionResetError:
+                return response
+        try:
+            await response.write_eof()
+        except ConnectionResetError:
+            # Client đóng kết nối ngay sau sự kiện "done"
+            pass
+    return response
+
+
+async def _send_event(response, event, data):
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    await response.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+
+
+async def handle_health(request):
+    """GET /health: 200 khi sẵn sàng, 503 khi đang tắt (để load balancer ngừng gửi request)."""
+    state = request.app[STATE]
+    bot = request.app[BOT]
+    body = {
+        "status": "draining" if state.draining else "ok",
+        "uptime": round(time.time() - state.started_at, 3),
+        "in_flight": state.in_flight,
+        "learning_queue": bot.learning_queue.stats(),
+    }
+    return web.json_response(body, status=503 if state.draining else 200,
+                             dumps=lambda data: json.dumps(data, default=str))
+
+
+async def handle_metrics(request):
+    return web.Response(text=telemetry.render_prometheus(), content_type="text/plain")
+
+
+# --- Vòng đời ---
+async def _on_startup(app):
+    state = app[STATE]
+    # Các bước đồng bộ (truy xuất, stream LLM, tra cứu) chạy trên nhóm luồng có kích thước cố định
+    state.executor = ThreadPoolExecutor(max_workers=SERVICE_WORKER_THREADS, thread_name_prefix="chatbot")
+    asyncio.get_running_loop().set_default_executor(state.executor)
+    if app.get(BOT) is None:
+        with startup.phase("init_chatbot"):
+            from src.chatbot import Chatbot
+            app[BOT] = await asyncio.to_thread(Chatbot)
+        if STARTUP_WARMUP:
+            # Khởi động nóng trước khi nhận request; connection async được mở trên chính loop của dịch vụ
+            loop = asyncio.get_running_loop()
+            await asyncio.to_thread(warm_up, app[BOT],
+                                    lambda coro: asyncio.run_coroutine_threadsafe(coro, loop).result())
+    startup.mark("service_ready")
+    startup.log()
+    log_event("service_started", max_concurrency=SERVICE_MAX_CONCURRENCY,
+              client_concurrency=state.limits.concurrency, client_rpm=state.limits.requests_per_minute)
+
+
+async def _on_shutdown(app):
+    # Gọi sau khi đã ngừng nhận kết nối mới và trước khi chờ các request đang chạy
+    app[STATE].draining = True
+    log_event("service_draining", in_flight=app[STATE].in_flight)
+
+
+async def _on_cleanup(app):
+    # Các request đã xong (hoặc hết shutdown_timeout): ghi nốt hàng đợi tự học rồi đóng các client
+    bot = app.get(BOT)
+    if bot is not None:
+        await asyncio.to_thread(bot.learning_queue.close, SERVICE_SHUTDOWN_TIMEOUT)
+    await aclose_async_clients()
+    close_clients()
+    app[STATE].executor.shutdown(wait=False, cancel_futures=True)
+    log_event("service_stopped")
+
+
+def create_app(bot=None, api_keys=None, limits=None, max_concurrency=SERVICE_MAX_CONCURRENCY):
+    """Tạo ứng dụng aiohttp; bot=None thì Chatbot được tạo khi dịch vụ khởi động."""
+    app = web.Application()
+    app[STATE] = ServiceState(parse_api_keys(SERVICE_API_KEYS) if api_keys is None else api_keys,
+                              limits or ClientLimits(), max_concurrency)
+    if bot is not None:
+        app[BOT] = bot
+    app.router.add_post("/ask", handle_ask)
+    app.router.add_post("/stream", handle_stream)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    app.on_startup.append(_on_startup)
+    app.on_shutdown.append(_on_shutdown)
+    app.on_cleanup.append(_on_cleanup)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dịch vụ HTTP/SSE của ISTQB Chatbot")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    args = parser.parse_args()
+    # SIGINT/SIGTERM: ngừng nhận kết nối, chờ các request đang chạy (tối đa shutdown_timeout) rồi dọn dẹp
+    web.run_app(create_app(), host=args.host, port=args.port, shutdown_timeout=SERVICE_SHUTDOWN_TIMEOUT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import json
+import os
+
+from src.clients import get_http_client
+
+# Địa chỉ của dịch vụ HTTP/SSE (src/service.py); để trống thì trang Streamlit tự tạo Chatbot
+CHATBOT_SERVICE_URL = os.environ.get("CHATBOT_SERVICE_URL", "").rstrip("/")
+CHATBOT_SERVICE_API_KEY = os.environ.get("CHATBOT_SERVICE_API_KEY")
+
+
+class ChatServiceError(Exception):
+    pass
+
+
+class ChatServiceClient:
+    """
+    Gọi dịch vụ chatbot qua HTTP thay vì tạo Chatbot trong tiến trình hiện tại.
+    Dùng pool connection và chính sách thử lại chung (src.clients, dịch vụ "chatbot").
+    """
+
+    def __init__(self, base_url=CHATBOT_SERVICE_URL, api_key=CHATBOT_SERVICE_API_KEY, client_id="streamlit"):
+        self.base_url = base_url.rstrip("/")
+        self.http = get_http_client("chatbot")
+        self.headers = {"X-Client-Id": client_id}
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+
+    def ask(self, question):
+        """Câu trả lời đầy đủ: {"answer", "sources", "language", "trace_id"}."""
+        response = self.http.post(f"{self.base_url}/ask", json={"question": question}, headers=self.headers)
+        _raise_for_status(response)
+        return response.json()
+
+    def stream(self, question):
+        """
+        Giống Chatbot.stream_in_syllabus: trả về {"stream": generator các token, "sources": [...],
+        "language", "trace_id"} ngay khi dịch vụ gửi sự kiện "meta"; "sources" được cập nhật theo sự kiện
+        "done" khi stream xong.
+        """
+        request = self.http.build_request("POST", f"{self.base_url}/stream", json={"question": question},
+                                          headers=self.headers)
+        response = self.http.send(request, stream=True)
+        try:
+            if response.status_code >= 400:
+                response.read()
+                _raise_for_status(response)
+            events = _iter_events(response)
+            event, meta = next(events, ("error", {"error": "Dịch vụ đóng kết nối trước khi trả lời"}))
+            if event != "meta":
+                raise ChatServiceError(meta.get("error", f"Sự kiện không mong đợi: {event}"))
+        except BaseException:
+            response.close()
+            raise
+
+        def tokens():
+            try:
+                for event, data in events:
+                    if event == "token":
+                        yield data["text"]
+                    elif event == "error":
+                        raise ChatServiceError(data.get("error"))
+                    elif event == "done":
+                        result["sources"] = data.get("sources", result.get("sources", []))
+                        return
+            finally:
+                response.close()
+
+        result = dict(meta)
+        result["stream"] = tokens()
+        return result
+
+
+def _raise_for_status(response):
+    if response.status_code < 400:
+        return
+    try:
+        message = response.json().get("error")
+    except ValueError:
+        message = response.text
+    raise ChatServiceError(f"{response.status_code}: {message}")
+
+
+def _iter_events(response):
+    """Phân tích text/event-stream thành các cặp (event, data JSON)."""
+    event, data = "message", []
+    for line in response.iter_lines():
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].lstrip())
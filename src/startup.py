@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from src.telemetry import log_event, telemetry as default_telemetry
+
+# Khởi động nóng sau khi tạo Chatbot: nạp trước hồ sơ ngôn ngữ, tokenizer, chỉ mục và mở connection
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "true").lower() == "true"
+
+
+class StartupReport:
+    """
+    Thời gian khởi động của tiến trình: các mốc (giây kể từ lúc module này được import, ví dụ
+    "ui_ready" = time-to-interactive, "backend_ready") và thời lượng từng bước khởi tạo.
+    Mỗi mốc/bước được ghi log và vào histogram startup_seconds để so sánh giữa các lần triển khai.
+    """
+
+    def __init__(self, telemetry=None, started_at=None):
+        self.telemetry = telemetry or default_telemetry
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self.marks = {}
+        self.phases = []
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    def mark(self, name):
+        """Ghi một mốc (chỉ lần đầu tiên, các lần sau trả về giá trị đã ghi)."""
+        with self._lock:
+            if name in self.marks:
+                return self.marks[name]
+            seconds = self.marks[name] = self.elapsed()
+        self.telemetry.observe("startup_seconds", seconds, mark=name)
+        log_event("startup_mark", mark=name, seconds=round(seconds, 3))
+        return seconds
+
+    @contextmanager
+    def phase(self, name):
+        """Đo thời lượng một bước khởi tạo; lỗi được ghi vào báo cáo rồi ném lại."""
+        started_at = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            seconds = time.perf_counter() - started_at
+            with self._lock:
+                self.phases.append({"phase": name, "seconds": round(seconds, 6), "error": error})
+            self.telemetry.observe("startup_phase_seconds", seconds, phase=name)
+
+    def summary(self):
+        with self._lock:
+            return {
+                "marks": {name: round(seconds, 3) for name, seconds in self.marks.items()},
+                "phases": list(self.phases),
+            }
+
+    def log(self):
+        log_event("startup", **self.summary())
+
+
+# Báo cáo khởi động của tiến trình (mốc 0 là lần import đầu tiên)
+startup = StartupReport()
+
+
+def start_in_background(fn, name="startup"):
+    """Chạy fn trên một luồng nền; trả về Future để giao diện chỉ chờ khi thật sự cần kết quả."""
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return future
+
+
+async def _ahead(service, url):
+    # Client async phải được lấy trên chính loop sẽ dùng nó
+    from src.clients import get_async_http_client
+    return await get_async_http_client(service).head(url)
+
+
+def warm_up(bot, run_async=None, report=None):
+    """
+    Khởi động nóng sau khi tạo Chatbot, để lượt hỏi đầu tiên không phải trả các chi phí một lần:
+    hồ sơ ngôn ngữ của langdetect, tokenizer, chỉ mục BM25, danh sách câu đã duyệt (mở luôn
+    connection tới Supabase) và connection tới OpenAI. run_async(coro) chạy coroutine trên event
+    loop của client async (connection async gắn với loop đó). Lỗi ở một bước chỉ được ghi log.
+    """
+    from src.clients import get_http_client, get_openai_client
+    from src.context_builder import count_tokens
+    from src.language_utils import preload_language_profiles
+
+    report = report or startup
+    # HEAD tới API của OpenAI: chỉ cần mở connection (TCP/TLS), mã trạng thái không quan trọng
+    openai_url = str(get_openai_client().base_url)
+    steps = [
+        ("warm_language", preload_language_profiles),
+        ("warm_tokenizer", lambda: count_tokens("warm up")),
+        ("warm_lexical_index", bot.lexical_index.reload_if_changed),
+        ("warm_approved_qa", bot.approved_qa.preload),
+        ("warm_openai", lambda: get_http_client("openai").head(openai_url)),
+    ]
+    if run_async is not None:
+        steps.append(("warm_openai_async", lambda: run_async(_ahead("openai", openai_url))))
+
+    for name, step in steps:
+        try:
+            with report.phase(name):
+                step()
+        except Exception as e:
+            log_event("startup_warmup_failed", logging.WARNING, phase=name, error=str(e))
+    report.mark("warm")
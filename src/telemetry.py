@@ -0,0 +1,280 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+
+LOG_LEVEL = os.environ.get("CHATBOT_LOG_LEVEL", "INFO").upper()
+TELEMETRY_RECENT_TURNS = int(os.environ.get("TELEMETRY_RECENT_TURNS", "50"))
+METRIC_PREFIX = "istqb_chatbot"
+# Các mốc (giây) của histogram thời gian
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger("istqb_chatbot")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+# Lượt hỏi đang xử lý trong luồng/task hiện tại
+_current_turn = contextvars.ContextVar("istqb_chatbot_turn", default=None)
+
+
+def current_turn():
+    return _current_turn.get()
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """Ghi một dòng log JSON có cấu trúc, kèm trace_id của lượt hỏi hiện tại (nếu có)."""
+    if not logger.isEnabledFor(level):
+        return
+    record = {"ts": round(time.time(), 3), "level": logging.getLevelName(level), "event": event}
+    turn = _current_turn.get()
+    if turn is not None:
+        record["trace_id"] = turn.trace_id
+    record.update(fields)
+    logger.log(level, json.dumps(record, ensure_ascii=False, default=str))
+
+
+class Turn:
+    """Thông tin của một lượt hỏi: trace ID, thời gian từng bước, token và các thuộc tính (ngôn ngữ, nhánh...)."""
+
+    def __init__(self, question):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.question = question
+        self.started_at = time.time()
+        self.duration = None
+        self.stages = []
+        self.tokens = Counter()
+        self.attributes = {}
+        self.error = None
+
+    def summary(self):
+        return {
+            "trace_id": self.trace_id,
+            "question": self.question[:120],
+            "started_at": round(self.started_at, 3),
+            "duration": round(self.duration or 0.0, 6),
+            "stages": [{"stage": name, "seconds": round(seconds, 6)} for name, seconds in self.stages],
+            "tokens": dict(self.tokens),
+            "error": self.error,
+            **self.attributes,
+        }
+
+
+class Telemetry:
+    """
+    Bộ đo dùng chung: counter, histogram thời gian theo bước, các lượt hỏi gần đây
+    và hook mở rộng (mỗi hook nhận một dict sự kiện "stage" hoặc "turn").
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, recent_turns=TELEMETRY_RECENT_TURNS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self._histograms = {}
+        self._recent = deque(maxlen=recent_turns)
+        self._hooks = []
+
+    # --- Hook ---
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        if hook in self._hooks:
+            self._hooks.remove(hook)
+
+    def _emit(self, event):
+        for hook in list(self._hooks):
+            try:
+                hook(event)
+            except Exception as e:
+                log_event("telemetry_hook_error", logging.WARNING, error=str(e))
+
+    # --- Counter và histogram ---
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def counter_values(self, name):
+        """{nhãn (tuple): giá trị} của một counter."""
+        with self._lock:
+            return {labels: value for (metric, labels), value in self._counters.items() if metric == name}
+
+    def add_tokens(self, stage, prompt=0, completion=0):
+        if prompt:
+            self.count("tokens_total", prompt, stage=stage, kind="prompt")
+        if completion:
+            self.count("tokens_total", completion, stage=stage, kind="completion")
+        turn = _current_turn.get()
+        if turn is not None:
+            turn.tokens["prompt"] += prompt
+            turn.tokens["completion"] += completion
+
+    def record_context(self, context_tokens, saved_tokens):
+        """Số token ngữ cảnh đã gửi và số token tiết kiệm được so với việc nối nguyên các chunk."""
+        self.count("context_tokens_total", context_tokens, kind="sent")
+        self.count("context_tokens_total", saved_tokens, kind="saved")
+        turn = _current_turn.get()
+        if turn is not None:
+            turn.tokens["context_saved"] += saved_tokens
+
+    def record_cache(self, cache, hit):
+        self.count("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+    # --- Đo thời gian ---
+    def _record_stage(self, name, seconds, error=None):
+        self.observe("stage_duration_seconds", seconds, stage=name)
+        turn = _current_turn.get()
+        if turn is not None:
+            turn.stages.append((name, seconds))
+        if self._hooks:
+            self._emit({"type": "stage", "stage": name, "seconds": seconds, "error": error,
+                        "trace_id": turn.trace_id if turn else None})
+
+    @contextmanager
+    def stage(self, name):
+        """Đo thời gian một bước; lỗi được đếm vào errors_total rồi ném lại."""
+        started_at = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = type(e).__name__
+            self.count("errors_total", stage=name)
+            raise
+        finally:
+            self._record_stage(name, time.perf_counter() - started_at, error)
+
+    def timed_stream(self, name, chunks, started_at=None):
+        """Bọc một generator: bước kết thúc khi stream chạy hết (hoặc bị đóng sớm)."""
+        started_at = time.perf_counter() if started_at is None else started_at
+        error = None
+        try:
+            yield from chunks
+        except Exception as e:
+            error = type(e).__name__
+            self.count("errors_total", stage=name)
+            raise
+        finally:
+            self._record_stage(name, time.perf_counter() - started_at, error)
+
+    # --- Lượt hỏi ---
+    @contextmanager
+    def turn(self, question, **attributes):
+        """
+        Mở một lượt hỏi mới (trace ID riêng) cho luồng/task hiện tại.
+        Khi kết thúc: ghi histogram, counter turns_total và một dòng log có cấu trúc.
+        """
+        turn = Turn(question)
+        turn.attributes.update(attributes)
+        token = _current_turn.set(turn)
+        started_at = time.perf_counter()
+        try:
+            yield turn
+        except Exception as e:
+            turn.error = f"{type(e).__name__}: {e}"
+            self.count("errors_total", stage="turn")
+            raise
+        finally:
+            _current_turn.reset(token)
+            turn.duration = time.perf_counter() - started_at
+            self.observe("turn_duration_seconds", turn.duration)
+            self.count("turns_total", path=turn.attributes.get("path", "unknown"),
+                       language=turn.attributes.get("language", "unknown"))
+            summary = turn.summary()
+            with self._lock:
+                self._recent.appendleft(summary)
+            log_event("turn", **summary)
+            if self._hooks:
+                self._emit({"type": "turn", **summary})
+
+    def annotate(self, **attributes):
+        """Gắn thuộc tính (ngôn ngữ, nhánh trả lời...) vào lượt hỏi hiện tại."""
+        turn = _current_turn.get()
+        if turn is not None:
+            turn.attributes.update(attributes)
+
+    def recent_turns(self, limit=None):
+        with self._lock:
+            turns = list(self._recent)
+        return turns[:limit] if limit else turns
+
+    # --- Xuất số liệu ---
+    def summary(self):
+        """Các chỉ số tổng hợp cho giao diện: số lượt, tỉ lệ dự phòng, tỉ lệ trúng cache, token, lỗi."""
+        context = self.counter_values("context_tokens_total")
+        turns = self.counter_values("turns_total")
+        total_turns = sum(turns.values())
+        fallback_turns = sum(value for labels, value in turns.items() if ("path", "fallback") in labels)
+        cache = self.counter_values("cache_requests_total")
+        cache_total = sum(cache.values())
+        cache_hits = sum(value for labels, value in cache.items() if ("result", "hit") in labels)
+        return {
+            "turns": total_turns,
+            "fallback_rate": fallback_turns / total_turns if total_turns else 0.0,
+            "cache_hit_rate": cache_hits / cache_total if cache_total else 0.0,
+            "tokens": sum(self.counter_values("tokens_total").values()),
+            "context_tokens_saved": sum(value for labels, value in context.items() if ("kind", "saved") in labels),
+            "errors": sum(self.counter_values("errors_total").values()),
+        }
+
+    def render_prometheus(self):
+        """Xuất counter và histogram theo định dạng text của Prometheus."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, dict(value, buckets=list(value["buckets"])))
+                                for key, value in self._histograms.items())
+
+        lines, typed = [], set()
+        for (name, labels), value in counters:
+            metric = f"{METRIC_PREFIX}_{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(labels)} {_number(value)}")
+        for (name, labels), histogram in histograms:
+            metric = f"{METRIC_PREFIX}_{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            for bound, count in zip(self.buckets, histogram["buckets"]):
+                lines.append(f"{metric}_bucket{_labels(labels + (('le', _number(bound)),))} {count}")
+            lines.append(f"{metric}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{metric}_sum{_labels(labels)} {_number(histogram['sum'])}")
+            lines.append(f"{metric}_count{_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Bộ đo mặc định dùng chung trong tiến trình
+telemetry = Telemetry()
@@ -0,0 +1,84 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from src.answer_cache import CACHE_DIR
+
+TRANSLATION_MEMORY_PATH = os.environ.get("TRANSLATION_MEMORY_PATH", os.path.join(CACHE_DIR, "translations.sqlite3"))
+
+
+def normalize_text(text):
+    """Chuẩn hoá văn bản làm khoá: NFKC, gộp khoảng trắng (giữ nguyên chữ hoa/thường)."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text or "")).strip()
+
+
+class TranslationMemory:
+    """
+    Bộ nhớ dịch lưu bền trong SQLite, khoá theo (văn bản đã chuẩn hoá, ngôn ngữ đích),
+    với một lớp LRU trong bộ nhớ phía trước để tra cứu không cần đụng tới đĩa.
+    """
+
+    def __init__(self, path=TRANSLATION_MEMORY_PATH, max_entries=2048):
+        self.path = path
+        self.max_entries = max_entries
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            " source_hash TEXT NOT NULL,"
+            " target_language TEXT NOT NULL,"
+            " source_text TEXT NOT NULL,"
+            " translation TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (source_hash, target_language))"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _key(text, target_language):
+        normalized = normalize_text(text)
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest(), target_language.strip().lower()
+
+    def get(self, text, target_language):
+        """Trả về bản dịch đã lưu hoặc None."""
+        key = self._key(text, target_language)
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return self._lru[key]
+            row = self._conn.execute(
+                "SELECT translation FROM translations WHERE source_hash = ? AND target_language = ?", key
+            ).fetchone()
+            if row is None:
+                return None
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, text, target_language, translation):
+        key = self._key(text, target_language)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+                (*key, normalize_text(text), translation, time.time()),
+            )
+            self._conn.commit()
+            self._remember(key, translation)
+
+    def _remember(self, key, translation):
+        self._lru[key] = translation
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]